@@ -2,6 +2,14 @@
 # 檔案名稱: app.py
 # 
 # 修改歷程:
+# 2026-10-17 23:40:00: [Refactor] 技術指標只寫入共用快取，移除 session_state["ta_data"] (各頁面直接讀快取)
+# 2026-10-17 15:00:00: [Perf] 戰情室改用 logic.summarize_ledger 一次取得庫存與帳戶餘額
+# 2026-10-17 12:00:00: [Perf] 載入後於背景預熱庫存與自選股的技術指標快取 (低優先序)
+# 2026-10-17 10:00:00: [Perf] 盤中自動更新改讀 WebSocket 串流看板的最新價 (每5秒，不呼叫 API)
+# 2026-10-16 19:00:00: [Update] 更新股價時列出報價失敗的股票
+# 2026-10-16 16:00:00: [Perf] 資產趨勢圖新增區間選擇，只讀取區間內的歷史紀錄
+# 2026-10-16 15:00:00: [UI] 側邊欄顯示背景同步狀態 (待寫入 / 已同步 / 錯誤)
+# 2026-10-16 12:00:00: [Perf] 頁面啟動改用 database.load_all 一次取回所有工作表
 # 2025-11-27 13:45:00: [UI] 優化首頁 UX (行動版更新按鈕、台股紅漲綠跌 Metric、Toast 回饋)
 # 2025-11-24 16:45:00: [UI] 將戰情室控制台移回 Sidebar；移除主畫面 Container
 # ==============================================================================
@@ -22,13 +30,24 @@ st.set_page_config(page_title="股票資產戰情室", layout="wide", page_icon=
 # 1. 初始化
 if "realtime_prices" not in st.session_state: st.session_state["realtime_prices"] = {}
 if "price_update_time" not in st.session_state: st.session_state["price_update_time"] = None
-if "ta_data" not in st.session_state: st.session_state["ta_data"] = {}
 
+# 一次取回所有工作表 (單一 API 往返)
 try:
-    df_raw = database.load_data()
+    all_data = database.load_all()
+    df_raw = all_data["ledger"]
 except:
+    all_data = {}
     df_raw = pd.DataFrame()
 
+# 背景預熱庫存 + 自選股的技術指標 (低優先序，不搶報價請求的額度；結果所有頁面共用)
+try:
+    warm_list = logic.calculate_fifo_report(df_raw)['股票代號'].astype(str).unique().tolist() if not df_raw.empty else []
+    df_watch = all_data.get("watchlist", pd.DataFrame())
+    if '股票代號' in df_watch.columns: warm_list += df_watch['股票代號'].astype(str).str.strip().tolist()
+    market_data.start_ta_warmup(warm_list)
+except Exception:
+    pass
+
 # ==============================================================================
 # 2. 側邊欄 (保留導航與被動資訊，主動操作移至主畫面)
 # ==============================================================================
@@ -44,6 +63,17 @@ with st.sidebar:
     else:
         st.caption("🕒 尚未更新 (顯示庫存成本)")
 
+    # 背景寫入 Google Sheets 的同步狀態
+    try:
+        journal = database.get_journal_status()
+        if journal["pending"]:
+            st.caption(f"⏳ {journal['pending']} 筆資料等待同步至 Google Sheets")
+        else:
+            st.caption("☁️ 所有資料已同步")
+        if journal["last_error"]: st.caption(f"⚠️ 同步重試中: {journal['last_error']}")
+    except Exception:
+        pass
+
 # ==============================================================================
 # 3. 主畫面 Dashboard
 # ==============================================================================
@@ -68,14 +98,15 @@ with col_btn:
                 with st.status("🚀 連線交易所主機中...", expanded=True) as status:
                     st.write("1. 正在抓取即時報價 (Fugle API)...")
                     prices = market_data.get_realtime_prices(stock_ids)
+                    failed = getattr(prices, "errors", {})
+                    if failed: st.write("⚠️ 報價失敗: " + ", ".join(f"{s} ({e})" for s, e in failed.items()))
                     
                     st.write("2. 計算技術指標 (均線/量能)...")
-                    ta_data = market_data.get_batch_technical_analysis(stock_ids)
+                    market_data.get_batch_technical_analysis(stock_ids)  # 寫入共用快取，各頁面直接讀取
                     
                     status.update(label="✅ 資料更新完成！", state="complete", expanded=False)
                 
                 st.session_state["realtime_prices"] = prices
-                st.session_state["ta_data"] = ta_data
                 tw_time = datetime.utcnow() + timedelta(hours=8)
                 st.session_state["price_update_time"] = tw_time.strftime("%Y-%m-%d %H:%M:%S")
                 
@@ -86,15 +117,24 @@ with col_btn:
             else:
                 st.toast("目前無庫存可更新", icon="ℹ️")
 
-# Dashboard Fragment
-@st.fragment(run_every=60)
+# Dashboard Fragment (串流報價啟用時讀看板，刷新不消耗 API 額度)
+DASHBOARD_REFRESH = 5 if market_data.get_quote_stream() is not None else 60
+
+@st.fragment(run_every=DASHBOARD_REFRESH)
 def render_dashboard(df_raw, auto_refresh=False):
     # 計算
-    acc_balances = logic.calculate_account_balances(df_raw)
+    ledger = logic.summarize_ledger(df_raw)
+    acc_balances = ledger.balances
     total_cash = sum(acc_balances.values())
     
-    df_fifo = logic.calculate_fifo_report(df_raw)
+    df_fifo = ledger.holdings
     current_prices = st.session_state.get("realtime_prices", {})
+    if auto_refresh and not df_fifo.empty:
+        live_prices = market_data.get_board_prices(df_fifo['股票代號'].unique().tolist())
+        if live_prices:
+            current_prices = {**current_prices, **live_prices}
+            st.session_state["realtime_prices"] = current_prices
+            st.session_state["price_update_time"] = (datetime.utcnow() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")
     df_unrealized = logic.calculate_unrealized_pnl(df_fifo, current_prices)
     
     total_market_value = df_unrealized['股票市值'].sum() if not df_unrealized.empty else 0
@@ -140,11 +180,15 @@ def render_dashboard(df_raw, auto_refresh=False):
              try:
                 today_tw = (datetime.utcnow() + timedelta(hours=8)).date()
                 database.save_asset_history(today_tw, int(total_assets), int(total_cash), int(total_market_value))
-                st.toast(f"✅ 已記錄今日資產: ${total_assets:,}", icon="💾")
+                st.toast(f"✅ 已記錄今日資產: ${total_assets:,} (背景同步中)", icon="💾")
              except Exception as e:
                 st.toast(f"❌ 記錄失敗: {e}", icon="⚠️")
 
-    df_history = database.load_asset_history()
+    # 只顯示選定區間的歷史紀錄 (由已快取的整表篩選)
+    trend_period = st.radio("區間", ["近3個月", "近1年", "全部"], index=1, horizontal=True, label_visibility="collapsed")
+    today_tw = (datetime.utcnow() + timedelta(hours=8)).date()
+    trend_start = {"近3個月": today_tw - timedelta(days=92), "近1年": today_tw - timedelta(days=366)}.get(trend_period)
+    df_history = database.load_asset_history(start=trend_start)
     if not df_history.empty:
         df_history['日期'] = pd.to_datetime(df_history['日期'])
         df_history = df_history.sort_values('日期').drop_duplicates(subset=['日期'], keep='last')
@@ -203,5 +247,5 @@ if df_raw.empty:
     st.info("目前沒有任何交易資料，請前往「帳務管理」頁面新增第一筆交易。")
 else:
     col_toggle, _ = st.columns([2, 8])
-    auto_refresh_on = col_toggle.toggle("啟用盤中自動更新 (每60秒)", value=False)
+    auto_refresh_on = col_toggle.toggle(f"啟用盤中自動更新 (每{DASHBOARD_REFRESH}秒)", value=False)
     render_dashboard(df_raw, auto_refresh=auto_refresh_on)
@@ -0,0 +1,106 @@
+# ==============================================================================
+# 檔案名稱: benchmark.py
+#
+# 修改歷程:
+# 2026-10-17 23:00:00: [Fix] 模擬資料改用正式欄位 (交易紀錄 15 欄、帳戶折數、mp_table、自選股)；新增 summarize_ledger 計時
+# 2026-10-16 18:00:00: [New] 資料層壓力測試：以本地記憶體後端模擬 Google Sheets 延遲/配額，量測讀取、寫入與同步耗時
+# ==============================================================================
+# 用法: python benchmark.py --rows 5000 --latency 0.3 --quota 60 --writes 50
+# 預設使用暫存目錄當本地快取 (可用 STOCK_APP_CACHE_DIR 指定)，不會動到正式的本地鏡像
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+LEDGER_HEADER = ['交易ID', '交易日期', '股票代號', '股票名稱', '交易類別', '股數', '單價', '手續費', '交易稅',
+                 '其他費用', '成交總金額', '總費用', '淨收付金額', '交易帳戶', '備註']   # 同 database._build_row 順序
+ACCOUNTS = {'永豐': 0.6, '國泰': 0.28}
+
+def _synthetic_sheets(n_rows, seed=0):
+    """與正式試算表相同欄位的模擬資料 (交易紀錄 15 欄，費用依 logic.calculate_fees_batch 計算)"""
+    import logic
+    rng = random.Random(seed)
+    symbols = [f"{2300 + i}" for i in range(50)] + ["0050", "00878"]
+    names = {s: f"股票{s}" for s in symbols}
+    days = [f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" for _ in range(n_rows)]
+    sids = [rng.choice(symbols) for _ in range(n_rows)]
+    actions = [rng.choice(['買進', '買進', '賣出', '現金股利', '入金']) for _ in range(n_rows)]
+    accounts = [rng.choice(list(ACCOUNTS)) for _ in range(n_rows)]
+    qtys = [1 if a == '入金' else rng.choice([rng.randint(1, 20) * 1000, rng.randint(1, 999)]) for a in actions]
+    prices = [rng.randint(10, 50) * 10000 if a == '入金' else round(rng.uniform(10, 900), 2) for a in actions]
+    fees = logic.calculate_fees_batch(qtys, prices, actions, [ACCOUNTS[a] for a in accounts], sids)
+
+    ledger = [LEDGER_HEADER]
+    for i in range(n_rows):
+        cash = actions[i] == '入金'
+        ledger.append([
+            f"TXN-{i:08X}", days[i], "" if cash else sids[i], "" if cash else names[sids[i]], actions[i],
+            str(qtys[i]), str(prices[i]), str(fees['commission'][i]), str(fees['tax'][i]), str(fees['other_fees'][i]),
+            str(fees['gross_amount'][i]), str(fees['total_fees'][i]), str(fees['net_cash_flow'][i]), accounts[i], ""
+        ])
+    return {
+        '交易紀錄': ledger,
+        'INDEX': [['Symbol', 'Name']] + [[s, names[s]] for s in symbols],
+        '交割帳戶設定': [['帳戶名稱', '手續費折數', '最低手續費']] + [[a, str(d), '1'] for a, d in ACCOUNTS.items()],
+        '資產歷史紀錄': [['日期', '總資產', '現金', '股票市值']],
+        '自選股清單': [['群組', '股票代號', '股票名稱', '警示價_高', '警示價_低', '備註']]
+                      + [['觀察', s, names[s], '', '', ''] for s in symbols[:10]],
+        'mp_table': [['時間點迄 (HH:MM)', '量能倍數'], ['09:30', '4.0'], ['11:00', '2.0'], ['13:30', '1.0']],
+    }
+
+def _timed(label, fn, results):
+    t0 = time.perf_counter()
+    out = fn()
+    results.append((label, time.perf_counter() - t0))
+    return out
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="資料層壓力測試 (本地模擬後端)")
+    parser.add_argument("--rows", type=int, default=2000, help="交易紀錄列數")
+    parser.add_argument("--latency", type=float, default=0.2, help="每次呼叫延遲 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="額外隨機延遲上限 (秒)")
+    parser.add_argument("--quota", type=int, default=60, help="每分鐘呼叫上限 (0 表示不限制)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="隨機逾時機率")
+    parser.add_argument("--writes", type=int, default=20, help="連續寫入筆數")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("STOCK_APP_CACHE_DIR", tempfile.mkdtemp(prefix="stock_app_bench_"))
+    import storage
+    import database
+    import logic
+
+    backend = storage.MemoryBackend(
+        sheets=_synthetic_sheets(args.rows), latency=args.latency, jitter=args.jitter,
+        quota_per_minute=args.quota or None, error_rate=args.error_rate, seed=0
+    )
+    database.set_backend(backend)
+    results = []
+
+    all_data = _timed("load_all (冷啟動，完整同步)", database.load_all, results)
+    _timed("load_all (熱快取)", database.load_all, results)
+    ledger = all_data["ledger"]
+    _timed("summarize_ledger (整本重建)", lambda: logic.summarize_ledger(ledger, engine=logic.LedgerEngine()), results)
+    _timed("summarize_ledger (共用引擎，首次)", lambda: logic.summarize_ledger(ledger), results)
+    _timed("summarize_ledger (共用引擎，無變動)", lambda: logic.summarize_ledger(ledger), results)
+    for i in range(args.writes):
+        database.save_transaction("2024-12-31", "2330", "股票2330", "買進", 1000, 600.0, "永豐", f"bench {i}", ACCOUNTS['永豐'])
+    results.append((f"save_transaction x{args.writes} (僅寫入日誌)", None))
+    _timed("flush_journal", database.flush_journal, results)
+    all_data = _timed("load_all (寫入後)", database.load_all, results)
+    _timed(f"summarize_ledger (增量套用 {args.writes} 筆)", lambda: logic.summarize_ledger(all_data["ledger"]), results)
+    database.save_asset_history("2024-12-31", 1000000, 900000, 100000)
+    _timed("save_asset_history + flush", database.flush_journal, results)
+
+    print(f"rows={args.rows} latency={args.latency}s±{args.jitter}s quota={args.quota}/min")
+    for label, sec in results:
+        print(f"  {label:<40} {'-' if sec is None else f'{sec * 1000:9.1f} ms'}")
+    print(f"  backend stats: {backend.stats}")
+    print(f"  journal: {database.get_journal_status()}")
+    print(f"  ledger engine: {logic.get_ledger_engine_stats()}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
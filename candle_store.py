@@ -0,0 +1,148 @@
+# ==============================================================================
+# 檔案名稱: candle_store.py
+#
+# 修改歷程:
+# 2026-10-16 22:00:00: [New] 本地日K線庫 (SQLite)：記錄每檔股票已下載的日期區間，只補抓缺少的區段，斷線時仍可讀取已存資料
+# 2026-10-17 09:00:00: [New] 每檔滾動指標狀態 (indicator_state) 與K線一併存放，新K線入庫時增量推進
+# 2026-10-17 11:00:00: [New] 技術分析結果快取 (ta_cache)，以最近完成交易日為鍵，跨 process 重啟沿用
+# ==============================================================================
+
+import json
+from datetime import date, timedelta
+
+import pandas as pd
+
+import local_store
+from indicator_state import RollingIndicators
+
+# --- 常數設定 ---
+CANDLE_DB = 'candles.db'
+CANDLE_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+def _init(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS candles ("
+        "symbol TEXT NOT NULL, date TEXT NOT NULL, open REAL, high REAL, low REAL, close REAL, volume INTEGER, "
+        "PRIMARY KEY (symbol, date))"
+    )
+    # 已下載過的連續日期區間 (含休市日)，區間內查無資料代表當天沒有交易，不需要再抓
+    conn.execute("CREATE TABLE IF NOT EXISTS candle_coverage (symbol TEXT PRIMARY KEY, from_date TEXT, to_date TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS indicator_state (symbol TEXT PRIMARY KEY, last_date TEXT, data TEXT NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS ta_cache (symbol TEXT PRIMARY KEY, day TEXT NOT NULL, computed_at REAL, data TEXT NOT NULL)")
+
+def _shift(day_str, days):
+    return (date.fromisoformat(day_str) + timedelta(days=days)).isoformat()
+
+def get_coverage(symbol):
+    """回傳 (起日, 迄日)；尚未下載過回傳 None"""
+    with local_store.connect(CANDLE_DB) as conn:
+        _init(conn)
+        row = conn.execute("SELECT from_date, to_date FROM candle_coverage WHERE symbol = ?", (symbol,)).fetchone()
+    return tuple(row) if row else None
+
+def missing_ranges(symbol, from_date, to_date):
+    """
+    回傳需要向 API 抓取的日期區間 list of (起日, 迄日)
+    已存區間維持連續：要求範圍在已存區間之前或之後的部分各補一段 (中間不會有缺口)
+    """
+    coverage = get_coverage(symbol)
+    if not coverage: return [(from_date, to_date)]
+    cov_from, cov_to = coverage
+    ranges = []
+    if from_date < cov_from: ranges.append((from_date, _shift(cov_from, -1)))
+    if to_date > cov_to: ranges.append((_shift(cov_to, 1), to_date))
+    return ranges
+
+def save_candles(symbol, candles, from_date, to_date):
+    """
+    存入 [from_date, to_date] 區間下載到的K線 (list of dict，含 date/open/high/low/close/volume)
+    並把該區間併入已存區間；只應傳入已收盤的日期 (盤中K線不入庫)
+    """
+    rows = [
+        (symbol, str(c['date'])[:10], *[c.get(f) for f in CANDLE_FIELDS])
+        for c in candles if from_date <= str(c['date'])[:10] <= to_date
+    ]
+    with local_store.write_lock, local_store.connect(CANDLE_DB) as conn:
+        _init(conn)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO candles (symbol, date, {', '.join(CANDLE_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        if rows: _advance_indicator_state(conn, symbol, min(r[1] for r in rows))
+        row = conn.execute("SELECT from_date, to_date FROM candle_coverage WHERE symbol = ?", (symbol,)).fetchone()
+        if row and from_date <= _shift(row[1], 1) and to_date >= _shift(row[0], -1):
+            from_date, to_date = min(from_date, row[0]), max(to_date, row[1])
+        elif row and row[1] > to_date:
+            # 與既有區間不相連且較舊：保留較新的區間 (下次會再補中間缺口)
+            return
+        conn.execute("INSERT OR REPLACE INTO candle_coverage (symbol, from_date, to_date) VALUES (?, ?, ?)",
+                     (symbol, from_date, to_date))
+
+def load_candles(symbol, from_date, to_date):
+    """讀取本地K線，回傳依日期排序的 DataFrame (date 為 datetime)"""
+    with local_store.connect(CANDLE_DB) as conn:
+        _init(conn)
+        df = pd.read_sql_query(
+            f"SELECT date, {', '.join(CANDLE_FIELDS)} FROM candles WHERE symbol = ? AND date BETWEEN ? AND ? ORDER BY date",
+            conn, params=(symbol, from_date, to_date)
+        )
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+# --- 滾動指標狀態 ---
+def _advance_indicator_state(conn, symbol, earliest_saved):
+    """
+    新K線都在狀態最後日期之後：逐根 push (每根 O(1))
+    狀態不存在或回補了較舊的K線：以最近 60 根重建
+    """
+    row = conn.execute("SELECT data FROM indicator_state WHERE symbol = ?", (symbol,)).fetchone()
+    state = RollingIndicators.from_dict(json.loads(row[0])) if row else None
+    if state is None or state.last_date is None or earliest_saved <= state.last_date:
+        state = RollingIndicators()
+        bars = conn.execute(
+            "SELECT date, close, volume FROM candles WHERE symbol = ? ORDER BY date DESC LIMIT ?",
+            (symbol, state.closes.capacity)
+        ).fetchall()[::-1]
+    else:
+        bars = conn.execute(
+            "SELECT date, close, volume FROM candles WHERE symbol = ? AND date > ? ORDER BY date",
+            (symbol, state.last_date)
+        ).fetchall()
+    for d, close, volume in bars: state.push(d, close, volume)
+    conn.execute("INSERT OR REPLACE INTO indicator_state (symbol, last_date, data) VALUES (?, ?, ?)",
+                 (symbol, state.last_date, json.dumps(state.to_dict())))
+
+def load_indicator_states(symbols):
+    """一次讀取多檔的滾動指標狀態，回傳 {symbol: RollingIndicators} (沒有K線的股票不在結果中)"""
+    symbols = list(symbols)
+    if not symbols: return {}
+    with local_store.connect(CANDLE_DB) as conn:
+        _init(conn)
+        marks = ",".join("?" * len(symbols))
+        rows = conn.execute(f"SELECT symbol, data FROM indicator_state WHERE symbol IN ({marks})", symbols).fetchall()
+    return {symbol: RollingIndicators.from_dict(json.loads(data)) for symbol, data in rows}
+
+# --- 技術分析結果快取 ---
+def _json_default(value):
+    return value.item() if hasattr(value, "item") else str(value)
+
+def load_ta_cache(symbols, day):
+    """回傳 {symbol: (TA dict, 計算時間)}，只取 day 當天的結果"""
+    symbols = list(symbols)
+    if not symbols: return {}
+    with local_store.connect(CANDLE_DB) as conn:
+        _init(conn)
+        marks = ",".join("?" * len(symbols))
+        rows = conn.execute(
+            f"SELECT symbol, computed_at, data FROM ta_cache WHERE day = ? AND symbol IN ({marks})", [day] + symbols
+        ).fetchall()
+    return {symbol: (json.loads(data), computed_at) for symbol, computed_at, data in rows}
+
+def save_ta_cache(results, day, computed_at):
+    """每檔只保留最新一個交易日的結果"""
+    with local_store.write_lock, local_store.connect(CANDLE_DB) as conn:
+        _init(conn)
+        conn.executemany(
+            "INSERT OR REPLACE INTO ta_cache (symbol, day, computed_at, data) VALUES (?, ?, ?, ?)",
+            [(s, day, computed_at, json.dumps(r, ensure_ascii=False, default=_json_default)) for s, r in results.items()]
+        )
@@ -2,6 +2,22 @@
 # 檔案名稱: database.py
 # 
 # 修改歷程:
+# 2026-10-17 23:50:00: [Fix] load_all 先取修改版本再批次讀取，與預取資料一起交給鏡像同步 (預取後才取版本會把讀取之後的修改誤記為已同步)
+# 2026-10-17 23:10:00: [Fix] load_asset_history 區間讀取改為篩選已快取的整表 (load_all 已批次取回)，不再依可能過期的日期索引讀取部分範圍而漏掉外部新增的列；日期索引只用於寫入定位
+# 2026-10-17 23:00:00: [Fix] 鏡像同步改以整份試算表的修改版本 (Drive modifiedTime) 判斷：版本變動即整表重抓，舊列任何欄位被手動修改都能偵測；版本未變則不讀工作表
+# 2026-10-17 20:00:00: [Fix] 批次匯入改以出現次數去重：同內容的多筆成交只扣除既有筆數，不再只保留一筆
+# 2026-10-17 19:00:00: [Fix] 鏡像同步與資產日期索引的遠端讀取不再持有 local_store.write_lock，寫入日誌不必等 Google 回應
+# 2026-10-17 18:00:00: [Perf] 批次匯入改用 logic.calculate_fees_batch 一次計算整批費用
+# 2026-10-16 18:00:00: [Refactor] 改透過 storage 後端介面存取工作表 (Google Sheets / 本地記憶體)，支援離線模式與壓力測試
+# 2026-10-16 17:00:00: [New] 新增 get_symbol_index (代號/名稱前綴與子字串搜尋)；INDEX 代號保留文字 (0050 不再變成 50)
+# 2026-10-16 16:00:00: [Perf] 資產歷史紀錄新增本地「日期→列號」索引：同日覆寫只需單一範圍寫入；load_asset_history 支援 start/end 區間讀取
+# 2026-10-16 15:00:00: [Perf] 寫入改走本地預寫日誌 (write_journal)，立即返回；背景執行緒合併待寫列批次寫入 Google Sheets 並指數退避重試
+# 2026-10-16 14:00:00: [Perf] 以工作表版本號取代 st.cache_data.clear()：寫入只讓該表快取失效；新增快取命中統計 get_cache_stats
+# 2026-10-16 13:00:00: [Perf] load_data 回傳型別化帳本 (logic.normalize_ledger)；股票代號保留文字 (0050 不再變成 50)
+# 2026-10-16 12:00:00: [Perf] 共用同一個 Spreadsheet 連線；新增 load_all 以單次 values_batch_get 取回所有工作表
+# 2026-10-16 11:00:00: [New] 新增 save_transactions 批次匯入 (內容雜湊去重、單次 batch_update 寫入)
+# 2026-10-16 10:05:00: [Perf] save_transaction 改用本地追蹤的寫入游標 (只探測 2 列確認無衝突)，不再讀整張表
+# 2026-10-16 09:10:00: [Perf] load_data 改由本地 SQLite 鏡像提供，僅增量同步新增列；ID/日期欄校驗碼變動時整表重抓
 # 2025-11-24 11:10:00: [Fix] 修正 save_transaction 寫入位置錯誤 (改用指定列號寫入，避免 append_row 誤判)
 # 2025-11-23: [Update] 新增 load_mp_table 函式，讀取盤中量能倍數表
 # ==============================================================================
@@ -9,8 +25,19 @@
 import streamlit as st
 import pandas as pd
 import gspread
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from gspread.utils import numericise_all
 from google.oauth2.service_account import Credentials
 import logic  # 匯入邏輯層
+import local_store
+import storage
+from symbol_index import SymbolIndex
 
 # --- 常數設定 ---
 SHEET_NAME = '交易紀錄'
@@ -20,10 +47,32 @@ HISTORY_SHEET_NAME = '資產歷史紀錄'
 WATCHLIST_SHEET_NAME = '自選股清單'
 MP_TABLE_SHEET_NAME = 'mp_table'
 
+# --- 交易紀錄本地鏡像 ---
+LEDGER_DB = 'ledger.db'
+LEDGER_LAST_COL = 'O'                 # 交易紀錄共 15 欄 (A~O)
+LEDGER_PROBE_INTERVAL = 30            # 秒；間隔內的重跑直接讀本地，不探測遠端
+LEDGER_FULL_RESYNC_INTERVAL = 3600    # 秒；定期整表重抓 (後端不提供修改版本時，手動修改舊列內容只能靠這個涵蓋)
+_ledger_sync_lock = threading.Lock()
+
+# --- 預寫日誌 (寫入先落地本地，再由背景執行緒批次送出) ---
+JOURNAL_FLUSH_INTERVAL = 5        # 秒；背景執行緒定期檢查待寫入項目
+JOURNAL_MAX_BACKOFF = 120         # 秒；連續失敗時的最長等待
+JOURNAL_RETENTION = 7 * 86400     # 秒；已送出的日誌保留天數
+_journal_flush_lock = threading.Lock()
+
+# --- 工作表快取秒數 (交易紀錄由本地鏡像處理，不在此列) ---
+SHEET_CACHE_TTL = {
+    INDEX_SHEET_NAME: 3600,
+    ACCOUNT_SHEET_NAME: 3600,
+    WATCHLIST_SHEET_NAME: 600,
+    MP_TABLE_SHEET_NAME: 3600,
+    HISTORY_SHEET_NAME: 600,
+}
+
 # --- 連線核心 ---
 @st.cache_resource
-def get_worksheet(sheet_name):
-    """建立 Google Sheet 連線"""
+def get_spreadsheet():
+    """建立 Google Sheet 連線 (整個 process 共用同一個 client 與 Spreadsheet 物件)"""
     if "gcp_service_account" not in st.secrets:
         st.error("❌ 未設定 gcp_service_account 金鑰！")
         st.stop()
@@ -35,65 +84,390 @@ def get_worksheet(sheet_name):
     scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
     creds = Credentials.from_service_account_info(creds_dict, scopes=scopes)
     client = gspread.authorize(creds)
-    
-    sheet_url = st.secrets["spreadsheet_url"]
-    try:
-        sheet = client.open_by_url(sheet_url)
-        return sheet.worksheet(sheet_name)
-    except Exception as e:
-        print(f"無法開啟工作表 '{sheet_name}': {e}")
-        return None
+    return client.open_by_url(st.secrets["spreadsheet_url"])
+
+def _setting(name, default=None):
+    """讀取設定：環境變數優先 (STOCK_APP_<NAME>)，其次 st.secrets；沒有 secrets 檔也不報錯"""
+    env = os.environ.get(f"STOCK_APP_{name.upper()}")
+    if env is not None: return env
+    try: return st.secrets.get(name, default)
+    except Exception: return default
+
+@st.cache_resource
+def _default_backend():
+    """
+    依設定建立儲存後端：
+    - storage_backend = "google" (預設)：Google Sheets
+    - storage_backend = "local"：離線模式，從 local_data_dir 下的 <工作表>.csv 讀寫
+    """
+    if _setting("storage_backend", "google") == "local":
+        return storage.MemoryBackend(data_dir=_setting("local_data_dir", "local_data"))
+    return storage.GoogleSheetsBackend(get_spreadsheet())
+
+_backend_override = None
+
+def set_backend(backend):
+    """注入儲存後端 (壓力測試 / 測試用)；傳入 None 恢復依設定建立。切換時清空工作表快取"""
+    global _backend_override
+    _backend_override = backend
+    cache = _sheet_cache()
+    with cache["lock"]:
+        cache["entries"].clear()
+
+def get_backend():
+    return _backend_override or _default_backend()
+
+def _ledger_db():
+    """本地鏡像/日誌檔依後端分開，避免離線資料與雲端資料混在一起"""
+    name = get_backend().name
+    return LEDGER_DB if name == "google" else f"ledger_{name}.db"
+
+# --- 工作表快取 (process 共用，依工作表版本失效) ---
+@st.cache_resource
+def _sheet_cache():
+    """
+    entries: {工作表: {"version", "fetched_at", "values", "parsed", "prefetched"}}
+    versions: {工作表: 版本號}，寫入該表時 +1，只讓該表的快取失效
+    stats: {工作表: {"hits", "misses"}}
+    """
+    return {"entries": {}, "versions": {}, "stats": {}, "lock": threading.Lock()}
+
+def bump_sheet_version(sheet_name):
+    """寫入某工作表後呼叫，其他工作表的快取不受影響"""
+    cache = _sheet_cache()
+    with cache["lock"]:
+        cache["versions"][sheet_name] = cache["versions"].get(sheet_name, 0) + 1
+
+def get_cache_stats():
+    """各工作表的快取版本與命中/未命中次數"""
+    cache = _sheet_cache()
+    with cache["lock"]:
+        names = set(cache["versions"]) | set(cache["stats"])
+        return {n: {"version": cache["versions"].get(n, 0), **cache["stats"].get(n, {"hits": 0, "misses": 0})}
+                for n in sorted(names)}
+
+def _record_lookup(cache, sheet_name, hit):
+    stats = cache["stats"].setdefault(sheet_name, {"hits": 0, "misses": 0})
+    stats["hits" if hit else "misses"] += 1
+
+def _batch_get(ranges):
+    """單次往返取回多個範圍；ranges: list of (sheet_name, a1 或 None)"""
+    if not ranges: return []
+    return get_backend().batch_get(ranges)
+
+def _get_range(sheet_name, a1=None):
+    return _batch_get([(sheet_name, a1)])[0]
+
+def _is_fresh(cache, sheet_name, now, entry_key=None):
+    entry = cache["entries"].get(entry_key or sheet_name)
+    return (entry is not None
+            and entry["version"] == cache["versions"].get(sheet_name, 0)
+            and now - entry["fetched_at"] <= SHEET_CACHE_TTL.get(sheet_name, 600))
+
+def _stale_sheets(sheet_names):
+    cache = _sheet_cache()
+    now = time.time()
+    with cache["lock"]:
+        return [n for n in sheet_names if not _is_fresh(cache, n, now)]
+
+def _store_sheet_values(sheet_name, values, prefetched=False):
+    cache = _sheet_cache()
+    with cache["lock"]:
+        cache["entries"][sheet_name] = {
+            "version": cache["versions"].get(sheet_name, 0), "fetched_at": time.time(),
+            "values": values, "parsed": {}, "prefetched": prefetched
+        }
+
+def _cached_sheet(sheet_name, parse, text_cols=()):
+    """
+    取得解析後的工作表內容，快取失效 (版本變動或逾時) 時才向遠端抓取
+    同一份資料可有多種解析結果 (依 parse 函式分開快取)
+    由 load_all 預先批次取回的資料，第一次使用時計為未命中
+    """
+    fetched = False
+    if _stale_sheets([sheet_name]):
+        _store_sheet_values(sheet_name, _batch_get([(sheet_name, None)])[0])
+        fetched = True
+    cache = _sheet_cache()
+    with cache["lock"]:
+        entry = cache["entries"][sheet_name]
+        _record_lookup(cache, sheet_name, hit=not (fetched or entry["prefetched"]))
+        entry["prefetched"] = False
+        if parse not in entry["parsed"]:
+            values = entry["values"]
+            entry["parsed"][parse] = parse(_rows_to_records(values[0], values[1:], text_cols) if values else [])
+        # 回傳副本，避免呼叫端修改到快取內容 (唯讀物件如 SymbolIndex 直接共用)
+        result = entry["parsed"][parse]
+        return result.copy() if hasattr(result, "copy") else result
 
 # --- 讀取股票代碼表 ---
-@st.cache_data(ttl=3600)
+def _parse_stock_map(data):
+    stock_map = {}
+    for row in data:
+        symbol = str(row.get('symbol', row.get('Symbol', ''))).strip()
+        name = str(row.get('name', row.get('Name', ''))).strip()
+        if symbol and name:
+            stock_map[symbol] = name
+    return stock_map
+
+INDEX_TEXT_COLS = ('symbol', 'Symbol')
+
 def get_stock_info_map():
-    ws = get_worksheet(INDEX_SHEET_NAME)
-    if not ws: return {}
-    try:
-        data = ws.get_all_records()
-        stock_map = {}
-        for row in data:
-            symbol = str(row.get('symbol', row.get('Symbol', ''))).strip()
-            name = str(row.get('name', row.get('Name', ''))).strip()
-            if symbol and name:
-                stock_map[symbol] = name
-        return stock_map
+    try: return _cached_sheet(INDEX_SHEET_NAME, _parse_stock_map, INDEX_TEXT_COLS)
     except: return {}
 
+def _build_symbol_index(data):
+    return SymbolIndex(_parse_stock_map(data))
+
+def get_symbol_index():
+    """代號/名稱搜尋索引，INDEX 工作表版本不變時共用同一個索引"""
+    try: return _cached_sheet(INDEX_SHEET_NAME, _build_symbol_index, INDEX_TEXT_COLS)
+    except: return SymbolIndex({})
+
 # --- 讀取帳戶與折數 ---
-@st.cache_data(ttl=3600)
+def _parse_account_settings(data):
+    account_map = {}
+    for row in data:
+        name = str(row.get('帳戶名稱', row.get('Account', ''))).strip()
+        discount_val = row.get('手續費折數', row.get('Discount', 0.6))
+        try: discount = float(discount_val)
+        except: discount = 0.6 
+        if name: account_map[name] = discount
+    return account_map if account_map else {"預設帳戶": 0.6}
+
 def get_account_settings():
-    ws = get_worksheet(ACCOUNT_SHEET_NAME)
-    if not ws: return {"預設帳戶": 0.6}
-    try:
-        data = ws.get_all_records()
-        account_map = {}
-        for row in data:
-            name = str(row.get('帳戶名稱', row.get('Account', ''))).strip()
-            discount_val = row.get('手續費折數', row.get('Discount', 0.6))
-            try: discount = float(discount_val)
-            except: discount = 0.6 
-            if name: account_map[name] = discount
-        return account_map if account_map else {"預設帳戶": 0.6}
+    try: return _cached_sheet(ACCOUNT_SHEET_NAME, _parse_account_settings)
     except: return {"預設帳戶": 0.6}
 
+# --- 交易紀錄本地鏡像 (SQLite) ---
+def _init_ledger_mirror(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS ledger_rows (row_num INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+    local_store.ensure_meta_table(conn, "ledger_meta")
+
+def _probe_checksum(probe_rows, seed=""):
+    """
+    以 A、B 欄 (交易ID、交易日期) 計算校驗碼，列被刪除/插入/重排時會改變
+    採逐列串接雜湊，新增一列時只需以舊校驗碼為 seed 再算一次
+    """
+    checksum = seed
+    for r in probe_rows:
+        line = "\t".join(str(v) for v in list(r[:2]) + [""] * (2 - len(r[:2])))
+        checksum = hashlib.sha1(f"{checksum}\n{line}".encode("utf-8")).hexdigest()
+    return checksum
+
+def _remote_revision():
+    """整份試算表的修改版本 (任一儲存格變動都會改變)；後端不支援或讀取失敗時回傳 None"""
+    try:
+        return get_backend().revision()
+    except Exception as e:
+        print(f"Warning: 無法取得試算表修改版本，改用校驗碼探測: {e}")
+        return None
+
+def _adopt_own_revision(conn, before, after):
+    """
+    本程式的寫入同樣會改變修改版本：寫入前的版本與鏡像記錄相同 (期間沒有其他人修改) 時，
+    改記錄寫入後的版本，避免下一次同步因自己的寫入而整表重抓
+    寫入前後的瞬間若有人手動修改，會被視為自己的寫入，仍由定期整表重抓涵蓋
+    """
+    _init_ledger_mirror(conn)
+    if before is not None and before == local_store.read_meta(conn, "ledger_meta").get("revision"):
+        local_store.write_meta(conn, "ledger_meta", revision=after)
+
+def _full_resync(values, conn, meta, revision=None):
+    header = values[0] if values else []
+    rows = values[1:]
+    conn.execute("DELETE FROM ledger_rows")
+    conn.executemany(
+        "INSERT INTO ledger_rows (row_num, data) VALUES (?, ?)",
+        [(i + 2, json.dumps(r, ensure_ascii=False)) for i, r in enumerate(rows)]
+    )
+    now = time.time()
+    local_store.write_meta(
+        conn, "ledger_meta",
+        header=header, row_count=len(rows), checksum=_probe_checksum(rows),
+        synced_at=now, full_synced_at=now, generation=meta.get("generation", 0) + 1, revision=revision
+    )
+
+def _ledger_sync_mode(meta, force_full=False):
+    """回傳 "full" (整表重抓)、"probe" (探測新增列) 或 None (直接讀本地)"""
+    now = time.time()
+    if force_full or not meta or now - meta.get("full_synced_at", 0) > LEDGER_FULL_RESYNC_INTERVAL:
+        return "full"
+    if now - meta.get("synced_at", 0) < LEDGER_PROBE_INTERVAL:
+        return None
+    return "probe"
+
+def _ledger_prefetch_range():
+    """供 load_all 併入批次讀取的交易紀錄範圍 (None 表示不需向遠端讀取)"""
+    with local_store.connect(_ledger_db()) as conn:
+        _init_ledger_mirror(conn)
+        mode = _ledger_sync_mode(local_store.read_meta(conn, "ledger_meta"))
+    if mode == "full": return mode, None
+    if mode == "probe": return mode, "A2:B"
+    return None, None
+
+def _meta_key(meta):
+    """鏡像狀態的識別 (遠端讀取期間若被其他執行緒推進，寫入前會發現)"""
+    return (meta.get("generation"), meta.get("row_count"), meta.get("checksum"), meta.get("revision"))
+
+def sync_ledger_mirror(force_full=False, prefetched=None):
+    """
+    將遠端交易紀錄同步到本地鏡像
+    1. 先取整份試算表的修改版本 (只讀中繼資料)：與上次相同 -> 沒有任何變動；不同 -> 整表重抓
+       (任一儲存格的修改都會改變版本，舊列的股數、價格等欄位被手動修改也能偵測)
+    2. 後端不提供版本時，改探測 A2:B (ID、日期兩欄) 取得列數與校驗碼：
+       已知列的校驗碼一致 -> 只抓新增的列；不一致 (刪除/插入/排序) -> 整表重抓
+    prefetched: (mode, values, revision)，由 load_all 批次取回的資料 (revision 在讀取之前取得)，可省去一次讀取
+    遠端讀取不持有 local_store.write_lock (寫入日誌不必等 Google 回應)；
+    只在寫入 SQLite 時取得鎖，並確認鏡像在讀取期間沒有被推進 (否則以新狀態重來一次)
+    """
+    with _ledger_sync_lock:
+        for _ in range(2):
+            meta = _read_ledger_meta()
+            mode = _ledger_sync_mode(meta, force_full)
+            if mode is None: return
+            pre_mode, pre_values, pre_revision = prefetched if prefetched else (None, None, None)
+            now = time.time()
+
+            full_values, probe, new_rows = None, None, None
+            # 版本需在讀取工作表之前取得：讀取期間的修改會讓下次比對不一致，而不是被漏掉
+            # 預取的資料沿用 load_all 在批次讀取前取得的版本
+            revision = pre_revision if prefetched else _remote_revision()
+            prefetched = None
+            unchanged = revision is not None and revision == meta.get("revision")
+            if mode == "probe" and revision is not None and meta.get("revision") is not None and not unchanged:
+                mode = "full"
+            if mode == "full" or pre_mode == "full":
+                full_values = pre_values if pre_mode == "full" else _get_range(SHEET_NAME)
+            elif not unchanged:
+                probe = pre_values if pre_mode == "probe" else _get_range(SHEET_NAME, "A2:B")
+                known = meta.get("row_count", 0)
+                if len(probe) < known or _probe_checksum(probe[:known]) != meta.get("checksum"):
+                    full_values = _get_range(SHEET_NAME)
+                elif len(probe) > known:
+                    start_row, end_row = known + 2, len(probe) + 1
+                    new_rows = _get_range(SHEET_NAME, f"A{start_row}:{LEDGER_LAST_COL}{end_row}")
+                    # 尾端空白列會被 API 省略，補齊列數以維持 row_num 對應
+                    new_rows += [[] for _ in range(end_row - start_row + 1 - len(new_rows))]
+
+            with local_store.write_lock, local_store.connect(_ledger_db()) as conn:
+                _init_ledger_mirror(conn)
+                current = local_store.read_meta(conn, "ledger_meta")
+                if _meta_key(current) != _meta_key(meta): continue
+                if full_values is not None:
+                    _full_resync(full_values, conn, current, revision)
+                    return
+                if unchanged:
+                    local_store.write_meta(conn, "ledger_meta", synced_at=now)
+                    return
+                if new_rows:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO ledger_rows (row_num, data) VALUES (?, ?)",
+                        [(start_row + i, json.dumps(r, ensure_ascii=False)) for i, r in enumerate(new_rows)]
+                    )
+                local_store.write_meta(conn, "ledger_meta", row_count=len(probe), checksum=_probe_checksum(probe),
+                                       synced_at=now, revision=revision)
+                return
+
+def _read_ledger_meta():
+    with local_store.connect(_ledger_db()) as conn:
+        _init_ledger_mirror(conn)
+        return local_store.read_meta(conn, "ledger_meta")
+
+def _read_ledger_mirror():
+    with local_store.connect(_ledger_db()) as conn:
+        _init_ledger_mirror(conn)
+        meta = local_store.read_meta(conn, "ledger_meta")
+        rows = [json.loads(d) for (d,) in conn.execute("SELECT data FROM ledger_rows ORDER BY row_num")]
+    return meta.get("header", []), rows
+
+def _rows_to_records(header, rows, text_cols=()):
+    """與 get_all_records 相同的轉換：補齊欄位並把數字字串轉為數值 (text_cols 指定的欄位保留原字串)"""
+    width = len(header)
+    ignore = [i + 1 for i, h in enumerate(header) if str(h).strip() in text_cols]
+    padded = [(list(r) + [""] * width)[:width] for r in rows]
+    return [dict(zip(header, numericise_all(r, ignore=ignore))) for r in padded]
+
 # --- 讀取交易紀錄 ---
+def _cached_ledger():
+    """型別化帳本依 (版本號, 鏡像世代, 列數, 校驗碼) 快取，鏡像未變動時不必重新解析"""
+    meta = _read_ledger_meta()
+    cache = _sheet_cache()
+    with cache["lock"]:
+        key = (cache["versions"].get(SHEET_NAME, 0), meta.get("generation"), meta.get("row_count"), meta.get("checksum"))
+        # 版本號在寫入日誌與送出時都會遞增，因此也涵蓋了待寫入列的變化
+        entry = cache["entries"].get(SHEET_NAME)
+        hit = entry is not None and entry["key"] == key
+        _record_lookup(cache, SHEET_NAME, hit)
+        if hit: return entry["parsed"].copy()
+
+    header, rows = _read_ledger_mirror()
+    if not header: return pd.DataFrame()
+    # 待寫入的交易接在鏡像之後，送出前就能在各頁面看到
+    rows += [row for _, _, _, row in _journal_pending(SHEET_NAME)]
+    records = _rows_to_records(header, rows, text_cols=('交易ID', '股票代號', '交易帳戶'))
+    df = logic.normalize_ledger(pd.DataFrame(records))
+    with cache["lock"]:
+        cache["entries"][SHEET_NAME] = {"key": key, "parsed": df}
+    return df.copy()
+
 def load_data():
-    ws = get_worksheet(SHEET_NAME)
-    if not ws: return pd.DataFrame()
     try:
-        data = ws.get_all_records()
-        return pd.DataFrame(data)
+        sync_ledger_mirror()
+    except Exception as e:
+        print(f"Warning: 交易紀錄同步失敗，改用本地鏡像: {e}")
+    try:
+        return _cached_ledger()
     except Exception as e:
         st.error(f"讀取交易紀錄失敗: {e}")
         return pd.DataFrame()
 
-# --- [關鍵修正] 儲存交易 (指定位置寫入) ---
-def save_transaction(date_val, stock_id, stock_name, action, qty, price, account, notes, discount):
-    ws = get_worksheet(SHEET_NAME)
-    if not ws: raise Exception(f"找不到工作表: {SHEET_NAME}")
-    
-    fees = logic.calculate_fees(qty, price, action, discount, stock_id)
+# --- 寫入游標 (取代 get_all_values 找最後一列) ---
+def _reserve_append_row(max_attempts=3):
+    """
+    由本地鏡像推算下一個空白列，並只讀取游標前後 2 列確認：
+    - 前一列必須是鏡像中的最後一列 (ID、日期相符)
+    - 游標所在列必須是空白
+    不符時 (其他裝置也寫入了) 先增量同步鏡像再重算，確保絕不覆蓋既有資料
+    """
+    for _ in range(max_attempts):
+        sync_ledger_mirror()
+        header, last_row, row_count = _mirror_tail()
+        next_row = row_count + 2
+        expected_prev = [str(v) for v in (last_row if row_count else header)[:2]]
+        probe = _get_range(SHEET_NAME, f"A{next_row - 1}:B{next_row}")
+        prev = (probe[0] if probe else []) + ["", ""]
+        if len(probe) < 2 and [str(v) for v in prev[:2]] == expected_prev:
+            return next_row
+        # 游標失效：讓下一次 sync 立即探測遠端
+        with local_store.write_lock, local_store.connect(_ledger_db()) as conn:
+            local_store.write_meta(conn, "ledger_meta", synced_at=0)
+    raise Exception("無法確認交易紀錄的寫入位置 (遠端資料持續變動中)，請稍後再試")
+
+def _mirror_tail():
+    with local_store.connect(_ledger_db()) as conn:
+        _init_ledger_mirror(conn)
+        meta = local_store.read_meta(conn, "ledger_meta")
+        last = conn.execute("SELECT data FROM ledger_rows ORDER BY row_num DESC LIMIT 1").fetchone()
+    return meta.get("header", []), (json.loads(last[0]) if last else []), meta.get("row_count", 0)
+
+def _mirror_append_rows(conn, start_row, rows):
+    """寫入成功後直接把新列補進本地鏡像，並推進列數與校驗碼 (與日誌狀態在同一個交易內提交)"""
+    _init_ledger_mirror(conn)
+    meta = local_store.read_meta(conn, "ledger_meta")
+    conn.executemany(
+        "INSERT OR REPLACE INTO ledger_rows (row_num, data) VALUES (?, ?)",
+        [(start_row + i, json.dumps(r, ensure_ascii=False)) for i, r in enumerate(rows)]
+    )
+    local_store.write_meta(
+        conn, "ledger_meta",
+        row_count=start_row - 2 + len(rows),
+        checksum=_probe_checksum(rows, seed=meta.get("checksum", ""))
+    )
+
+def _build_row(date_val, stock_id, stock_name, action, qty, price, account, notes, discount, fees=None):
+    """組出一列交易紀錄 (A~O 欄，皆轉為字串)；fees 為已算好的費用 (批次匯入時由 calculate_fees_batch 產生)"""
+    if fees is None: fees = logic.calculate_fees(qty, price, action, discount, stock_id)
     txn_id = logic.generate_txn_id()
     
     # 確保每個元素都轉為字串或數值，避免 gspread 寫入錯誤
@@ -115,83 +489,356 @@ def save_transaction(date_val, stock_id, stock_name, action, qty, price, account
         notes                   # 備註
     ]
     
-    # 1. 取得目前已有資料的最後一列 (使用 len(get_all_values) 最準確)
-    # 雖然耗效能一點，但能保證不會覆蓋
-    all_values = ws.get_all_values()
-    next_row = len(all_values) + 1
-    
-    # 2. 指定範圍寫入 (例如 A501:O501)
-    # row_data 的長度為 15，對應 A 到 O 欄
-    col_count = len(row_data)
-    # 將欄位數轉為字母 (例如 15 -> O)，這裡簡化直接計算範圍
-    # gspread update 支援直接給 row index 和 col index
-    
-    # 使用 update_cells 或 update (range)
-    # 這裡使用 range 寫法： f"A{next_row}"
-    # 注意：如果 row_data 有空值，update 可能會報錯，需確保 list 完整
-    
-    # 簡單暴力的解法：先用 append_row，但強制指定 table_range 參數 (gspread 新版功能)
-    # 或者回歸最原始且穩定的方法：update
-    
     # 轉換 row_data 為字串陣列，避免 JSON 序列化問題
-    formatted_row = [str(item) if item is not None else "" for item in row_data]
+    return [str(item) if item is not None else "" for item in row_data]
+
+def _content_hash(date_val, stock_id, action, qty, price, account):
+    """交易內容雜湊 (不含交易ID)，用於批次匯入去重"""
+    try: date_key = pd.to_datetime(str(date_val)).strftime('%Y-%m-%d')
+    except: date_key = str(date_val).strip()
+    # 試算表讀回時 "0050" 會被轉成數字 50，純數字代號一律補足 4 碼再比對
+    sid = str(stock_id).strip()
+    if sid.isdigit(): sid = sid.zfill(4)
+    key = "|".join([
+        date_key, sid, str(action).strip(),
+        f"{logic._safe_float(qty):.4f}", f"{logic._safe_float(price):.4f}", str(account).strip()
+    ])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+# --- 預寫日誌 (write-ahead journal) ---
+def _init_journal(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS write_journal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sheet TEXT NOT NULL,
+            row_key TEXT,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            flushed_at REAL
+        )""")
+
+def _journal_enqueue(sheet_name, rows, row_keys=None):
+    """寫入本地日誌後立即返回，由背景執行緒送出"""
+    now = time.time()
+    keys = row_keys or [None] * len(rows)
+    with local_store.write_lock, local_store.connect(_ledger_db()) as conn:
+        _init_journal(conn)
+        conn.executemany(
+            "INSERT INTO write_journal (sheet, row_key, payload, created_at) VALUES (?, ?, ?, ?)",
+            [(sheet_name, k, json.dumps(r, ensure_ascii=False), now) for k, r in zip(keys, rows)]
+        )
+    # 交易紀錄的待寫入列會併入 load_data，需讓已解析的帳本失效；資產紀錄則是讀取時即時疊加
+    if sheet_name == SHEET_NAME: bump_sheet_version(SHEET_NAME)
+    get_journal_flusher().wake()
+
+def _journal_pending(sheet_name=None):
+    """回傳待寫入項目 [(id, row_key, row)]，依寫入順序"""
+    with local_store.connect(_ledger_db()) as conn:
+        _init_journal(conn)
+        sql = "SELECT id, sheet, row_key, payload FROM write_journal WHERE status = 'pending'"
+        args = ()
+        if sheet_name:
+            sql += " AND sheet = ?"
+            args = (sheet_name,)
+        rows = conn.execute(sql + " ORDER BY id", args).fetchall()
+    return [(i, sheet, key, json.loads(p)) for i, sheet, key, p in rows]
+
+def _journal_mark(conn, ids, status, error=None):
+    marks = ",".join("?" * len(ids))
+    if status == "flushed":
+        conn.execute(f"UPDATE write_journal SET status = 'flushed', flushed_at = ?, last_error = NULL WHERE id IN ({marks})",
+                     (time.time(), *ids))
+    else:
+        conn.execute(f"UPDATE write_journal SET attempts = attempts + 1, last_error = ? WHERE id IN ({marks})",
+                     (str(error), *ids))
+
+def _flush_ledger(entries):
+    """把所有待寫入的交易合併為一次 batch_update"""
+    sync_ledger_mirror()
+
+    # 冪等：上次送出成功但尚未標記 (例如中途重啟) 的列，交易ID 已在鏡像中，不再重送
+    ids = [e[0] for e in entries]
+    with local_store.connect(_ledger_db()) as conn:
+        marks = ",".join("?" * len(entries))
+        existing = {r[0] for r in conn.execute(
+            f"SELECT json_extract(data, '$[0]') FROM ledger_rows WHERE json_extract(data, '$[0]') IN ({marks})",
+            [e[3][0] for e in entries])}
+    to_write = [e for e in entries if e[3][0] not in existing]
+
+    if to_write:
+        rows = [e[3] for e in to_write]
+        start_row = _reserve_append_row()
+        end_row = start_row + len(rows) - 1
+        before = _remote_revision()
+        get_backend().batch_update(SHEET_NAME, [{"range": f"A{start_row}:{LEDGER_LAST_COL}{end_row}", "values": rows}])
+        after = _remote_revision()
+    with local_store.write_lock, local_store.connect(_ledger_db()) as conn:
+        if to_write:
+            _mirror_append_rows(conn, start_row, rows)
+            _adopt_own_revision(conn, before, after)
+        _journal_mark(conn, ids, "flushed")
+    bump_sheet_version(SHEET_NAME)
+
+def _flush_history(entries):
+    """
+    同一天的多次記錄只保留最後一筆；依本地日期索引決定列號 (既有日期覆寫、新日期接在最後)
+    先以一次 batch_get 確認目標列的日期欄仍與索引相符，再一次 batch_update 寫入
+    索引失效 (有人手動排序/刪列) 時重建索引後再試一次
+    """
+    latest = {}
+    for _, _, key, row in entries: latest[key] = row
+
+    for attempt in range(2):
+        index, last_row = _history_index(rebuild=attempt > 0)
+        targets = {}
+        next_row = last_row + 1
+        for date_key in latest:
+            if date_key in index:
+                targets[date_key] = index[date_key]
+            else:
+                targets[date_key] = next_row
+                next_row += 1
+        checks = _batch_get([(HISTORY_SHEET_NAME, f"A{r}") for r in targets.values()])
+        if all(((c[0][0] if c and c[0] else "") == (d if d in index else "")) for d, c in zip(targets, checks)):
+            break
+    else:
+        raise Exception("資產歷史紀錄的日期索引與遠端不一致，請稍後再試")
+
+    before = _remote_revision()
+    get_backend().batch_update(HISTORY_SHEET_NAME, [{"range": f"A{r}:D{r}", "values": [latest[d]]} for d, r in targets.items()])
+    after = _remote_revision()
+    with local_store.write_lock, local_store.connect(_ledger_db()) as conn:
+        # 資產紀錄與交易紀錄在同一份試算表，寫入同樣會改變修改版本
+        _adopt_own_revision(conn, before, after)
+        _init_history_index(conn)
+        conn.executemany("INSERT OR REPLACE INTO history_index (date, row_num) VALUES (?, ?)", list(targets.items()))
+        local_store.write_meta(conn, "history_meta", last_row=max([last_row] + list(targets.values())))
+        _journal_mark(conn, [e[0] for e in entries], "flushed")
+    bump_sheet_version(HISTORY_SHEET_NAME)
+
+def flush_journal():
+    """送出所有待寫入項目 (背景執行緒定期呼叫，也可手動觸發)；任一工作表失敗時拋出例外"""
+    with _journal_flush_lock:
+        errors = []
+        for sheet_name, flush in [(SHEET_NAME, _flush_ledger), (HISTORY_SHEET_NAME, _flush_history)]:
+            entries = _journal_pending(sheet_name)
+            if not entries: continue
+            try:
+                flush(entries)
+            except Exception as e:
+                with local_store.write_lock, local_store.connect(_ledger_db()) as conn:
+                    _journal_mark(conn, [x[0] for x in entries], "error", e)
+                errors.append(f"{sheet_name}: {e}")
+        with local_store.write_lock, local_store.connect(_ledger_db()) as conn:
+            _init_journal(conn)
+            conn.execute("DELETE FROM write_journal WHERE status = 'flushed' AND flushed_at < ?",
+                         (time.time() - JOURNAL_RETENTION,))
+        if errors: raise Exception("; ".join(errors))
+
+class _JournalFlusher:
+    """背景執行緒：定期 (或被喚醒時) 送出日誌，失敗時指數退避 (含隨機抖動)"""
+    def __init__(self):
+        self.last_error = None
+        self.last_flush_at = None
+        self._backoff = 0
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sheets-journal-flusher", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=JOURNAL_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                flush_journal()
+                self.last_error = None
+                self.last_flush_at = time.time()
+                self._backoff = 0
+            except Exception as e:
+                print(f"Warning: 背景寫入 Google Sheets 失敗，稍後重試: {e}")
+                self.last_error = str(e)
+                self._backoff = min(max(self._backoff * 2, 1), JOURNAL_MAX_BACKOFF)
+                time.sleep(self._backoff + random.uniform(0, 1))
+
+@st.cache_resource
+def get_journal_flusher():
+    return _JournalFlusher()
+
+def get_journal_status():
+    """供 UI 顯示：待寫入/已送出筆數、最後錯誤與最後成功時間"""
+    flusher = get_journal_flusher()
+    with local_store.connect(_ledger_db()) as conn:
+        _init_journal(conn)
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM write_journal GROUP BY status").fetchall())
+    return {
+        "pending": counts.get("pending", 0),
+        "flushed": counts.get("flushed", 0),
+        "last_error": flusher.last_error,
+        "last_flush_at": flusher.last_flush_at,
+    }
+
+# --- [關鍵修正] 儲存交易 (先寫入本地日誌，背景送出) ---
+def save_transaction(date_val, stock_id, stock_name, action, qty, price, account, notes, discount):
+    formatted_row = _build_row(date_val, stock_id, stock_name, action, qty, price, account, notes, discount)
+    _journal_enqueue(SHEET_NAME, [formatted_row])
+
+# --- 批次匯入交易 (一次寫入) ---
+def save_transactions(rows):
+    """
+    批次寫入多筆交易
+    rows: list of dict，欄位同 save_transaction 的參數
+          (date_val, stock_id, stock_name, action, qty, price, account, notes, discount)
+    同一筆內容 (日期/代號/類別/股數/單價/帳戶皆相同) 依出現次數比對：
+    檔案中出現 n 次、既有紀錄 (含待寫入) 已有 m 次時，只寫入 n - m 筆
+    (同日同價的多筆成交是真實交易，不可只保留一筆)
+    回傳 {"written": 寫入筆數, "skipped": 略過筆數}
+    """
+    df_existing = load_data()
+    existing = Counter()
+    if not df_existing.empty:
+        cols = ['交易日期', '股票代號', '交易類別', '股數', '單價', '交易帳戶']
+        df_keys = df_existing.reindex(columns=cols).astype(object).fillna("")
+        existing = Counter(_content_hash(*vals) for vals in df_keys.itertuples(index=False))
     
-    # 指定從第一欄開始寫入
-    ws.update(range_name=f"A{next_row}", values=[formatted_row])
+    in_file = Counter()
+    picked = []
+    for r in rows:
+        h = _content_hash(r['date_val'], r['stock_id'], r['action'], r['qty'], r['price'], r['account'])
+        in_file[h] += 1
+        if in_file[h] <= existing[h]: continue
+        picked.append(r)
+
+    # 整批一次計算費用
+    new_rows = []
+    if picked:
+        fees = logic.calculate_fees_batch(
+            [r['qty'] for r in picked], [r['price'] for r in picked], [r['action'] for r in picked],
+            [r.get('discount', 0.6) for r in picked], [r['stock_id'] for r in picked]
+        )
+        for i, r in enumerate(picked):
+            new_rows.append(_build_row(
+                r['date_val'], r['stock_id'], r.get('stock_name', ''), r['action'], r['qty'], r['price'],
+                r['account'], r.get('notes', ''), r.get('discount', 0.6), fees={k: int(v[i]) for k, v in fees.items()}
+            ))
+    
+    # 整批進入日誌，背景執行緒會合併成單次 batch_update 送出
+    if new_rows: _journal_enqueue(SHEET_NAME, new_rows)
     
-    st.cache_data.clear()
+    return {"written": len(new_rows), "skipped": len(rows) - len(new_rows)}
+
+# --- 資產歷史紀錄：日期 -> 列號索引 (本地) ---
+def _init_history_index(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS history_index (date TEXT PRIMARY KEY, row_num INTEGER NOT NULL)")
+    local_store.ensure_meta_table(conn, "history_meta")
+
+def _history_index(rebuild=False):
+    """
+    回傳 ({日期: 列號}, 最後一列列號)；本地沒有索引或要求重建時，才讀取遠端 A 欄
+    只供寫入定位使用 (寫入前會確認目標列，不符時重建)，讀取資產紀錄不依賴索引
+    遠端讀取不持有 local_store.write_lock，只在寫回索引時取得
+    """
+    with local_store.connect(_ledger_db()) as conn:
+        _init_history_index(conn)
+        meta = local_store.read_meta(conn, "history_meta")
+        if meta and not rebuild:
+            index = dict(conn.execute("SELECT date, row_num FROM history_index").fetchall())
+            return index, meta.get("last_row", 1)
+
+    col_a = _get_range(HISTORY_SHEET_NAME, "A:A")
+    col_dates = [r[0] if r else "" for r in col_a]
+    index = {d: i + 1 for i, d in enumerate(col_dates) if i > 0 and d}
+    with local_store.write_lock, local_store.connect(_ledger_db()) as conn:
+        _init_history_index(conn)
+        conn.execute("DELETE FROM history_index")
+        conn.executemany("INSERT INTO history_index (date, row_num) VALUES (?, ?)", list(index.items()))
+        local_store.write_meta(conn, "history_meta", last_row=max(len(col_dates), 1), built_at=time.time())
+    return index, max(len(col_dates), 1)
 
 # --- 讀取資產歷史紀錄 ---
-def load_asset_history():
-    ws = get_worksheet(HISTORY_SHEET_NAME)
-    if not ws: return pd.DataFrame()
+def load_asset_history(start=None, end=None):
+    """
+    讀取資產歷史紀錄；指定 start / end (date 或字串) 時只回傳該區間的列
+    整表與其他工作表共用快取 (load_all 已批次取回)，區間篩選在本地進行，不另外讀取遠端
+    """
     try:
-        data = ws.get_all_records()
-        return pd.DataFrame(data)
-    except: return pd.DataFrame()
+        df = _cached_sheet(HISTORY_SHEET_NAME, pd.DataFrame)
+    except: df = pd.DataFrame()
+    # 疊加尚未送出的記錄，讓剛記錄的資產立即出現在圖表上
+    pending = _journal_pending(HISTORY_SHEET_NAME)
+    if pending:
+        header = list(df.columns[:4]) if len(df.columns) >= 4 else ['日期', '總資產', '總現金', '總股票市值']
+        df_pending = pd.DataFrame(_rows_to_records(header, [row for _, _, _, row in pending]))
+        df = pd.concat([df, df_pending], ignore_index=True)
+    # 待寫入的記錄一併依區間篩選
+    if (start is not None or end is not None) and not df.empty:
+        d = pd.to_datetime(df.iloc[:, 0], errors='coerce')
+        mask = pd.Series(True, index=df.index)
+        if start is not None: mask &= d >= pd.Timestamp(start)
+        if end is not None: mask &= d <= pd.Timestamp(end)
+        df = df[mask].reset_index(drop=True)
+    return df
 
-# --- 寫入資產歷史紀錄 ---
+# --- 寫入資產歷史紀錄 (同日覆寫；先寫入本地日誌，背景送出) ---
 def save_asset_history(date_str, total_assets, total_cash, total_stock):
-    ws = get_worksheet(HISTORY_SHEET_NAME)
-    if not ws: raise Exception(f"找不到工作表: {HISTORY_SHEET_NAME}")
-    
     row_data = [str(date_str), f"{total_assets:,}", f"{total_cash:,}", f"{total_stock:,}"]
-    try:
-        col_dates = ws.col_values(1)
-        if str(date_str) in col_dates:
-            row_idx = col_dates.index(str(date_str)) + 1
-            ws.update(range_name=f"A{row_idx}:D{row_idx}", values=[row_data])
-        else:
-            # 對於歷史紀錄，append_row 通常比較安全，因為它是單純的 log
-            # 但為了保險，我們也可以用同樣的邏輯
-            all_values = ws.get_all_values()
-            next_row = len(all_values) + 1
-            ws.update(range_name=f"A{next_row}", values=[row_data])
-            
-    except Exception as e:
-        # 如果讀取失敗，退回 append_row
-        ws.append_row(row_data)
+    _journal_enqueue(HISTORY_SHEET_NAME, [row_data], row_keys=[str(date_str)])
 
 # --- 讀取自選股清單 ---
-@st.cache_data(ttl=600) 
 def load_watchlist():
-    ws = get_worksheet(WATCHLIST_SHEET_NAME)
-    if not ws: return pd.DataFrame()
     try:
-        data = ws.get_all_records()
-        return pd.DataFrame(data)
+        return _cached_sheet(WATCHLIST_SHEET_NAME, pd.DataFrame)
     except Exception as e:
         print(f"Warning: 讀取自選股失敗: {e}")
         return pd.DataFrame()
 
 # --- 讀取量能倍數表 (mp_table) ---
-@st.cache_data(ttl=3600)
 def load_mp_table():
-    ws = get_worksheet(MP_TABLE_SHEET_NAME)
-    if not ws: return pd.DataFrame()
     try:
-        data = ws.get_all_records()
-        return pd.DataFrame(data)
+        return _cached_sheet(MP_TABLE_SHEET_NAME, pd.DataFrame)
     except Exception as e:
         print(f"Warning: 讀取 mp_table 失敗: {e}")
-        return pd.DataFrame()
\ No newline at end of file
+        return pd.DataFrame()
+
+# --- 頁面啟動：一次取回所有工作表 ---
+def load_all():
+    """
+    以單次 values_batch_get 取回所有快取過期的工作表，以及交易紀錄的探測範圍 (或整表)
+    再拆回各自的 DataFrame / dict；快取都有效時完全不連線
+    """
+    stale = _stale_sheets(list(SHEET_CACHE_TTL.keys()))
+    ledger_mode, ledger_range = _ledger_prefetch_range()
+    ranges = [(n, None) for n in stale]
+    if ledger_mode: ranges.append((SHEET_NAME, ledger_range))
+
+    prefetched = None
+    try:
+        # 交易紀錄的修改版本需在批次讀取之前取得 (見 sync_ledger_mirror)
+        revision = _remote_revision() if ledger_mode else None
+        results = _batch_get(ranges)
+        for name, values in zip(stale, results):
+            _store_sheet_values(name, values, prefetched=True)
+        if ledger_mode: prefetched = (ledger_mode, results[-1], revision)
+    except Exception as e:
+        print(f"Warning: 批次讀取工作表失敗，改為逐表讀取: {e}")
+
+    if prefetched:
+        try:
+            sync_ledger_mirror(prefetched=prefetched)
+        except Exception as e:
+            print(f"Warning: 交易紀錄同步失敗，改用本地鏡像: {e}")
+
+    get_journal_flusher()  # 確保上次未送出的日誌會被背景執行緒接手
+    return {
+        "ledger": load_data(),
+        "stock_map": get_stock_info_map(),
+        "accounts": get_account_settings(),
+        "watchlist": load_watchlist(),
+        "mp_table": load_mp_table(),
+        "history": load_asset_history(),
+    }
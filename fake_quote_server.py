@@ -0,0 +1,104 @@
+# ==============================================================================
+# 檔案名稱: fake_quote_server.py
+#
+# 修改歷程:
+# 2026-10-17 10:00:00: [New] 本地模擬 Fugle WebSocket 行情伺服器 (驗證 / 訂閱 / aggregates 推播 / 定時斷線)，供測試串流報價
+# ==============================================================================
+# 用法: python fake_quote_server.py --port 8765 --interval 0.5 --drop-every 30
+# 並在 .streamlit/secrets.toml 設定 fugle_ws_url = "ws://localhost:8765"
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+
+from websockets.sync.server import serve
+
+class FakeQuoteServer:
+    """
+    模擬 Fugle 串流協定：
+    - {"event":"auth"} → {"event":"authenticated"}
+    - {"event":"subscribe","data":{"channel","symbols"}} → {"event":"subscribed"}，之後定時推送 aggregates
+    - {"event":"ping"} → {"event":"pong"}
+    drop_every 秒後主動斷線 (測試重連與重新訂閱)
+    """
+    def __init__(self, host="127.0.0.1", port=8765, interval=0.5, drop_every=None, api_key=None, seed=None):
+        self.host, self.port = host, port
+        self.interval = interval
+        self.drop_every = drop_every
+        self.api_key = api_key
+        self.rng = random.Random(seed)
+        self.prices = {}
+        self.stats = {"connections": 0, "subscribe_events": 0, "pushed": 0}
+        self.server = None
+
+    def _quote(self, symbol):
+        price = self.prices.get(symbol) or self.rng.uniform(20, 600)
+        price = round(price * (1 + self.rng.uniform(-0.005, 0.005)), 2)
+        self.prices[symbol] = price
+        return {
+            "symbol": symbol, "closePrice": price, "changePercent": round(self.rng.uniform(-5, 5), 2),
+            "total": {"tradeVolume": self.rng.randint(1, 50000)}
+        }
+
+    def handler(self, ws):
+        self.stats["connections"] += 1
+        symbols = []
+        opened = time.time()
+        try:
+            auth = json.loads(ws.recv(timeout=10))
+            if auth.get("event") != "auth" or (self.api_key and auth.get("data", {}).get("apikey") != self.api_key):
+                ws.send(json.dumps({"event": "error", "data": {"message": "Unauthorized"}}))
+                return
+            ws.send(json.dumps({"event": "authenticated", "data": {"message": "Authenticated successfully"}}))
+            while True:
+                if self.drop_every and time.time() - opened > self.drop_every:
+                    return
+                try:
+                    message = json.loads(ws.recv(timeout=self.interval))
+                    if message.get("event") == "subscribe":
+                        self.stats["subscribe_events"] += 1
+                        new = message["data"]["symbols"]
+                        symbols += [s for s in new if s not in symbols]
+                        ws.send(json.dumps({"event": "subscribed", "data": [
+                            {"id": s, "channel": message["data"]["channel"], "symbol": s} for s in new
+                        ]}))
+                    elif message.get("event") == "ping":
+                        ws.send(json.dumps({"event": "pong"}))
+                except TimeoutError:
+                    pass
+                for s in symbols:
+                    ws.send(json.dumps({"event": "data", "channel": "aggregates", "data": self._quote(s)}))
+                    self.stats["pushed"] += 1
+        except Exception:
+            return
+
+    def start(self):
+        """背景啟動 (測試用)，回傳實際的 ws:// 位址"""
+        self.server = serve(self.handler, self.host, self.port)
+        self.port = self.server.socket.getsockname()[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"ws://{self.host}:{self.port}"
+
+    def stop(self):
+        if self.server: self.server.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地模擬 Fugle WebSocket 行情伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--interval", type=float, default=0.5, help="推送間隔 (秒)")
+    parser.add_argument("--drop-every", type=float, default=None, help="每隔幾秒主動斷線")
+    args = parser.parse_args(argv)
+    server = FakeQuoteServer(args.host, args.port, args.interval, args.drop_every)
+    print(f"fake quote server: {server.start()}")
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
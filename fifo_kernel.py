@@ -0,0 +1,86 @@
+# ==============================================================================
+# 檔案名稱: fifo_kernel.py
+#
+# 修改歷程:
+# 2026-10-17 16:00:00: [New] 向量化 FIFO 沖銷核心：以累計買進/賣出股數 + searchsorted 找出每筆賣出沖銷的批次，供大型帳本整本重建
+# ==============================================================================
+
+import numpy as np
+
+def _group_starts(group):
+    """已排序 group 中每段的起點"""
+    if not len(group): return np.array([], dtype=np.int64)
+    return np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+
+def _group_cumsum(values, starts):
+    total = np.cumsum(values)
+    before = (total - values)[starts]
+    return total - np.repeat(before, np.diff(np.r_[starts, len(values)]))
+
+def _group_cummax(values, starts):
+    """分段累計最大值：每段加上遞增偏移量，讓前一段的值都比後一段小"""
+    if not len(values): return values
+    seg = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(values)]))
+    span = int(values.max() - values.min()) + 1
+    offset = seg.astype(np.int64) * span
+    return np.maximum.accumulate(values + offset) - offset
+
+def match(group, qty, unit_cost, is_lot, is_sell):
+    """
+    FIFO 沖銷 (結果與逐筆 deque 迴圈相同)
+    輸入為同長度陣列，已依 FIFO 順序 (日期、同日先買後賣) 排列：
+    - group: 股票編號 (int)；qty: 股數 (int，>= 0)
+    - unit_cost: 批次單位成本 (is_lot 的列才有意義)
+    - is_lot: 買進 / 現金增資 / 股票股利；is_sell: 賣出
+    每檔股票在「累計買進股數」軸上，批次佔 [累計-股數, 累計)，第 j 筆賣出沖銷 [S(j-1), S(j))；
+    S(j) = min(S(j-1) + 賣出股數, 當時累計買進)，超賣的部分丟棄 (與迴圈在批次用完時停止相同)
+    回傳:
+    - cost_basis: 與輸入等長，賣出列為沖銷批次的成本合計 (依批次順序逐一累加)，其他列為 0
+    - open_rows / open_qty: 尚未沖銷完的批次 (輸入列索引) 與剩餘股數，依股票、FIFO 順序
+    """
+    n = len(group)
+    qty = np.asarray(qty, dtype=np.int64)
+    order = np.argsort(group, kind='stable')
+    g, q = group[order], qty[order]
+    lot, sell = is_lot[order], is_sell[order]
+    u = unit_cost[order]
+    starts = _group_starts(g)
+
+    buy_q = np.where(lot, q, 0)
+    bought = _group_cumsum(buy_q, starts)                   # 到該列為止的累計買進
+    sold = _group_cumsum(np.where(sell, q, 0), starts)      # 到該列為止的累計賣出 (含超賣)
+    lost = np.maximum(_group_cummax(sold - bought, starts), 0) if n else sold
+    consumed = sold - lost                                  # 實際沖銷到的累計股數
+    prev = np.r_[0, consumed[:-1]] if n else consumed
+    prev[starts] = 0
+
+    # 各股票的批次依序接在同一條全域軸上
+    offset = np.cumsum(buy_q) - bought
+    lot_pos = np.flatnonzero(lot)
+    lo = bought[lot_pos] - q[lot_pos] + offset[lot_pos]
+    hi = bought[lot_pos] + offset[lot_pos]
+
+    sell_pos = np.flatnonzero(sell & (consumed > prev))
+    a = prev[sell_pos] + offset[sell_pos]
+    b = consumed[sell_pos] + offset[sell_pos]
+    first = np.searchsorted(hi, a, side='right')
+    last = np.searchsorted(lo, b, side='left') - 1
+    counts = np.maximum(last - first + 1, 0)
+
+    # 展開成 (賣出, 批次) 片段，片段股數 = 兩段區間的交集
+    piece_sell = np.repeat(sell_pos, counts)
+    piece_lot = np.repeat(first, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    piece_qty = np.minimum(hi[piece_lot], np.repeat(b, counts)) - np.maximum(lo[piece_lot], np.repeat(a, counts))
+    # bincount 依輸入順序逐一累加，與迴圈的浮點結果一致
+    cost_sorted = np.bincount(piece_sell, weights=piece_qty * u[lot_pos][piece_lot], minlength=n)
+
+    cost_basis = np.zeros(n)
+    cost_basis[order] = cost_sorted
+
+    # 未沖銷完的批次：每檔最後的沖銷位置之後
+    ends = np.r_[starts[1:], n] - 1 if n else starts
+    final = np.repeat(consumed[ends] + offset[ends], np.diff(np.r_[starts, n]))[lot_pos]
+    still_open = hi > final
+    open_qty = hi[still_open] - np.maximum(lo[still_open], final[still_open])
+    open_rows = order[lot_pos[still_open]]
+    return cost_basis, open_rows, open_qty
@@ -0,0 +1,103 @@
+# ==============================================================================
+# 檔案名稱: indicator_state.py
+#
+# 修改歷程:
+# 2026-10-17 21:00:00: [Fix] preview 新增 replace_last：今日K線已入庫時以現價取代最新一根，不再重複計入今日
+# 2026-10-17 09:00:00: [New] 每檔股票的滾動指標狀態 (環形緩衝 + 累計和)：新增一根K線或盤中試算皆為 O(1)
+# ==============================================================================
+
+import math
+
+class RingBuffer:
+    """固定容量的環形緩衝區，back(k) 取倒數第 k 筆 (1 = 最新)"""
+    def __init__(self, capacity, values=()):
+        self.capacity = capacity
+        self.buf = [0.0] * capacity
+        self.head = 0       # 下一筆要寫入的位置
+        self.count = 0
+        for v in values: self.push(v)
+
+    def __len__(self):
+        return self.count
+
+    def push(self, value):
+        self.buf[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def back(self, k):
+        return self.buf[(self.head - k) % self.capacity]
+
+    def tolist(self):
+        """由舊到新"""
+        return [self.back(k) for k in range(self.count, 0, -1)]
+
+class RollingIndicators:
+    """
+    收盤價均線 (MA5/10/20/60) 與成交量均量 (Vol10) 的增量狀態
+    push() 推進一根已收盤K線；preview() 試算「若現在收盤」的均線與乖離，皆不需重算整段歷史
+    """
+    def __init__(self, ma_windows=(5, 10, 20, 60), vol_window=10):
+        self.ma_windows = tuple(ma_windows)
+        self.vol_window = vol_window
+        self.closes = RingBuffer(max(self.ma_windows))
+        self.volumes = RingBuffer(vol_window)
+        self.close_sums = {w: 0.0 for w in self.ma_windows}
+        self.vol_sum = 0.0
+        self.last_date = None
+
+    def push(self, date_str, close, volume):
+        for w in self.ma_windows:
+            if len(self.closes) >= w: self.close_sums[w] -= self.closes.back(w)
+            self.close_sums[w] += close
+        if len(self.volumes) >= self.vol_window: self.vol_sum -= self.volumes.back(self.vol_window)
+        self.vol_sum += volume
+        self.closes.push(close)
+        self.volumes.push(volume)
+        self.last_date = date_str
+
+    def ma(self, window):
+        return self.close_sums[window] / window if len(self.closes) >= window else None
+
+    def values(self):
+        """最新一根已收盤K線的指標 (資料不足時為 None)"""
+        out = {f"MA{w}": self.ma(w) for w in self.ma_windows}
+        out[f"Vol{self.vol_window}"] = self.vol_sum / self.vol_window if len(self.volumes) >= self.vol_window else None
+        return out
+
+    def preview(self, price, window=20, replace_last=False):
+        """
+        盤中試算：若今日以 price 收盤，window 日均線與乖離率為何
+        replace_last: 最新一根已是今日K線 (收盤後已入庫)，以 price 取代它，而不是再多算一根
+        回傳 {"MA": 均線, "Bias": 乖離率(%)}；歷史不足時回傳 None
+        """
+        n = len(self.closes)
+        if not price: return None
+        if replace_last:
+            if n < window: return None
+            total = self.close_sums[window] - self.closes.back(1) + price
+        else:
+            if n < window - 1: return None
+            # 未滿 window 根時累計和即為全部歷史，不需扣除最舊一根
+            total = self.close_sums[window] + price - (self.closes.back(window) if n >= window else 0)
+        ma = total / window
+        return {"MA": ma, "Bias": (price - ma) / ma * 100 if ma else 0}
+
+    # --- 持久化 ---
+    def to_dict(self):
+        return {
+            "ma_windows": list(self.ma_windows), "vol_window": self.vol_window, "last_date": self.last_date,
+            "closes": self.closes.tolist(), "volumes": self.volumes.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """還原時以 fsum 重算累計和，避免浮點誤差長期累積"""
+        state = cls(data["ma_windows"], data["vol_window"])
+        for v in data["closes"]: state.closes.push(v)
+        for v in data["volumes"]: state.volumes.push(v)
+        closes = state.closes.tolist()
+        state.close_sums = {w: math.fsum(closes[-w:]) for w in state.ma_windows}
+        state.vol_sum = math.fsum(state.volumes.tolist())
+        state.last_date = data["last_date"]
+        return state
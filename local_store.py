@@ -0,0 +1,55 @@
+# ==============================================================================
+# 檔案名稱: local_store.py
+#
+# 修改歷程:
+# 2026-10-16 09:10:00: [New] 本地快取 (SQLite) 共用連線工具，供交易紀錄鏡像等使用
+# ==============================================================================
+
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# --- 常數設定 ---
+# 預設放在專案目錄下的 .cache/，可用環境變數覆寫 (例如雲端部署時指向可寫入的路徑)
+CACHE_DIR = os.environ.get(
+    "STOCK_APP_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+
+# 同一個 process 內的寫入序列化 (Streamlit 多個 session 共用同一個 process)
+write_lock = threading.RLock()
+
+def db_path(db_name):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, db_name)
+
+@contextmanager
+def connect(db_name):
+    """開啟 SQLite 連線；區塊正常結束時 commit，發生例外時 rollback"""
+    conn = sqlite3.connect(db_path(db_name), timeout=10)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# --- key/value 中繼資料 ---
+def ensure_meta_table(conn, table):
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT)")
+
+def read_meta(conn, table):
+    ensure_meta_table(conn, table)
+    return {k: json.loads(v) for k, v in conn.execute(f"SELECT key, value FROM {table}")}
+
+def write_meta(conn, table, **values):
+    ensure_meta_table(conn, table)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {table} (key, value) VALUES (?, ?)",
+        [(k, json.dumps(v, ensure_ascii=False)) for k, v in values.items()]
+    )
@@ -2,16 +2,27 @@
 # 檔案名稱: logic.py
 # 
 # 修改歷程:
+# 2026-10-17 19:00:00: [Fix] 向量化重建的未平倉批次單位成本改存 Python float (平均成本的 round 與迴圈版一致)；新增 check_engine_parity 比對兩種重建結果
+# 2026-10-17 18:00:00: [New] calculate_fees_batch 陣列版費用計算 (取整規則同單筆版)；audit_fees 一次稽核帳本已存的費用欄位
+# 2026-10-17 17:00:00: [Perf] calculate_unrealized_pnl 改為整欄運算 (NumPy 計算賣出稅費與 ETF 稅率)，移除逐列 apply
+# 2026-10-17 16:00:00: [Perf] 大型帳本整本重建改用 fifo_kernel 向量化 FIFO 沖銷 (結果與逐筆迴圈一致)
+# 2026-10-17 15:00:00: [Perf] FifoLotEngine 擴充為 LedgerEngine：單次走訪同時產生庫存、已實現損益/股息與帳戶餘額，三個報表函式改為共用結果
+# 2026-10-17 14:00:00: [Perf] 新增 FifoLotEngine 常駐 FIFO 庫存狀態：只套用未見過的交易，歷史交易被修改才整本重建
+# 2026-10-16 13:00:00: [Perf] 新增 normalize_ledger 型別化帳本；FIFO/已實現/餘額計算直接使用型別化欄位，不再逐格轉換
 # 2025-11-24 17:10:00: [Fix] 修正 calculate_volume_ratio 量比公式；統一單位為「張」(將 Vol10 除以 1000)
 # 2025-11-24 13:00:00: [Fix] 強化 calculate_account_balances，使用 regex 強制清除 $ 與 , 避免字串串接錯誤
 # 2025-11-24 09:45:00: [Fix] 強制同日交易排序：先買進後賣出
 # ==============================================================================
 
+import numpy as np
 import pandas as pd
 from collections import deque
 import uuid
+import threading
 from datetime import datetime
 
+import fifo_kernel
+
 # --- 常數設定 ---
 COMMISSION_RATE = 0.001425
 MIN_FEE = 1
@@ -57,6 +68,86 @@ def calculate_fees(qty, price, action, discount=1.0, stock_id=""):
         "net_cash_flow": net_cash_flow
     }
 
+# --- 批次費用計算 ---
+FEE_COLUMNS = {
+    'gross_amount': '成交總金額', 'commission': '手續費', 'tax': '交易稅',
+    'other_fees': '其他費用', 'total_fees': '總費用', 'net_cash_flow': '淨收付金額'
+}
+
+def _net_cash_flow(gross_amount, total_fees, action):
+    """淨收付 (陣列版，規則同 calculate_fees)"""
+    return np.select(
+        [np.isin(action, ['買進', '現金增資']), np.isin(action, ['賣出', '現金股利']), action == '入金', action == '出金'],
+        [-(gross_amount + total_fees), gross_amount - total_fees, gross_amount, -gross_amount],
+        default=0
+    )
+
+def calculate_fees_batch(qty, price, action, discount=1.0, stock_id=""):
+    """
+    calculate_fees 的陣列版：各參數可為陣列或純量 (自動廣播)
+    回傳與 calculate_fees 同名欄位的 int64 陣列；取整 (int 截斷)、最低手續費與 ETF 稅率規則完全相同
+    """
+    qty, price, discount = (np.asarray(v, dtype='float64') for v in (qty, price, discount))
+    action = np.asarray(action, dtype=object)
+    stock_id = np.asarray(stock_id, dtype=object)
+    qty, price, discount, action, stock_id = np.broadcast_arrays(qty, price, discount, action, stock_id)
+
+    gross_amount = np.trunc(qty * price).astype('int64')
+    raw_commission = np.trunc(gross_amount * COMMISSION_RATE * discount).astype('int64')
+    commission = np.where(np.isin(action, ['買進', '賣出']) & (gross_amount > 0), np.maximum(raw_commission, MIN_FEE), 0)
+
+    is_etf = pd.Series(stock_id.ravel()).astype(str).str.strip().str.startswith("00").to_numpy(dtype=bool).reshape(action.shape)
+    tax = np.where(action == '賣出', np.trunc(gross_amount * np.where(is_etf, ETF_TAX_RATE, TAX_RATE)), 0).astype('int64')
+
+    other_fees = np.zeros(action.shape, dtype='int64')
+    total_fees = commission + tax + other_fees
+    return {
+        "gross_amount": gross_amount,
+        "commission": commission,
+        "tax": tax,
+        "other_fees": other_fees,
+        "total_fees": total_fees,
+        "net_cash_flow": _net_cash_flow(gross_amount, total_fees, action).astype('int64')
+    }
+
+def audit_fees(df, discounts=None):
+    """
+    一次驗證帳本已存的費用欄位是否與 calculate_fees 規則一致
+    discounts: {交易帳戶: 手續費折數}；沒有對應折數的帳戶不檢查手續費 (沿用已存值推算其餘欄位)
+    其他費用為手動輸入欄位不檢查，但會計入總費用與淨收付
+    回傳不一致的欄位 (一列一個欄位)：交易ID、交易日期、股票代號、交易類別、交易帳戶、欄位、已存、預期
+    """
+    key_cols = ['交易ID', '交易日期', '股票代號', '交易類別', '交易帳戶']
+    empty = pd.DataFrame(columns=key_cols + ['欄位', '已存', '預期'])
+    if df.empty: return empty
+    df = normalize_ledger(df)
+    stored = {col: df[col].to_numpy(dtype='float64') if col in df.columns else None for col in FEE_COLUMNS.values()}
+    action = df['交易類別'].astype(str).to_numpy(dtype=object)
+
+    discount = df['交易帳戶'].astype(str).map(discounts or {}).to_numpy(dtype='float64') \
+        if '交易帳戶' in df.columns else np.full(len(df), np.nan)
+    known = ~np.isnan(discount)
+    fees = calculate_fees_batch(df['股數'].to_numpy(), df['單價'].to_numpy(), action,
+                                np.where(known, discount, 1.0), df['股票代號'].astype(str).to_numpy(dtype=object))
+
+    commission = fees['commission'] if stored['手續費'] is None else np.where(known, fees['commission'], stored['手續費'])
+    other_fees = stored['其他費用'] if stored['其他費用'] is not None else fees['other_fees']
+    total_fees = commission + fees['tax'] + other_fees
+    expected = {
+        '成交總金額': fees['gross_amount'], '手續費': commission, '交易稅': fees['tax'],
+        '總費用': total_fees, '淨收付金額': _net_cash_flow(fees['gross_amount'], total_fees, action)
+    }
+
+    keys = df.reindex(columns=key_cols)
+    mismatches = []
+    for col, values in expected.items():
+        if stored[col] is None: continue
+        bad = stored[col] != values
+        if bad.any():
+            mismatches.append(keys[bad].assign(欄位=col, 已存=stored[col][bad], 預期=values[bad]))
+    if not mismatches: return empty
+    return pd.concat(mismatches).sort_index(kind='stable').reset_index(drop=True)
+
 def generate_txn_id():
     return f"TXN-{str(uuid.uuid4())[:8].upper()}"
 
@@ -73,196 +164,442 @@ def _safe_float(value):
     except:
         return 0.0
 
+# --- 交易紀錄欄位型別 ---
+LEDGER_DATE_COL = '交易日期'
+LEDGER_INT_COLS = ['股數']
+LEDGER_MONEY_COLS = ['單價', '手續費', '交易稅', '其他費用', '成交總金額', '總費用', '淨收付金額']
+LEDGER_CATEGORY_COLS = ['股票代號', '交易類別', '交易帳戶']
+LEDGER_TEXT_COLS = ['交易ID', '股票名稱', '備註']
+
+def _to_number(series):
+    """整欄轉數值 (移除 $ 與 ,)，無法轉換者為 0，規則同 _safe_float"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.fillna(0).astype('float64')
+    clean = series.astype(str).str.replace(r'[$,\s]', '', regex=True)
+    return pd.to_numeric(clean, errors='coerce').fillna(0).astype('float64')
+
+def is_typed_ledger(df):
+    return (LEDGER_DATE_COL in df.columns
+            and pd.api.types.is_datetime64_any_dtype(df[LEDGER_DATE_COL])
+            and all(pd.api.types.is_numeric_dtype(df[c]) for c in LEDGER_MONEY_COLS if c in df.columns))
+
+def normalize_ledger(df):
+    """
+    將交易紀錄轉為型別化帳本 (讀取時做一次即可)
+    - 交易日期: datetime64
+    - 股數: int64 (含零股小數時保留 float64)
+    - 金額欄位: float64
+    - 股票代號 / 交易類別 / 交易帳戶: category
+    已型別化的帳本直接回傳
+    """
+    if df.empty or is_typed_ledger(df): return df
+    df = df.copy()
+    df.columns = df.columns.str.strip()
+
+    if LEDGER_DATE_COL in df.columns:
+        df[LEDGER_DATE_COL] = pd.to_datetime(df[LEDGER_DATE_COL], errors='coerce')
+    for col in LEDGER_INT_COLS:
+        if col not in df.columns: continue
+        values = _to_number(df[col])
+        df[col] = values.astype('int64') if (values % 1 == 0).all() else values
+    for col in LEDGER_MONEY_COLS:
+        if col in df.columns: df[col] = _to_number(df[col])
+    for col in LEDGER_CATEGORY_COLS + LEDGER_TEXT_COLS:
+        if col not in df.columns: continue
+        df[col] = df[col].fillna('').astype(str).str.strip()
+        if col in LEDGER_CATEGORY_COLS: df[col] = df[col].astype('category')
+    return df
+
 def _get_action_sort_order(action):
     if action in ['買進', '現金增資', '股票股利']: return 1
     elif action == '賣出': return 2
     else: return 3
 
-def calculate_fifo_report(df):
-    df.columns = df.columns.str.strip()
-    col_date = '交易日期'
-    col_id = '股票代號'
-    col_name = '股票名稱'
-    col_action = '交易類別'
-    col_qty = '股數'
-    col_price = '單價'
-    col_fee = '手續費'
-    col_tax = '交易稅'
-    col_other = '其他費用'
-
-    df[col_date] = pd.to_datetime(df[col_date])
-    df['sort_order'] = df[col_action].apply(_get_action_sort_order)
-    df = df.sort_values(by=[col_date, 'sort_order']).reset_index(drop=True)
-    
-    portfolio = {} 
-    names_map = {}
-
-    for _, row in df.iterrows():
-        sid = str(row.get(col_id, '')).strip()
-        action = row.get(col_action, '')
-        stock_name = str(row.get(col_name, '')).strip()
-        if action in ['入金', '出金']: continue
-        if sid and stock_name: names_map[sid] = stock_name
-        
-        qty = _safe_float(row.get(col_qty))
-        price = _safe_float(row.get(col_price))
-        fee = _safe_float(row.get(col_fee))
-        tax = _safe_float(row.get(col_tax))
-        other = _safe_float(row.get(col_other))
-        total_buy_cost = (qty * price) + fee + other
-        
-        if sid not in portfolio: portfolio[sid] = deque()
+def _sorted_ledger(df):
+    """依日期、同日先買後賣排序 (不修改傳入的 DataFrame)"""
+    df = normalize_ledger(df)
+    order = df['交易類別'].map(_get_action_sort_order).astype('int64')
+    return df.assign(sort_order=order).sort_values(by=['交易日期', 'sort_order'], kind='stable').reset_index(drop=True)
 
-        if action in ['買進', '現金增資']:
-            unit_cost = total_buy_cost / qty if qty > 0 else 0
-            portfolio[sid].append({'qty': qty, 'unit_cost': unit_cost})
-        elif action == '股票股利':
-            portfolio[sid].append({'qty': qty, 'unit_cost': (fee+other)/qty if qty>0 else 0})
-        elif action == '賣出':
-            sell_qty = qty
-            while sell_qty > 0 and portfolio[sid]:
-                batch = portfolio[sid].popleft()
-                if batch['qty'] > sell_qty:
-                    batch['qty'] -= sell_qty
-                    portfolio[sid].appendleft(batch)
-                    sell_qty = 0
-                else:
-                    sell_qty -= batch['qty']
-    
-    report_data = []
-    EPSILON = 0.001
-    for sid, batches in portfolio.items():
-        total_shares = sum(b['qty'] for b in batches)
-        if total_shares > EPSILON:
-            total_cost = sum(b['qty'] * b['unit_cost'] for b in batches)
-            report_data.append({
-                '股票代號': sid,
-                '股票名稱': names_map.get(sid, '未命名'),
-                '庫存股數': int(total_shares),
-                '總持有成本 (FIFO)': int(total_cost),
-                '平均成本': round(total_cost / total_shares, 2)
-            })
-    return pd.DataFrame(report_data)
+# --- 帳本引擎 (單次走訪：庫存 / 已實現損益 / 股息 / 帳戶餘額) ---
+VECTORIZE_MIN_ROWS = 5000      # 整本重建超過此列數時改用 fifo_kernel 向量化沖銷
+LEDGER_KEY_COL = '交易ID'
+LEDGER_ENGINE_COLS = ['交易日期', '股票代號', '股票名稱', '交易類別', '股數', '單價', '手續費', '交易稅', '其他費用',
+                      '交易帳戶', '淨收付金額']
 
-def calculate_unrealized_pnl(df_fifo, current_price_map):
-    if df_fifo.empty: return df_fifo
-    df_fifo['股票'] = df_fifo.apply(lambda row: f"{row['股票名稱']}({row['股票代號']})", axis=1)
-    df_fifo['目前市價'] = df_fifo['股票代號'].map(current_price_map).fillna(0)
-    df_fifo['股票市值'] = df_fifo.apply(lambda row: row['庫存股數'] * row['目前市價'], axis=1)
-    
-    total_market_value = df_fifo['股票市值'].sum()
-    df_fifo['佔總資產比例 (%)'] = df_fifo.apply(
-        lambda row: 0 if total_market_value == 0 else (row['股票市值'] / total_market_value) * 100, axis=1
-    )
-    
-    def get_sell_costs(row):
-        market_value = int(row['股票市值'])
-        stock_id = str(row['股票代號']).strip()
-        if market_value == 0: return 0, 0, 0 
-        current_tax_rate = ETF_TAX_RATE if stock_id.startswith("00") else TAX_RATE
-        tax = int(market_value * current_tax_rate)
-        raw_comm = int(market_value * COMMISSION_RATE)
-        comm = max(raw_comm, MIN_FEE)
-        return tax + comm, comm, tax
-
-    costs_df = df_fifo.apply(get_sell_costs, axis=1, result_type='expand')
-    costs_df.columns = ['total_fee', 'comm', 'tax']
-    df_fifo['未實現損益'] = df_fifo['股票市值'] - df_fifo['總持有成本 (FIFO)'] - costs_df['total_fee']
-    df_fifo['報酬率 (%)'] = df_fifo.apply(
-        lambda row: 0 if row['總持有成本 (FIFO)'] == 0 else (row['未實現損益'] / row['總持有成本 (FIFO)']) * 100, axis=1
-    )
-    df_fifo['賣出額外費用'] = costs_df.apply(lambda x: f"{int(x['total_fee'])} ({int(x['comm'])}+{int(x['tax'])})", axis=1)
-    df_fifo['配息金額'] = 0
-    df_fifo = df_fifo.sort_values(by='佔總資產比例 (%)', ascending=False).reset_index(drop=True)
-    return df_fifo
+def _category_codes(series):
+    """回傳 (每列的類別編號, 類別字串陣列)"""
+    cat = series if isinstance(series.dtype, pd.CategoricalDtype) else series.astype(str).astype('category')
+    labels = cat.cat.categories.astype(str).to_numpy(dtype=object)
+    return cat.cat.codes.to_numpy().astype(np.int64), labels
 
-def calculate_realized_report(df):
-    df.columns = df.columns.str.strip()
-    col_date = '交易日期'
-    col_id = '股票代號'
-    col_name = '股票名稱'
-    col_action = '交易類別'
-    col_qty = '股數'
-    col_price = '單價'
-    col_fee = '手續費'
-    col_tax = '交易稅'
-    col_other = '其他費用'
-
-    df[col_date] = pd.to_datetime(df[col_date])
-    df['sort_order'] = df[col_action].apply(_get_action_sort_order)
-    df = df.sort_values(by=[col_date, 'sort_order']).reset_index(drop=True)
-    
-    portfolio = {} 
-    realized_records = []
-
-    for _, row in df.iterrows():
-        action = row.get(col_action, '')
-        if action in ['入金', '出金']: continue
-        sid = str(row.get(col_id, '')).strip()
-        stock_name = str(row.get(col_name, '')).strip()
-        txn_date = row[col_date]
-        qty = _safe_float(row.get(col_qty))
-        price = _safe_float(row.get(col_price))
-        fee = _safe_float(row.get(col_fee))
-        tax = _safe_float(row.get(col_tax))
-        other = _safe_float(row.get(col_other))
-        total_buy_cost_raw = (qty * price) + fee + other
+class LedgerResult:
+    """
+    帳本引擎的一次結果 (皆為複本，可自由修改)
+    - lots: {股票代號: [(股數, 單位成本), ...]} 未平倉批次 (FIFO 順序)
+    - holdings: 目前庫存 (calculate_fifo_report 欄位)
+    - realized: 賣出與股息紀錄 (calculate_realized_report 欄位)
+    - trades / dividends: realized 中的賣出 / 股息
+    - balances: {交易帳戶: 現金餘額}
+    """
+    def __init__(self, lots, holdings, realized, balances):
+        self.lots = lots
+        self.holdings = holdings
+        self.realized = realized
+        self.balances = balances
+
+    @property
+    def trades(self):
+        return self.realized[self.realized['交易類別'] == '賣出'] if not self.realized.empty else self.realized
+
+    @property
+    def dividends(self):
+        return self.realized[self.realized['交易類別'] == '股息'] if not self.realized.empty else self.realized
+
+class LedgerEngine:
+    """
+    常駐的帳本狀態，依日期 (同日先買後賣) 走訪一次交易即同時維護：
+    每檔股票的 FIFO 批次佇列、已實現損益/股息紀錄、各帳戶現金餘額
+    update() 只套用尚未見過的交易 (每筆 O(1))；下列情況才整本重建：
+    - 已套用的交易被修改或刪除 (以列內容雜湊比對)
+    - 新交易排在高水位之前 (補登較早日期，會改變 FIFO 順序)
+    - 列順序改變 (同日同類交易依列順序套用)，或交易ID 缺漏/重複無法辨識新交易
+    多個 session 共用，以 lock 保護
+    """
+    def __init__(self, vectorize_min_rows=VECTORIZE_MIN_ROWS):
+        self.lock = threading.RLock()
+        self.vectorize_min_rows = vectorize_min_rows
+        self.stats = {"rebuilds": 0, "incremental": 0, "vectorized": 0, "applied_rows": 0}
+        self.reset()
+
+    def reset(self):
+        self.portfolio = {}          # sid -> deque of {'qty', 'unit_cost'}
+        self.names_map = {}
+        self.realized_records = []
+        self.balances = {}
+        self.has_balances = False    # 帳本有 交易帳戶 / 淨收付金額 欄位
+        self.applied_ids = np.array([], dtype=object)        # 已套用的交易ID (帳本列順序)
+        self.applied_hashes = np.array([], dtype='uint64')   # 對應的列內容雜湊
+        self.applied_set = set()
+        self.high_water = None       # 最後套用交易的 (交易日期, sort_order)
+        self.rows = {}               # sid -> 庫存報表列快取 (None 表示已無庫存)
+        self.dirty = set()
+        self.realized_base = None    # 向量化重建產生的已實現紀錄 (之後新增的仍放 realized_records)
+        self.realized_df = None      # 已實現報表快取 (None 表示需重建)
+
+    def _apply(self, txn_date, sid, stock_name, action, qty, price, fee, tax, other, account, net_cash):
+        if account: self.balances[account] = self.balances.get(account, 0.0) + net_cash
+        if action in ['入金', '出金']: return
+        if sid and stock_name: self.names_map[sid] = stock_name
+        total_buy_cost = (qty * price) + fee + other
         net_sell_proceeds = (qty * price) - fee - tax - other
-        
-        if sid not in portfolio: portfolio[sid] = deque()
+        lots = self.portfolio.setdefault(sid, deque())
+        self.dirty.add(sid)
+
         if action in ['買進', '現金增資']:
-            unit_cost = total_buy_cost_raw / qty if qty > 0 else 0
-            portfolio[sid].append({'qty': qty, 'unit_cost': unit_cost})
+            unit_cost = total_buy_cost / qty if qty > 0 else 0
+            lots.append({'qty': qty, 'unit_cost': unit_cost})
         elif action == '股票股利':
-            unit_cost = (fee + other) / qty if qty > 0 else 0
-            portfolio[sid].append({'qty': qty, 'unit_cost': unit_cost})
+            lots.append({'qty': qty, 'unit_cost': (fee+other)/qty if qty>0 else 0})
         elif action == '賣出':
             sell_qty = qty
             cost_basis = 0
-            while sell_qty > 0 and portfolio[sid]:
-                batch = portfolio[sid].popleft()
+            while sell_qty > 0 and lots:
+                batch = lots.popleft()
                 if batch['qty'] > sell_qty:
                     cost_basis += sell_qty * batch['unit_cost']
                     batch['qty'] -= sell_qty
-                    portfolio[sid].appendleft(batch)
+                    lots.appendleft(batch)
                     sell_qty = 0
                 else:
                     cost_basis += batch['qty'] * batch['unit_cost']
                     sell_qty -= batch['qty']
             realized_pnl = net_sell_proceeds - cost_basis
             ret_percent = (realized_pnl / cost_basis * 100) if cost_basis > 0 else 0
-            realized_records.append({
+            self.realized_records.append({
                 '交易日期': txn_date, '股票代號': sid, '股票名稱': stock_name, '交易類別': '賣出',
                 '已實現損益': int(realized_pnl), '報酬率 (%)': ret_percent, '本金(成本)': int(cost_basis)
             })
+            self.realized_df = None
         elif action == '現金股利':
-            realized_records.append({
+            self.realized_records.append({
                 '交易日期': txn_date, '股票代號': sid, '股票名稱': stock_name, '交易類別': '股息',
                 '已實現損益': int(net_sell_proceeds), '報酬率 (%)': 0, '本金(成本)': 0
             })
-    df_res = pd.DataFrame(realized_records)
-    if not df_res.empty:
-        df_res['年'] = df_res['交易日期'].dt.year
-        df_res['月'] = df_res['交易日期'].dt.strftime('%Y-%m')
-        df_res['股票'] = df_res.apply(lambda row: f"{row['股票名稱']}({row['股票代號']})", axis=1)
-    return df_res
-
-def calculate_account_balances(df):
-    """統計各帳戶的現金餘額 (暴力清洗版)"""
-    if df.empty: return {}
-    df.columns = df.columns.str.strip()
-    col_account = '交易帳戶'
-    col_net_cash = '淨收付金額'
-    if col_account not in df.columns or col_net_cash not in df.columns: return {}
-
-    df_calc = df.copy()
-    # [關鍵修正] 使用 regex=True 一次移除 , 和 $，並強制轉字串
-    df_calc[col_net_cash] = df_calc[col_net_cash].astype(str).str.replace(r'[$,]', '', regex=True)
-    df_calc[col_net_cash] = pd.to_numeric(df_calc[col_net_cash], errors='coerce').fillna(0)
+            self.realized_df = None
+
+    def _apply_frame(self, df):
+        n = len(df)
+        self.has_balances = '交易帳戶' in df.columns and '淨收付金額' in df.columns
+        tax = df['交易稅'] if '交易稅' in df.columns else np.zeros(n)
+        account = df['交易帳戶'] if self.has_balances else [''] * n
+        net_cash = df['淨收付金額'] if self.has_balances else np.zeros(n)
+        for row in zip(df['交易日期'], df['股票代號'], df['股票名稱'], df['交易類別'], df['股數'], df['單價'],
+                       df['手續費'], tax, df['其他費用'], account, net_cash):
+            self._apply(*row)
+        self.stats["applied_rows"] += n
+
+    def _load_vectorized(self, df):
+        """大型帳本整本重建：FIFO 沖銷交給 fifo_kernel，只把未平倉批次還原成 deque"""
+        n = len(df)
+        sid_codes, sid_labels = _category_codes(df['股票代號'])
+        action = df['交易類別']
+        qty = df['股數'].to_numpy()
+        price, fee, other = (df[c].to_numpy() for c in ['單價', '手續費', '其他費用'])
+        tax = df['交易稅'].to_numpy() if '交易稅' in df.columns else np.zeros(n)
+
+        stock = ~action.isin(['入金', '出金']).to_numpy()
+        is_buy = action.isin(['買進', '現金增資']).to_numpy()
+        is_lot = is_buy | (action == '股票股利').to_numpy()
+        is_sell = (action == '賣出').to_numpy()
+        is_div = (action == '現金股利').to_numpy()
+        safe_qty = np.where(qty > 0, qty, 1)
+        unit_cost = np.where(is_buy, ((qty * price) + fee + other) / safe_qty, (fee + other) / safe_qty)
+        unit_cost = np.where(qty > 0, unit_cost, 0)
+
+        # 股票依首次出現順序編號，與逐筆走訪建立 portfolio 的順序相同
+        rows = np.flatnonzero(stock)
+        group, first_seen = pd.factorize(sid_codes[rows])
+        cost_basis, open_rows, open_qty = fifo_kernel.match(
+            group.astype(np.int64), qty[rows], unit_cost[rows], is_lot[rows], is_sell[rows])
+
+        self.portfolio = {sid_labels[c]: deque() for c in first_seen}
+        # 轉成 Python 數值：之後的 sum / round 需與迴圈版相同 (NumPy 純量的 round 結果可能不同)
+        for row, remaining in zip(rows[open_rows].tolist(), open_qty.tolist()):
+            self.portfolio[sid_labels[sid_codes[row]]].append({'qty': remaining, 'unit_cost': float(unit_cost[row])})
+        self.dirty = set(self.portfolio)
+        # 名稱取每檔最後一筆非空白的名稱
+        named = np.flatnonzero(stock & (sid_labels[sid_codes] != '') & (df['股票名稱'] != '').to_numpy())
+        _, last = np.unique(sid_codes[named][::-1], return_index=True)
+        last_rows = named[::-1][last]
+        self.names_map = dict(zip(sid_labels[sid_codes[last_rows]], df['股票名稱'].iloc[last_rows]))
+
+        # 已實現損益 / 股息 (依帳本順序)
+        cost = np.zeros(n)
+        cost[rows] = cost_basis
+        net_sell_proceeds = (qty * price) - fee - tax - other
+        picked = np.flatnonzero(is_sell | is_div)
+        realized_pnl = np.where(is_sell, net_sell_proceeds - cost, net_sell_proceeds)[picked]
+        cost, sell_rows = cost[picked], is_sell[picked]
+        with_return = sell_rows & (cost > 0)
+        ret_percent = np.divide(realized_pnl, cost, out=np.zeros(len(cost)), where=with_return) * 100
+        self.realized_base = pd.DataFrame({
+            '交易日期': df['交易日期'].to_numpy()[picked],
+            '股票代號': sid_labels[sid_codes[picked]],
+            '股票名稱': df['股票名稱'].iloc[picked].reset_index(drop=True),
+            '交易類別': np.where(sell_rows, '賣出', '股息').astype(object),
+            '已實現損益': np.trunc(realized_pnl).astype(np.int64),
+            # 迴圈版在沒有任何賣出報酬時整欄為整數 0
+            '報酬率 (%)': ret_percent if with_return.any() else np.zeros(len(cost), dtype=np.int64),
+            '本金(成本)': np.trunc(np.where(sell_rows, cost, 0)).astype(np.int64),
+        }) if len(picked) else None
+
+        # 帳戶餘額：bincount 依帳本順序逐一累加，與逐筆走訪相同
+        self.has_balances = '交易帳戶' in df.columns and '淨收付金額' in df.columns
+        if self.has_balances:
+            acc_codes, acc_labels = _category_codes(df['交易帳戶'])
+            sums = np.bincount(acc_codes, weights=df['淨收付金額'].to_numpy(), minlength=len(acc_labels))
+            used = np.bincount(acc_codes, minlength=len(acc_labels)) > 0
+            self.balances = {acc: total for acc, total, ok in zip(acc_labels, sums.tolist(), used) if ok and acc != ''}
+        self.realized_df = None
+        self.stats["applied_rows"] += n
+        self.stats["vectorized"] += 1
+
+    def _vectorizable(self, df):
+        """股數皆為非負整數才走向量化 (零股小數的逐次相減需保留迴圈的浮點行為)"""
+        return len(df) >= self.vectorize_min_rows and pd.api.types.is_integer_dtype(df['股數']) and (df['股數'] >= 0).all()
+
+    def _mark(self, ordered, ids, hashes):
+        self.applied_ids, self.applied_hashes = ids, hashes
+        self.applied_set = set(ids)
+        last = ordered.iloc[-1]
+        self.high_water = (last['交易日期'].to_datetime64(), last['sort_order'])
+
+    def _rebuild(self, df, ids=None, hashes=None):
+        self.reset()
+        self.stats["rebuilds"] += 1
+        if df.empty: return
+        ordered = _sorted_ledger(df)
+        if self._vectorizable(ordered): self._load_vectorized(ordered)
+        else: self._apply_frame(ordered)
+        if ids is not None: self._mark(ordered, ids, hashes)
+
+    def _is_append(self, ids, hashes):
+        """帳本前段與上次套用時完全相同 (交易ID 與內容)，只在尾端新增了不重複的交易"""
+        n = len(self.applied_ids)
+        if self.high_water is None or len(ids) < n: return False
+        if not ((ids[:n] == self.applied_ids).all() and (hashes[:n] == self.applied_hashes).all()): return False
+        new_ids = ids[n:]
+        return not (new_ids == '').any() and len(set(new_ids)) == len(new_ids) and self.applied_set.isdisjoint(new_ids)
+
+    def update(self, df):
+        """把帳本同步進狀態；回傳 'incremental' / 'rebuild' / 'unchanged'"""
+        df = normalize_ledger(df)
+        with self.lock:
+            if df.empty or LEDGER_KEY_COL not in df.columns or df['交易日期'].isna().any():
+                self._rebuild(df)
+                return 'rebuild'
+            ids = df[LEDGER_KEY_COL].astype(str).to_numpy(dtype=object)
+            cols = [c for c in LEDGER_ENGINE_COLS if c in df.columns]
+            hashes = pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+            if not self._is_append(ids, hashes):
+                # 歷史列被修改/刪除/重排，或交易ID 缺漏重複
+                unique_ids = not (ids == '').any() and not pd.Index(ids).has_duplicates
+                self._rebuild(df, *((ids, hashes) if unique_ids else ()))
+                return 'rebuild'
+            n = len(self.applied_ids)
+            if n == len(ids): return 'unchanged'
+
+            # 新交易必須排在高水位之後 (同鍵值時本來就在舊交易之後)，否則會改變既有批次的 FIFO 順序
+            new = df.iloc[n:]
+            hw_date, hw_order = self.high_water
+            dates = new['交易日期'].to_numpy()
+            order = new['交易類別'].map(_get_action_sort_order).astype('int64').to_numpy()
+            if ((dates < hw_date) | ((dates == hw_date) & (order < hw_order))).any():
+                self._rebuild(df, ids, hashes)
+                return 'rebuild'
+
+            ordered = _sorted_ledger(new)
+            self._apply_frame(ordered)
+            self.applied_set.update(ids[n:])
+            self.applied_ids, self.applied_hashes = ids, hashes
+            last = ordered.iloc[-1]
+            self.high_water = (last['交易日期'].to_datetime64(), last['sort_order'])
+            self.stats["incremental"] += 1
+            return 'incremental'
+
+    # --- 報表 ---
+    def holdings(self):
+        """目前庫存 (只重算有變動的股票)"""
+        EPSILON = 0.001
+        with self.lock:
+            for sid in self.dirty:
+                batches = self.portfolio[sid]
+                total_shares = sum(b['qty'] for b in batches)
+                if total_shares > EPSILON:
+                    total_cost = sum(b['qty'] * b['unit_cost'] for b in batches)
+                    self.rows[sid] = (int(total_shares), int(total_cost), round(total_cost / total_shares, 2))
+                else:
+                    self.rows[sid] = None
+            self.dirty.clear()
+            report_data = []
+            for sid in self.portfolio:
+                row = self.rows[sid]
+                if row is None: continue
+                report_data.append({
+                    '股票代號': sid,
+                    '股票名稱': self.names_map.get(sid, '未命名'),
+                    '庫存股數': row[0],
+                    '總持有成本 (FIFO)': row[1],
+                    '平均成本': row[2]
+                })
+        return pd.DataFrame(report_data)
+
+    def realized(self):
+        """已實現損益與股息 (有新紀錄才重建 DataFrame)"""
+        with self.lock:
+            if self.realized_df is None:
+                df_res = pd.DataFrame(self.realized_records)
+                if self.realized_base is not None:
+                    df_res = pd.concat([self.realized_base, df_res], ignore_index=True) if not df_res.empty else self.realized_base.copy()
+                if not df_res.empty:
+                    df_res['年'] = df_res['交易日期'].dt.year
+                    df_res['月'] = df_res['交易日期'].dt.strftime('%Y-%m')
+                    df_res['股票'] = df_res['股票名稱'] + '(' + df_res['股票代號'] + ')'
+                self.realized_df = df_res
+            return self.realized_df.copy()
+
+    def account_balances(self):
+        with self.lock:
+            return dict(sorted(self.balances.items())) if self.has_balances else {}
+
+    def lots(self):
+        with self.lock:
+            return {sid: [(b['qty'], b['unit_cost']) for b in batches] for sid, batches in self.portfolio.items() if batches}
+
+    def result(self):
+        with self.lock:
+            return LedgerResult(self.lots(), self.holdings(), self.realized(), self.account_balances())
+
+_ledger_engine = LedgerEngine()
+
+def get_ledger_engine_stats():
+    return dict(_ledger_engine.stats, symbols=len(_ledger_engine.portfolio), transactions=len(_ledger_engine.applied_ids))
+
+def check_engine_parity(df):
+    """
+    以逐筆迴圈與 fifo_kernel 向量化各整本重建一次並比對結果
+    回傳不一致的項目名稱 list (空 list 表示一致)；帳本不適用向量化 (零股小數等) 時回傳 None
+    """
+    loop = LedgerEngine(vectorize_min_rows=float('inf'))
+    kernel = LedgerEngine(vectorize_min_rows=0)
+    loop.update(df)
+    kernel.update(df)
+    if not kernel.stats["vectorized"]: return None
+    a, b = loop.result(), kernel.result()
+    diffs = [name for name, x, y in [('holdings', a.holdings, b.holdings), ('realized', a.realized, b.realized)] if not x.equals(y)]
+    if a.balances != b.balances: diffs.append('balances')
+    if a.lots != b.lots: diffs.append('lots')
+    return diffs
+
+def summarize_ledger(df, engine=None):
+    """走訪帳本一次 (預設使用 process 共用的增量引擎)，回傳 LedgerResult"""
+    engine = engine or _ledger_engine
+    with engine.lock:
+        engine.update(df)
+        return engine.result()
+
+def calculate_fifo_report(df, engine=None):
+    """目前庫存 (FIFO)"""
+    engine = engine or _ledger_engine
+    with engine.lock:
+        engine.update(df)
+        return engine.holdings()
+
+def calculate_unrealized_pnl(df_fifo, current_price_map):
+    if df_fifo.empty: return df_fifo
+    df_fifo['股票'] = df_fifo['股票名稱'].astype(str) + '(' + df_fifo['股票代號'].astype(str) + ')'
+    df_fifo['目前市價'] = df_fifo['股票代號'].map(current_price_map).fillna(0)
+    df_fifo['股票市值'] = df_fifo['庫存股數'] * df_fifo['目前市價']
+    
+    total_market_value = df_fifo['股票市值'].sum()
+    df_fifo['佔總資產比例 (%)'] = 0 if total_market_value == 0 else (df_fifo['股票市值'] / total_market_value) * 100
     
-    df_calc = df_calc[df_calc[col_account].astype(str).str.strip() != '']
-    balances = df_calc.groupby(col_account)[col_net_cash].sum().to_dict()
-    return balances
+    # 賣出費用：市值取整後計算稅與手續費 (ETF 以代號 00 開頭判斷)，市值為 0 時不計
+    market_value = np.trunc(df_fifo['股票市值'].to_numpy(dtype='float64')).astype('int64')
+    is_etf = df_fifo['股票代號'].astype(str).str.strip().str.startswith("00").to_numpy(dtype=bool)
+    tax = np.trunc(market_value * np.where(is_etf, ETF_TAX_RATE, TAX_RATE)).astype('int64')
+    comm = np.maximum(np.trunc(market_value * COMMISSION_RATE).astype('int64'), MIN_FEE)
+    held = market_value != 0
+    tax, comm = np.where(held, tax, 0), np.where(held, comm, 0)
+    total_fee = tax + comm
+
+    cost = df_fifo['總持有成本 (FIFO)']
+    df_fifo['未實現損益'] = df_fifo['股票市值'] - cost - total_fee
+    has_cost = (cost != 0).to_numpy()
+    ret = np.divide(df_fifo['未實現損益'].to_numpy(dtype='float64'), cost.to_numpy(dtype='float64'),
+                    out=np.zeros(len(cost)), where=has_cost) * 100
+    df_fifo['報酬率 (%)'] = ret if has_cost.any() else 0
+    fee_parts = pd.DataFrame({'total': total_fee, 'comm': comm, 'tax': tax}, index=df_fifo.index).astype(str)
+    df_fifo['賣出額外費用'] = fee_parts['total'] + ' (' + fee_parts['comm'] + '+' + fee_parts['tax'] + ')'
+    df_fifo['配息金額'] = 0
+    df_fifo = df_fifo.sort_values(by='佔總資產比例 (%)', ascending=False).reset_index(drop=True)
+    return df_fifo
+
+def calculate_realized_report(df, engine=None):
+    """已實現損益與股息紀錄"""
+    engine = engine or _ledger_engine
+    with engine.lock:
+        engine.update(df)
+        return engine.realized()
+
+def calculate_account_balances(df, engine=None):
+    """統計各帳戶的現金餘額"""
+    if df.empty: return {}
+    engine = engine or _ledger_engine
+    with engine.lock:
+        engine.update(df)
+        return engine.account_balances()
 
 def get_volume_multiplier(current_time_str, mp_df):
     if mp_df.empty: return 1.0
@@ -2,6 +2,20 @@
 # 檔案名稱: market_data.py
 # 
 # 修改歷程:
+# 2026-10-17 23:30:00: [Fix] 技術分析未命中的股票改為單一飛行 (同一檔同時只有一個 session 抓K線計算，其他等待結果)；抓取失敗的結果也寫入短期快取；進度條只在真的有股票要抓時才顯示
+# 2026-10-17 23:20:00: [Fix] 盤中試算依報價所屬交易日判斷取代或新增K線 (週末、假日、開盤前的現價即前一交易日收盤，不再重複計入)；報價未附交易日時依是否在盤中判斷
+# 2026-10-17 22:00:00: [Fix] 技術分析失敗 (Error / 無資料) 的結果在記憶體快取 60 秒，監控頁每秒刷新時不再每次重打 historical API
+# 2026-10-17 21:00:00: [Fix] 收盤後今日K線已入庫時，盤中試算不再把現價當成額外一根重複計入今日
+# 2026-10-17 13:00:00: [Perf] get_live_quotes 改為回傳欄式 QuoteColumns (NumPy 陣列，順序同輸入)，看板讀取不再逐檔建 dict
+# 2026-10-17 12:00:00: [Perf] 以中央排程器 (RequestScheduler) 取代 token bucket：每分鐘額度帳本、依 429 / rate-limit 標頭做 AIMD 併發調整、互動請求優先於背景預熱
+# 2026-10-17 11:00:00: [Perf] 技術分析結果改為 process 共用快取 (可落地)，以 (股票, 最近完成交易日) 為鍵，下次收盤 (13:30) 自動失效；計算基準改為台灣時間的最近完成交易日
+# 2026-10-17 10:00:00: [New] WebSocket 串流報價：get_live_quotes / get_board_prices 讀取 process 內的最新報價看板，看板沒有的股票才走 REST
+# 2026-10-17 09:00:00: [New] get_intraday_previews：以每檔滾動指標狀態 O(1) 試算「若現在收盤」的月線與乖離
+# 2026-10-16 23:00:00: [Perf] 新增 compute_ta_panel：多檔K線合併成一張長表，以 groupby-rolling 一次算完所有均線與訊號；批次技術分析改用此引擎
+# 2026-10-16 22:00:00: [Perf] get_technical_analysis 改從本地K線庫 (candle_store) 讀取，只向 API 補抓最後一根之後的區間；斷線時使用已存資料
+# 2026-10-16 21:00:00: [Perf] 新增全市場快照模式 (snapshot/quotes/TSE、OTC)：股票數達門檻時以兩次呼叫取代逐檔報價，兩個批次報價函式共用同一份快照
+# 2026-10-16 20:00:00: [Perf] 所有 Fugle 呼叫改用共用的 keep-alive 連線池 (FugleClient)：可設定逾時、帶 jitter 的重試、連線重用統計
+# 2026-10-16 19:00:00: [Perf] 批次報價/技術指標改為執行緒池並行抓取，以共用 token bucket 依方案額度限流 (取代固定 sleep)；失敗原因記在結果的 errors
 # 2025-11-23 19:53:00: [Update] 調整盤中戰情監控；現價移除$；格式套用千分位；10MA量改為張數
 # 2025-11-23: [Update] get_technical_analysis 增加回傳 debug_info (歷史資料末3筆)
 # 2025-11-23: [Fix] 修正 Vol10 計算邏輯 (排除當日、單位檢查)；加入除錯 Log
@@ -9,167 +23,784 @@
 
 import streamlit as st
 import requests
+import heapq
+import itertools
+import random
 import time
+import threading
+from collections import deque
+from requests.adapters import HTTPAdapter
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone, time as dtime
 
-def get_price_from_fugle(symbol, api_key):
+import candle_store
+import quote_stream
+
+# --- 常數設定 ---
+# Fugle 方案的每分鐘請求上限 (可在 secrets 以 fugle_rate_limit / fugle_history_rate_limit 覆寫)
+FUGLE_RATE_LIMIT = 60
+FUGLE_HISTORY_RATE_LIMIT = 60
+MAX_WORKERS = 8
+PRIORITY_INTERACTIVE = 0     # 使用者正在等的請求 (報價、按鈕觸發的技術分析)
+PRIORITY_BACKGROUND = 1      # 背景預熱
+BACKGROUND_BUDGET_SHARE = 0.8  # 背景請求最多用到每分鐘額度的比例 (保留給互動請求)
+AIMD_START = 4               # 初始併發數，成功時緩增、遇 429 減半
+RATE_LIMIT_COOLDOWN = 5      # 429 沒有 Retry-After 時暫停的秒數
+RATE_LIMIT_RETRIES = 3       # 429 的重試次數 (另計，不佔用一般重試)
+FUGLE_BASE_URL = "https://api.fugle.tw/marketdata/v1.0/stock"
+FUGLE_TIMEOUT = 5            # 秒 (可在 secrets 以 fugle_timeout 覆寫)
+FUGLE_RETRIES = 2            # 連線錯誤 / 逾時 / 5xx 的重試次數
+FUGLE_RETRY_BASE = 0.3       # 重試等待基準秒數 (指數退避 + jitter)
+RETRY_STATUS = (500, 502, 503, 504)
+SNAPSHOT_MARKETS = ("TSE", "OTC")
+SNAPSHOT_THRESHOLD = 20      # 股票數達此門檻改用全市場快照 (可在 secrets 以 fugle_snapshot_threshold 覆寫)
+SNAPSHOT_TTL = 10            # 快照共用秒數 (首頁與監控頁在此期間內共用同一份)
+
+# --- HTTP 連線池 ---
+class FugleClient:
+    """
+    共用的 Fugle HTTP client：requests.Session + 連線池 (keep-alive，避免每次重新 TCP/TLS 交握)
+    get() 遇到連線錯誤、逾時或 5xx 時以指數退避加隨機 jitter 重試
+    """
+    def __init__(self, timeout=FUGLE_TIMEOUT, retries=FUGLE_RETRIES, pool_size=MAX_WORKERS, base_url=FUGLE_BASE_URL, scheduler=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.base_url = base_url
+        self.scheduler = scheduler
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.counters = {"requests": 0, "retries": 0, "errors": 0, "rate_limited": 0}
+        self.lock = threading.Lock()
+
+    def _count(self, key):
+        with self.lock: self.counters[key] += 1
+
+    def get(self, path, api_key, params=None):
+        """
+        有排程器時每次送出前先向排程器取得許可 (額度 / 併發 / 優先序)，回應交還排程器調整速率
+        429 由排程器決定暫停多久後重試 (另計 RATE_LIMIT_RETRIES 次)
+        """
+        url = path if path.startswith("http") else f"{self.base_url}/{path}"
+        headers = {"X-API-KEY": api_key}
+        kind = "historical" if path.startswith("historical") else "intraday"
+        attempt = throttled = 0
+        while True:
+            self._count("requests")
+            if self.scheduler: self.scheduler.acquire(kind, current_priority())
+            response = None
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    self._count("errors")
+                    raise
+            finally:
+                if self.scheduler: self.scheduler.release(kind, response)
+            if response is not None and response.status_code == 429:
+                self._count("rate_limited")
+                if throttled == RATE_LIMIT_RETRIES or not self.scheduler: return response
+                throttled += 1
+                continue
+            if response is not None and (response.status_code not in RETRY_STATUS or attempt == self.retries):
+                return response
+            self._count("retries")
+            time.sleep(FUGLE_RETRY_BASE * (2 ** attempt) + random.uniform(0, FUGLE_RETRY_BASE))
+            attempt += 1
+
+    def stats(self):
+        """請求數、重試數，以及連線池實際建立的連線數 (請求數 - 連線數 = 重用次數)"""
+        pools = self.adapter.poolmanager.pools
+        connections = sum(pools[key].num_connections for key in pools.keys())
+        http_requests = sum(pools[key].num_requests for key in pools.keys())
+        with self.lock: out = dict(self.counters)
+        out.update(connections=connections, reused=max(http_requests - connections, 0))
+        return out
+
+@st.cache_resource
+def get_fugle_client():
+    """process 共用的 FugleClient (所有 session 共用連線池)"""
+    try: timeout = float(st.secrets.get("fugle_timeout", FUGLE_TIMEOUT))
+    except Exception: timeout = FUGLE_TIMEOUT
+    return FugleClient(timeout=timeout, scheduler=get_scheduler())
+
+def get_connection_stats():
+    return get_fugle_client().stats()
+
+# --- 流量控制 (中央排程) ---
+_request_context = threading.local()
+
+def current_priority():
+    return getattr(_request_context, "priority", PRIORITY_INTERACTIVE)
+
+def _header_seconds(value, now):
+    """Retry-After / X-RateLimit-Reset：可能是秒數或 epoch 時間"""
+    try: value = float(value)
+    except (TypeError, ValueError): return None
+    return value - now if value > 1e9 else value
+
+class RequestScheduler:
+    """
+    所有 Fugle 請求的中央排程 (process 共用)
+    - 每分鐘額度帳本：依類別 (intraday / historical) 記錄最近 60 秒送出的請求，滿額時等到最舊一筆滿 60 秒
+    - AIMD 併發：每次成功 limit += 1/limit，遇 429 減半，並依 Retry-After / X-RateLimit-Reset 暫停該類別
+    - 優先序：可送出的請求中，互動 (INTERACTIVE) 永遠先於背景 (BACKGROUND)；背景最多用到額度的 BACKGROUND_BUDGET_SHARE
+    """
+    def __init__(self, budgets, max_concurrency=MAX_WORKERS, start=AIMD_START):
+        self.budgets = dict(budgets)
+        self.ledger = {kind: deque() for kind in budgets}
+        self.paused_until = {kind: 0.0 for kind in budgets}
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(start, max_concurrency))
+        self.in_flight = 0
+        self.waiting = []               # heap of (priority, seq, kind)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.stats = {"sent": 0, "rate_limited": 0, "interactive": 0, "background": 0}
+
+    def _wait_time(self, kind, priority, now):
+        """此類別/優先序距離可送出的秒數 (0 表示可立即送出)"""
+        ledger = self.ledger[kind]
+        while ledger and now - ledger[0] >= 60: ledger.popleft()
+        budget = self.budgets[kind]
+        if priority != PRIORITY_INTERACTIVE: budget = max(1, int(budget * BACKGROUND_BUDGET_SHARE))
+        wait = max(0.0, self.paused_until[kind] - now)
+        if len(ledger) >= budget: wait = max(wait, 60 - (now - ledger[len(ledger) - budget]))
+        return wait
+
+    def acquire(self, kind, priority=PRIORITY_INTERACTIVE):
+        with self.cond:
+            ticket = (priority, next(self.seq), kind)
+            heapq.heappush(self.waiting, ticket)
+            while True:
+                now = time.time()
+                waits = {t: self._wait_time(t[2], t[0], now) for t in self.waiting}
+                ready = [t for t in self.waiting if waits[t] <= 0]
+                if ready and min(ready) == ticket and self.in_flight < int(self.limit):
+                    break
+                self.cond.wait(min([w for w in waits.values() if w > 0] + [0.5]))
+            self.waiting.remove(ticket)
+            heapq.heapify(self.waiting)
+            self.in_flight += 1
+            self.ledger[kind].append(now)
+            self.stats["sent"] += 1
+            self.stats["interactive" if priority == PRIORITY_INTERACTIVE else "background"] += 1
+            self.cond.notify_all()
+
+    def release(self, kind, response=None):
+        """交還併發名額；依回應狀態與 rate-limit 標頭調整併發與暫停時間"""
+        with self.cond:
+            self.in_flight -= 1
+            if response is not None:
+                now = time.time()
+                headers = response.headers or {}
+                if response.status_code == 429:
+                    self.stats["rate_limited"] += 1
+                    self.limit = max(1.0, self.limit / 2)
+                    pause = _header_seconds(headers.get("Retry-After"), now) or _header_seconds(headers.get("X-RateLimit-Reset"), now)
+                    self.paused_until[kind] = max(self.paused_until[kind], now + (pause or RATE_LIMIT_COOLDOWN))
+                else:
+                    self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+                    if headers.get("X-RateLimit-Limit", "").isdigit():
+                        self.budgets[kind] = int(headers["X-RateLimit-Limit"])
+                    if headers.get("X-RateLimit-Remaining") == "0":
+                        reset = _header_seconds(headers.get("X-RateLimit-Reset"), now)
+                        if reset: self.paused_until[kind] = max(self.paused_until[kind], now + reset)
+            self.cond.notify_all()
+
+    def snapshot(self):
+        """供除錯頁顯示：目前併發上限、進行中請求數、各類別最近一分鐘用量"""
+        with self.cond:
+            now = time.time()
+            usage = {}
+            for kind, ledger in self.ledger.items():
+                while ledger and now - ledger[0] >= 60: ledger.popleft()
+                usage[kind] = {"used": len(ledger), "budget": self.budgets[kind],
+                               "paused": round(max(0.0, self.paused_until[kind] - now), 1)}
+            return dict(self.stats, limit=round(self.limit, 2), in_flight=self.in_flight,
+                        waiting=len(self.waiting), usage=usage)
+
+@st.cache_resource
+def get_scheduler():
+    """process 共用的請求排程器 (所有 session 一起受方案額度限制)"""
+    budgets = {}
+    for kind, key, default in (("intraday", "fugle_rate_limit", FUGLE_RATE_LIMIT),
+                               ("historical", "fugle_history_rate_limit", FUGLE_HISTORY_RATE_LIMIT)):
+        try: budgets[kind] = int(st.secrets.get(key, default))
+        except Exception: budgets[kind] = default
+    return RequestScheduler(budgets)
+
+def get_scheduler_stats():
+    return get_scheduler().snapshot()
+
+class FetchResult(dict):
+    """{symbol: 結果} (依輸入順序)，另以 errors 記錄失敗的股票與原因"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.errors = {}
+
+def fetch_concurrent(fetch_fn, stock_list, priority=PRIORITY_INTERACTIVE, max_workers=MAX_WORKERS, on_progress=None):
+    """
+    以有限執行緒池並行呼叫 fetch_fn(symbol)；實際送出速率由排程器 (FugleClient) 依額度控制
+    priority 會帶給這批請求 (背景預熱用 PRIORITY_BACKGROUND)
+    fetch_fn 回傳 None 或拋出例外都視為失敗，原因記在 result.errors
+    on_progress(完成數, 總數) 在呼叫端執行緒回報進度
+    """
+    symbols = list(dict.fromkeys(stock_list))
+    outcomes = {}
+
+    def task(symbol):
+        _request_context.priority = priority
+        try: return fetch_fn(symbol)
+        finally: _request_context.priority = PRIORITY_INTERACTIVE
+
+    if symbols:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(symbols))) as pool:
+            futures = {pool.submit(task, s): s for s in symbols}
+            for done, future in enumerate(as_completed(futures), 1):
+                symbol = futures[future]
+                try:
+                    value = future.result()
+                    outcomes[symbol] = (value, None if value is not None else "無資料")
+                except Exception as e:
+                    outcomes[symbol] = (None, str(e) or type(e).__name__)
+                if on_progress: on_progress(done, len(symbols))
+
+    result = FetchResult()
+    for symbol in symbols:
+        value, error = outcomes[symbol]
+        if error: result.errors[symbol] = error
+        else: result[symbol] = value
+    return result
+
+def _http_error(response):
+    """非 200 回應的錯誤說明 (429 表示重試後仍超過額度)"""
+    return f"HTTP {response.status_code}" + (" (超過 API 額度)" if response.status_code == 429 else "")
+
+# --- 即時報價 ---
+def _fetch_quote(symbol, api_key, client=None):
+    """呼叫 intraday/quote；非 200 時拋出例外 (由呼叫端決定回傳 None 或記錄錯誤)"""
+    response = (client or get_fugle_client()).get(f"intraday/quote/{symbol}", api_key)
+    if response.status_code != 200:
+        raise Exception(_http_error(response))
+    return response.json()
+
+def _parse_price(data):
+    last_price = None
+    if 'total' in data and data['total'].get('price') is not None: last_price = data['total']['price']
+    elif 'quote' in data and data['quote'].get('close') is not None: last_price = data['quote']['close']
+    elif 'trade' in data and data['trade'].get('price') is not None: last_price = data['trade']['price']
+    elif data.get('price') is not None: last_price = data['price']
+    if last_price is None: last_price = data.get('lastPrice', 0)
+    return float(last_price)
+
+def _parse_detailed_quote(data):
+    last_price = 0
+    if 'total' in data: last_price = data['total'].get('price', 0)
+    elif 'quote' in data: last_price = data['quote'].get('close', 0)
+    elif 'trade' in data: last_price = data['trade'].get('price', 0)
+    if last_price == 0: last_price = data.get('lastPrice', 0)
+
+    change_percent = 0
+    if 'quote' in data: change_percent = data['quote'].get('changePercent', 0)
+    elif 'changePercent' in data: change_percent = data['changePercent']
+
+    volume = 0
+    if 'total' in data: volume = data['total'].get('tradeVolume', 0)
+    elif 'trade' in data: volume = data['trade'].get('volume', 0)
+
+    return {
+        "price": float(last_price),
+        "change_pct": float(change_percent),
+        "volume": int(volume),
+        "date": data.get('date'),
+        "last_updated": datetime.now().strftime('%H:%M:%S')
+    }
+
+# --- 全市場快照 ---
+def _parse_snapshot(payload):
+    """snapshot/quotes 回應 → {symbol: {price, change_pct, volume, last_updated}}；尚未成交 (無價格) 的股票略過"""
+    out = {}
+    for item in payload.get('data', []):
+        price = item.get('closePrice') or item.get('lastPrice')
+        symbol = str(item.get('symbol', '')).strip()
+        if not symbol or not price: continue
+        out[symbol] = {
+            "price": float(price),
+            "change_pct": float(item.get('changePercent') or 0),
+            "volume": int(item.get('tradeVolume') or 0),
+            "date": item.get('date') or payload.get('date'),
+            "last_updated": datetime.now().strftime('%H:%M:%S')
+        }
+    return out
+
+@st.cache_resource
+def _snapshot_cache():
+    return {"data": {}, "fetched_at": 0.0, "lock": threading.Lock()}
+
+def get_market_snapshot(api_key, client=None):
+    """
+    取得上市 + 上櫃全市場快照 (兩次呼叫)，SNAPSHOT_TTL 秒內重複呼叫直接回傳同一份
+    任一市場失敗時拋出例外 (呼叫端改走逐檔報價)
+    """
+    cache = _snapshot_cache()
+    with cache["lock"]:
+        if time.time() - cache["fetched_at"] < SNAPSHOT_TTL: return cache["data"]
+        client = client or get_fugle_client()
+
+        def fetch_market(market):
+            response = client.get(f"snapshot/quotes/{market}", api_key)
+            if response.status_code != 200: raise Exception(_http_error(response))
+            return _parse_snapshot(response.json())
+
+        boards = fetch_concurrent(fetch_market, SNAPSHOT_MARKETS)
+        if boards.errors: raise Exception(f"快照失敗: {boards.errors}")
+        data = {}
+        for board in boards.values(): data.update(board)
+        cache["data"], cache["fetched_at"] = data, time.time()
+        return data
+
+def _use_snapshot(stock_list):
+    try: threshold = int(st.secrets.get("fugle_snapshot_threshold", SNAPSHOT_THRESHOLD))
+    except Exception: threshold = SNAPSHOT_THRESHOLD
+    return len(set(stock_list)) >= threshold
+
+def _fetch_with_snapshot(stock_list, api_key, client, pick, fetch_one, on_progress=None):
+    """
+    股票數達門檻時先從全市場快照取值 (pick 由快照項目取出需要的欄位)，
+    快照失敗或快照中沒有的股票 (例如興櫃、尚未成交) 再逐檔抓取；回傳依輸入順序的 FetchResult
+    """
+    symbols = list(dict.fromkeys(stock_list))
+    found = {}
+    if _use_snapshot(symbols):
+        try:
+            snapshot = get_market_snapshot(api_key, client)
+            found = {s: pick(snapshot[s]) for s in symbols if s in snapshot}
+        except Exception as e:
+            print(f"全市場快照失敗，改逐檔抓取: {e}")
+    missing = [s for s in symbols if s not in found]
+    fetched = fetch_concurrent(fetch_one, missing, on_progress=on_progress) if missing else FetchResult()
+
+    result = FetchResult()
+    for symbol in symbols:
+        if symbol in found: result[symbol] = found[symbol]
+        elif symbol in fetched: result[symbol] = fetched[symbol]
+        else: result.errors[symbol] = fetched.errors.get(symbol, "無資料")
+    return result
+
+def get_price_from_fugle(symbol, api_key, client=None):
     """單純取得價格"""
-    url = f"https://api.fugle.tw/marketdata/v1.0/stock/intraday/quote/{symbol}"
-    headers = {"X-API-KEY": api_key}
-    try:
-        response = requests.get(url, headers=headers, timeout=5)
-        if response.status_code != 200: return None
-        data = response.json()
-        last_price = None
-        if 'total' in data and data['total'].get('price') is not None: last_price = data['total']['price']
-        elif 'quote' in data and data['quote'].get('close') is not None: last_price = data['quote']['close']
-        elif 'trade' in data and data['trade'].get('price') is not None: last_price = data['trade']['price']
-        elif data.get('price') is not None: last_price = data['price']
-        if last_price is None: last_price = data.get('lastPrice', 0)
-        return float(last_price)
+    try: return _parse_price(_fetch_quote(symbol, api_key, client))
     except: return None
 
-def get_realtime_prices(stock_list):
-    """批次取得價格"""
+def get_realtime_prices(stock_list, client=None):
+    """批次取得價格 (股票數達門檻走全市場快照，其餘並行，由 RequestScheduler 依每分鐘額度與 429 調整併發)；回傳 FetchResult，失敗的股票記在 .errors"""
     if "fugle_api_key" not in st.secrets: return {}
     api_key = st.secrets["fugle_api_key"]
-    prices = {}
+    client = client or get_fugle_client()
     progress_bar = st.progress(0)
-    total = len(stock_list)
-    for i, symbol in enumerate(stock_list):
-        price = get_price_from_fugle(symbol, api_key)
-        if price is not None: prices[symbol] = price
-        progress_bar.progress((i + 1) / total)
-        time.sleep(0.1)
+    prices = _fetch_with_snapshot(
+        stock_list, api_key, client, pick=lambda q: q["price"],
+        fetch_one=lambda symbol: _parse_price(_fetch_quote(symbol, api_key, client)),
+        on_progress=lambda done, total: progress_bar.progress(done / total)
+    )
     progress_bar.empty()
     return prices
 
-def get_detailed_quote(symbol, api_key):
+def get_detailed_quote(symbol, api_key, client=None):
     """取得詳細即時報價"""
-    url = f"https://api.fugle.tw/marketdata/v1.0/stock/intraday/quote/{symbol}"
-    headers = {"X-API-KEY": api_key}
-    try:
-        response = requests.get(url, headers=headers, timeout=5)
-        if response.status_code != 200: return None
-        data = response.json()
-        
-        last_price = 0
-        if 'total' in data: last_price = data['total'].get('price', 0)
-        elif 'quote' in data: last_price = data['quote'].get('close', 0)
-        elif 'trade' in data: last_price = data['trade'].get('price', 0)
-        if last_price == 0: last_price = data.get('lastPrice', 0)
-        
-        change_percent = 0
-        if 'quote' in data: change_percent = data['quote'].get('changePercent', 0)
-        elif 'changePercent' in data: change_percent = data['changePercent']
-            
-        volume = 0
-        if 'total' in data: volume = data['total'].get('tradeVolume', 0)
-        elif 'trade' in data: volume = data['trade'].get('volume', 0)
-        
-        return {
-            "price": float(last_price),
-            "change_pct": float(change_percent),
-            "volume": int(volume),
-            "last_updated": datetime.now().strftime('%H:%M:%S')
-        }
+    try: return _parse_detailed_quote(_fetch_quote(symbol, api_key, client))
     except: return None
 
-def get_batch_detailed_quotes(stock_list):
+def get_batch_detailed_quotes(stock_list, client=None):
+    """批次取得詳細報價 (股票數達門檻走全市場快照，其餘並行，由 RequestScheduler 依每分鐘額度與 429 調整併發)；回傳 FetchResult，失敗的股票記在 .errors"""
     if "fugle_api_key" not in st.secrets: return {}
     api_key = st.secrets["fugle_api_key"]
+    client = client or get_fugle_client()
+    return _fetch_with_snapshot(
+        stock_list, api_key, client, pick=dict,
+        fetch_one=lambda symbol: _parse_detailed_quote(_fetch_quote(symbol, api_key, client))
+    )
+
+# --- 串流報價 (WebSocket 看板) ---
+STREAM_STALE = 120           # 串流斷線時，看板報價超過此秒數改走 REST 補抓
+
+@st.cache_resource
+def get_quote_stream():
+    """process 共用的 WebSocket 報價串流 (背景執行緒)；未設定金鑰或 fugle_streaming = false 時回傳 None"""
+    try:
+        if "fugle_api_key" not in st.secrets or not st.secrets.get("fugle_streaming", True): return None
+        stream = quote_stream.QuoteStream(st.secrets["fugle_api_key"], st.secrets.get("fugle_ws_url", quote_stream.FUGLE_WS_URL))
+    except Exception:
+        return None
+    stream.start()
+    return stream
+
+def get_live_quotes(stock_list, client=None):
+    """
+    盤中報價 (串流優先)，回傳 quote_stream.QuoteColumns (price / change_pct / volume 陣列，順序同輸入)
+    登記訂閱後直接讀看板，不呼叫 API；看板上還沒有的股票 (剛訂閱、尚未成交) 或串流斷線過久時，
+    才以 get_batch_detailed_quotes 補抓並寫回看板
+    """
+    symbols = list(dict.fromkeys(stock_list))
+    stream = get_quote_stream()
+    if stream is None:
+        return quote_stream.QuoteColumns.from_quotes(symbols, get_batch_detailed_quotes(symbols, client))
+    stream.subscribe(symbols)
+    cols = stream.board.read(symbols)
+    stale = ~cols.found
+    if not stream.connected: stale |= (time.time() - cols.updated_at) > STREAM_STALE
+    if not stale.any(): return cols
+
+    fetched = get_batch_detailed_quotes([symbols[i] for i in np.flatnonzero(stale)], client)
+    for symbol, quote in fetched.items(): stream.board.update(symbol, quote)
+    cols = stream.board.read(symbols)
+    cols.errors = dict(getattr(fetched, "errors", {}))
+    return cols
+
+def get_board_prices(stock_list):
+    """只讀串流看板的最新價 (不呼叫 API)；串流未啟用時回傳空 dict"""
+    stream = get_quote_stream()
+    if stream is None: return {}
+    stream.subscribe(stock_list)
+    return stream.board.read(stock_list).prices()
+
+def get_stream_status():
+    stream = get_quote_stream()
+    if stream is None: return None
+    return dict(stream.stats, connected=stream.connected, symbols=len(stream.symbols))
+
+# --- 交易日 ---
+TW_TZ = timezone(timedelta(hours=8))
+MARKET_OPEN = dtime(9, 0)
+MARKET_CLOSE = dtime(13, 30)
+
+def tw_now():
+    return datetime.now(TW_TZ).replace(tzinfo=None)
+
+def last_completed_trading_day(now=None):
+    """最近一個已收盤的交易日 (台灣時間；今日 13:30 前為前一個平日，未排除國定假日)"""
+    now = now or tw_now()
+    day = now.date()
+    if day.weekday() >= 5 or now.time() < MARKET_CLOSE: day -= timedelta(days=1)
+    while day.weekday() >= 5: day -= timedelta(days=1)
+    return day.isoformat()
+
+def quote_session_date(now=None):
+    """現價所屬的交易日：盤中為今日，其餘時間 (開盤前、收盤後、週末) 為最近一個已收盤的交易日"""
+    now = now or tw_now()
+    if now.weekday() < 5 and MARKET_OPEN <= now.time() < MARKET_CLOSE: return now.date().isoformat()
+    return last_completed_trading_day(now)
+
+# --- 日K線 (本地K線庫 + 補抓) ---
+def _fetch_candles(symbol, api_key, from_date, to_date, client=None):
+    params = {"from": from_date, "to": to_date, "fields": "open,high,low,close,volume"}
+    response = (client or get_fugle_client()).get(f"historical/candles/{symbol}", api_key, params=params)
+    data = response.json()
+    if response.status_code != 200 or 'data' not in data:
+        raise Exception(_http_error(response))
+    return data['data']
+
+def _load_candles(symbol, api_key, from_date, to_date, as_of, client=None):
+    """
+    先向 API 補抓本地K線庫缺少的區間 (通常只有最後一根之後)，as_of (最近完成交易日) 以前的K線存入本地；
+    今日盤中K線只用於本次回傳不入庫。API 失敗時直接使用本地已有資料 (離線)
+    收盤後若 API 還沒有當日K線，本地只記到前一天，下次再補抓
+    """
+    live_rows = []
+    for start, end in candle_store.missing_ranges(symbol, from_date, to_date):
+        try:
+            candles = _fetch_candles(symbol, api_key, start, end, client)
+        except Exception as e:
+            print(f"{symbol} K線補抓失敗，使用本地資料: {e}")
+            break
+        dates = {str(c['date'])[:10] for c in candles}
+        closed_to = min(end, as_of)
+        if closed_to == to_date and to_date not in dates:
+            closed_to = (datetime.strptime(to_date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+        if start <= closed_to: candle_store.save_candles(symbol, candles, start, closed_to)
+        live_rows += [c for c in candles if str(c['date'])[:10] > closed_to]
+
+    df = candle_store.load_candles(symbol, from_date, to_date)
+    if live_rows:
+        live_df = pd.DataFrame(live_rows)[['date'] + candle_store.CANDLE_FIELDS]
+        live_df['date'] = pd.to_datetime(live_df['date'])
+        df = pd.concat([df, live_df], ignore_index=True).drop_duplicates('date', keep='last').sort_values('date', ignore_index=True)
+    return df
+
+def get_intraday_previews(quotes, window=20, dates=None):
+    """
+    盤中試算：quotes 為 {symbol: 現價}，以本地K線庫的滾動指標狀態計算「若現在收盤」的 MA 與乖離
+    dates 為 {symbol: 報價所屬交易日} (QuoteColumns.dates())；未提供的股票依 quote_session_date 推定
+    回傳 {symbol: {"MA": ..., "Bias": ...}}；狀態不存在或歷史不足的股票略過
+    """
+    states = candle_store.load_indicator_states(quotes.keys())
+    dates = dates or {}
+    session = quote_session_date()
+    previews = {}
+    for symbol, state in states.items():
+        # 現價所屬交易日的K線已入庫 (收盤後、週末、假日、開盤前)：以現價取代那根，避免重複計入；新的交易日才多算一根
+        replace_last = state.last_date is not None and state.last_date >= dates.get(symbol, session)
+        preview = state.preview(quotes[symbol], window, replace_last=replace_last)
+        if preview: previews[symbol] = preview
+    return previews
+
+# --- 技術分析 (多檔一次計算) ---
+MA_WINDOWS = (5, 10, 20, 60)
+VOL_WINDOW = 10
+
+def compute_ta_panel(candles, as_of):
+    """
+    candles: 多檔K線長表 (symbol, date, close, volume)，date 為 datetime
+    以 groupby-rolling 一次算出所有股票的 MA5/10/20/60、Vol10、訊號與乖離，回傳 {symbol: TA dict}
+    只用 as_of (最近完成交易日) 以前的K線計算；盤中K線不列入 (排除今日資料計算均量)，但會出現在 debug_info (末3筆)
+    """
+    if candles.empty: return {}
+    df = candles[['symbol', 'date', 'close', 'volume']].sort_values(['symbol', 'date'], kind='stable').reset_index(drop=True)
+
+    # --- 準備 Debug 資訊 (每檔末3筆) ---
+    tail = df.groupby('symbol', sort=False).tail(3)
+    debug = {}
+    for rec in tail.assign(date=tail['date'].dt.strftime('%Y-%m-%d')).to_dict('records'):
+        debug.setdefault(rec.pop('symbol'), []).append(rec)
+
+    # 1. 排除盤中資料 (as_of 之後的K線)
+    df_calc = df[df['date'].dt.strftime('%Y-%m-%d') <= as_of].reset_index(drop=True)
+
+    # 2. 計算技術指標 (每檔各自滾動，一次處理所有股票)
+    grouped = df_calc.groupby('symbol', sort=False)
+    for w in MA_WINDOWS:
+        df_calc[f'MA{w}'] = grouped['close'].rolling(window=w).mean().reset_index(level=0, drop=True)
+    df_calc['Vol10'] = grouped['volume'].rolling(window=VOL_WINDOW).mean().reset_index(level=0, drop=True)
+
+    last = df_calc.groupby('symbol', sort=False).tail(1).set_index('symbol')
+    price, ma20 = last['close'], last['MA20']
+    month = np.where(price < ma20, "📉破月線", np.where(price > ma20, "🆗站上月線", ""))
+    bull = np.where((last['MA5'] > last['MA10']) & (last['MA10'] > ma20) & (ma20 > last['MA60']), "🔥多頭排列", "")
+    signal = pd.Series([" ".join(x for x in pair if x) for pair in zip(month, bull)], index=last.index)
+    signal = signal.where(signal != "", "盤整")
+    bias = ((price - ma20) / ma20 * 100).where(ma20 > 0, 0).fillna(0).round(2)
+    ma20_out = ma20.round(2).fillna(0)
+    vol10 = last['Vol10'].fillna(0).astype('int64')
+
     results = {}
-    for symbol in stock_list:
-        res = get_detailed_quote(symbol, api_key)
-        if res: results[symbol] = res
-        time.sleep(0.1)
+    for symbol in df['symbol'].unique():
+        if symbol not in last.index:
+            results[symbol] = {'Signal': '資料不足', 'MA20': 0, 'Vol10': 0, 'debug_info': debug[symbol]}
+            continue
+        results[symbol] = {
+            'MA20': ma20_out[symbol] if pd.notna(ma20[symbol]) else 0,
+            'Vol10': int(vol10[symbol]),
+            'Bias': bias[symbol],
+            'Signal': signal[symbol],
+            'debug_info': debug[symbol]
+        }
     return results
 
-# --- [修改] 技術分析 (回傳 debug_info) ---
-def get_technical_analysis(symbol, api_key):
+def _ta_window():
+    """(起日, 今日, 最近完成交易日)，皆為台灣時間"""
+    now = tw_now()
+    return (now - timedelta(days=120)).strftime('%Y-%m-%d'), now.strftime('%Y-%m-%d'), last_completed_trading_day(now)
+
+def get_technical_analysis(symbol, api_key, client=None):
     """
     抓取歷史資料並計算技術指標
     修正：排除今日盤中資料計算均量
     """
-    to_date = datetime.now().strftime('%Y-%m-%d')
-    from_date = (datetime.now() - timedelta(days=120)).strftime('%Y-%m-%d')
-    
-    url = f"https://api.fugle.tw/marketdata/v1.0/stock/historical/candles/{symbol}"
-    params = {"from": from_date, "to": to_date, "fields": "open,high,low,close,volume"}
-    headers = {"X-API-KEY": api_key}
+    from_date, to_date, as_of = _ta_window()
     
     try:
-        response = requests.get(url, params=params, headers=headers, timeout=5)
-        data = response.json()
-        if response.status_code != 200 or 'data' not in data: 
+        df = _load_candles(symbol, api_key, from_date, to_date, as_of, client)
+        if df.empty:
             return {'Signal': '無資料', 'MA20': 0, 'Vol10': 0, 'debug_info': 'API Error'}
-            
-        df = pd.DataFrame(data['data'])
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.sort_values('date')
-        
-        # --- 準備 Debug 資訊 ---
-        last_3_rows = df.tail(3)[['date', 'close', 'volume']].copy()
-        last_3_rows['date'] = last_3_rows['date'].dt.strftime('%Y-%m-%d')
-        debug_info = last_3_rows.to_dict('records') 
-        # ---------------------
-
-        # 1. 排除今日資料
-        today_str = datetime.now().strftime('%Y-%m-%d')
-        last_date_str = df.iloc[-1]['date'].strftime('%Y-%m-%d')
-        
-        df_calc = df.copy()
-        if last_date_str == today_str:
-            df_calc = df.iloc[:-1] # 排除最後一筆
-        
-        # 2. 計算技術指標
-        df_calc['MA5'] = df_calc['close'].rolling(window=5).mean()
-        df_calc['MA10'] = df_calc['close'].rolling(window=10).mean()
-        df_calc['MA20'] = df_calc['close'].rolling(window=20).mean()
-        df_calc['MA60'] = df_calc['close'].rolling(window=60).mean()
-        df_calc['Vol10'] = df_calc['volume'].rolling(window=10).mean()
-        
-        if len(df_calc) < 1: return {'Signal': '資料不足', 'MA20': 0, 'Vol10': 0, 'debug_info': debug_info}
-
-        last = df_calc.iloc[-1]
-        price = last['close']
-        ma5, ma10, ma20, ma60 = last['MA5'], last['MA10'], last['MA20'], last['MA60']
-        vol10 = last['Vol10']
-        
-        signals = []
-        if pd.notna(ma20):
-            if price < ma20: signals.append("📉破月線") 
-            elif price > ma20: signals.append("🆗站上月線")
-        if pd.notna(ma5) and ma5 > ma10 > ma20 > ma60: signals.append("🔥多頭排列")
-        
-        bias = 0
-        if pd.notna(ma20) and ma20 > 0:
-            bias = (price - ma20) / ma20 * 100
-
-        return {
-            'MA20': round(ma20, 2) if pd.notna(ma20) else 0,
-            'Vol10': int(vol10) if pd.notna(vol10) else 0,
-            'Bias': round(bias, 2),
-            'Signal': " ".join(signals) if signals else "盤整",
-            'debug_info': debug_info
-        }
+        return compute_ta_panel(df.assign(symbol=symbol), as_of)[symbol]
     except Exception as e:
         return {'Signal': 'Error', 'MA20': 0, 'Vol10': 0, 'debug_info': str(e)}
 
-def get_batch_technical_analysis(stock_list):
+# --- 技術分析快取 (process 共用，以最近完成交易日為鍵) ---
+TA_INCOMPLETE_TTL = 600      # 收盤後 API 尚無當日K線 (或休市) 的結果，只快取此秒數
+TA_ERROR_TTL = 60            # 抓取失敗 / 無資料的結果只留在記憶體此秒數，避免每次刷新都重打 API
+TA_INFLIGHT_TIMEOUT = 120    # 秒；等待其他 session 計算同一檔的上限，逾時改自行計算
+
+@st.cache_resource
+def _ta_cache():
+    """entries: 已算好的結果；inflight: {symbol: Future}，正在抓K線計算的股票 (單一飛行)"""
+    return {"day": None, "entries": {}, "inflight": {}, "lock": threading.Lock(), "stats": {"hits": 0, "misses": 0}}
+
+def _ta_persist():
+    try: return bool(st.secrets.get("ta_cache_persist", True))
+    except Exception: return True
+
+def _ta_complete(result, as_of):
+    debug = result.get('debug_info')
+    return isinstance(debug, list) and bool(debug) and debug[-1]['date'] >= as_of
+
+def _ta_cache_lookup(symbols, as_of):
+    """回傳 {symbol: TA dict}；換日 (過了收盤) 時整批失效，記憶體沒有的再讀本地檔"""
+    cache = _ta_cache()
+    now = time.time()
+    with cache["lock"]:
+        if cache["day"] != as_of:
+            cache["day"], cache["entries"] = as_of, {}
+        found = {s: e["result"] for s in symbols if (e := cache["entries"].get(s))
+                 and (e["complete"] or now - e["computed_at"] < e.get("ttl", TA_INCOMPLETE_TTL))}
+    missing = [s for s in symbols if s not in found]
+    if missing and _ta_persist():
+        for symbol, (result, computed_at) in candle_store.load_ta_cache(missing, as_of).items():
+            complete = _ta_complete(result, as_of)
+            if complete or now - computed_at < TA_INCOMPLETE_TTL:
+                found[symbol] = result
+                with cache["lock"]:
+                    cache["entries"][symbol] = {"result": result, "complete": complete, "computed_at": computed_at}
+    with cache["lock"]:
+        cache["stats"]["hits"] += len(found)
+        cache["stats"]["misses"] += len(symbols) - len(found)
+    return found
+
+def _ta_cache_store(results, as_of):
+    """
+    正常計算的結果快取並落地；Error / 無資料 只在記憶體保留 TA_ERROR_TTL 秒
+    (監控頁每秒刷新，失敗的股票不能每次都重打 historical API)
+    """
+    cache = _ta_cache()
+    now = time.time()
+    good = {s: r for s, r in results.items() if r.get('Signal') not in ('Error', '無資料')}
+    with cache["lock"]:
+        if cache["day"] != as_of: cache["day"], cache["entries"] = as_of, {}
+        for symbol, result in results.items():
+            if symbol in good:
+                cache["entries"][symbol] = {"result": result, "complete": _ta_complete(result, as_of), "computed_at": now}
+            else:
+                cache["entries"][symbol] = {"result": result, "complete": False, "computed_at": now, "ttl": TA_ERROR_TTL}
+    if good and _ta_persist():
+        candle_store.save_ta_cache(good, as_of, now)
+
+def get_ta_cache_stats():
+    cache = _ta_cache()
+    with cache["lock"]:
+        return dict(cache["stats"], day=cache["day"], entries=len(cache["entries"]))
+
+def _claim_inflight(symbols):
+    """登記要計算的股票：回傳 (自己負責的股票, {其他 session 正在計算的股票: Future})"""
+    cache = _ta_cache()
+    own, waiting = [], {}
+    with cache["lock"]:
+        for symbol in symbols:
+            future = cache["inflight"].get(symbol)
+            if future is None:
+                cache["inflight"][symbol] = Future()
+                own.append(symbol)
+            else:
+                waiting[symbol] = future
+    return own, waiting
+
+def _release_inflight(computed):
+    """計算完成 (或失敗) 後喚醒等待中的 session；computed 為 {symbol: TA dict}"""
+    cache = _ta_cache()
+    with cache["lock"]:
+        futures = [(cache["inflight"].pop(s, None), r) for s, r in computed.items()]
+    for future, result in futures:
+        if future is not None: future.set_result(result)
+
+def _compute_ta(symbols, api_key, client, from_date, to_date, as_of, priority, on_progress):
+    """抓取/補抓K線並計算，回傳 ({symbol: TA dict}, 抓取失敗的原因)"""
+    frames = fetch_concurrent(
+        lambda symbol: _load_candles(symbol, api_key, from_date, to_date, as_of, client), symbols,
+        priority=priority, on_progress=on_progress
+    )
+    loaded = [df.assign(symbol=symbol) for symbol, df in frames.items() if not df.empty]
+    try:
+        panel = compute_ta_panel(pd.concat(loaded, ignore_index=True), as_of) if loaded else {}
+    except Exception as e:
+        panel = {s: {'Signal': 'Error', 'MA20': 0, 'Vol10': 0, 'debug_info': str(e)} for s in frames}
+    computed = {}
+    for symbol in symbols:
+        if symbol in frames.errors:
+            computed[symbol] = {'Signal': 'Error', 'MA20': 0, 'Vol10': 0, 'debug_info': frames.errors[symbol]}
+        else:
+            computed[symbol] = panel.get(symbol, {'Signal': '無資料', 'MA20': 0, 'Vol10': 0, 'debug_info': 'API Error'})
+    return computed, frames.errors
+
+def _batch_ta(stock_list, api_key, client, force=False, priority=PRIORITY_INTERACTIVE, on_progress=None):
+    """
+    先查共用快取，未命中的股票並行讀取/補抓K線後合併成一張長表，由 compute_ta_panel 一次計算
+    同一檔同時只有一個 session 計算 (單一飛行)：其他 session 正在算的股票等待其結果，不重複抓K線
+    on_progress 只在自己有股票要抓時才會被呼叫
+    """
+    from_date, to_date, as_of = _ta_window()
+    symbols = list(dict.fromkeys(stock_list))
+    cached = {} if force else _ta_cache_lookup(symbols, as_of)
+    own, waiting = _claim_inflight([s for s in symbols if s not in cached])
+
+    computed, errors = {}, {}
+    if own:
+        try:
+            computed, errors = _compute_ta(own, api_key, client, from_date, to_date, as_of, priority, on_progress)
+            _ta_cache_store(computed, as_of)
+        finally:
+            # 例外時也要放行等待者 (給 Error 結果)，否則它們只能等到逾時
+            _release_inflight({s: computed.get(s, {'Signal': 'Error', 'MA20': 0, 'Vol10': 0, 'debug_info': '計算中斷'})
+                               for s in own})
+    for symbol, future in waiting.items():
+        try:
+            computed[symbol] = future.result(timeout=TA_INFLIGHT_TIMEOUT)
+        except Exception:
+            result, err = _compute_ta([symbol], api_key, client, from_date, to_date, as_of, priority, None)
+            computed.update(result)
+            errors.update(err)
+
+    results = FetchResult()
+    results.errors = errors
+    for symbol in symbols:
+        results[symbol] = cached[symbol] if symbol in cached else computed[symbol]
+    return results
+
+def get_batch_technical_analysis(stock_list, client=None, force=False):
+    """
+    批次技術分析：先查共用快取 (同一交易日只算一次，所有 session/頁面共用)，
+    未命中的股票並行讀取/補抓K線後由 compute_ta_panel 一次計算；force=True 時略過快取重新計算
+    """
     if "fugle_api_key" not in st.secrets: return {}
     api_key = st.secrets["fugle_api_key"]
-    results = {}
-    total = len(stock_list)
-    show_progress = total > 5
-    if show_progress: bar = st.progress(0)
-    
-    for i, symbol in enumerate(stock_list):
-        res = get_technical_analysis(symbol, api_key)
-        results[symbol] = res
-        if show_progress: bar.progress((i+1)/total)
-        time.sleep(0.2)
-    
-    if show_progress: bar.empty()
-    return results
\ No newline at end of file
+    client = client or get_fugle_client()
+    # 進度條在第一次回報進度時才建立：全部命中快取 (監控頁每秒刷新) 時不會閃一下
+    bar = None
+    def on_progress(done, total):
+        nonlocal bar
+        if total <= 5: return
+        if bar is None: bar = st.progress(0)
+        bar.progress(done / total)
+    results = _batch_ta(stock_list, api_key, client, force=force, on_progress=on_progress)
+    if bar is not None: bar.empty()
+    return results
+
+@st.cache_resource
+def _warmup_state():
+    return {"thread": None, "lock": threading.Lock()}
+
+def start_ta_warmup(stock_list):
+    """
+    背景預熱技術指標快取 (低優先序，不搶互動請求的額度)；已有預熱在跑時不重複啟動
+    回傳是否啟動了新的預熱
+    """
+    try:
+        if "fugle_api_key" not in st.secrets or not stock_list: return False
+        api_key = st.secrets["fugle_api_key"]
+    except Exception:
+        return False
+    client = get_fugle_client()
+    state = _warmup_state()
+    with state["lock"]:
+        if state["thread"] and state["thread"].is_alive(): return False
+        symbols = list(dict.fromkeys(stock_list))
+
+        def run():
+            try: _batch_ta(symbols, api_key, client, priority=PRIORITY_BACKGROUND)
+            except Exception as e: print(f"技術指標預熱失敗: {e}")
+
+        state["thread"] = threading.Thread(target=run, daemon=True, name="ta-warmup")
+        state["thread"].start()
+    return True
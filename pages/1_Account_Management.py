@@ -2,10 +2,17 @@
 # 檔案名稱: pages/1_Account_Management.py
 # 
 # 修改歷程:
+# 2026-10-17 23:40:00: [Fix] 持股庫存的技術訊號/月線改讀跨頁共用的技術分析快取，直接開啟本頁也有資料 (不再依賴戰情室寫入的 session_state)
+# 2026-10-17 20:00:00: [Fix] 批次匯入拒絕無法辨識的交易類別 (例如 沖買)，與日期格式錯誤相同方式回報
+# 2026-10-16 17:00:00: [UX] 股票代號改用本地搜尋索引：支援代號/名稱前綴與子字串候選，帶入名稱不再觸發 st.rerun
+# 2026-10-16 15:00:00: [UI] 側邊欄顯示背景同步狀態 (待寫入 / 已同步 / 錯誤)
+# 2026-10-16 12:00:00: [Perf] 頁面啟動改用 database.load_all 一次取回所有工作表
+# 2026-10-16 11:00:00: [New] 側邊欄新增「批次匯入」(CSV / 券商對帳單)，一次寫入多筆交易
 # 2025-11-24 15:10:00: [Fix] 修正詳細交易紀錄表格未連動個股篩選的問題
 # 2025-11-24 14:50:00: [Fix] 修復 Tab 2 個股損益查詢功能，確保選項正確載入
 # ==============================================================================
 
+import io
 import streamlit as st
 import pandas as pd
 import plotly.express as px
@@ -23,17 +30,16 @@ st.title("📝 帳務管理中心")
 # 1. 資料讀取與初始化
 # ==============================================================================
 
+# 一次取回所有工作表 (單一 API 往返)
 try:
-    stock_map = database.get_stock_info_map()
+    all_data = database.load_all()
 except:
-    stock_map = {}
+    all_data = {}
 
-try:
-    account_settings = database.get_account_settings()
-    account_list = list(account_settings.keys())
-except:
-    account_settings = {"預設帳戶": 0.6}
-    account_list = ["預設帳戶"]
+stock_map = all_data.get("stock_map", {})
+account_settings = all_data.get("accounts") or {"預設帳戶": 0.6}
+account_list = list(account_settings.keys())
+symbol_index = database.get_symbol_index()
 
 # Session State (Form 相關)
 if "txn_date" not in st.session_state: st.session_state["txn_date"] = date.today()
@@ -46,6 +52,26 @@ if "txn_price" not in st.session_state: st.session_state["txn_price"] = 0.0
 if "txn_notes" not in st.session_state: st.session_state["txn_notes"] = ""
 if "form_msg" not in st.session_state: st.session_state["form_msg"] = None 
 
+# Callback for 股票代號搜尋 (在 callback 內帶入名稱，不需 st.rerun)
+def stock_query_callback():
+    query = str(st.session_state.txn_stock_id).strip()
+    if not query: return
+    found_name = symbol_index.lookup(query)
+    if not found_name:
+        # 輸入的是名稱或片段：唯一結果時直接帶入代號
+        matches = symbol_index.search(query, limit=2)
+        if len(matches) == 1:
+            st.session_state.txn_stock_id, found_name = matches[0]
+    if found_name: st.session_state.txn_stock_name = found_name
+
+def stock_pick_callback():
+    pick = st.session_state.get("txn_stock_pick")
+    if pick:
+        code, name = pick
+        st.session_state.txn_stock_id = code
+        st.session_state.txn_stock_name = name
+    st.session_state.txn_stock_pick = None
+
 # Callback for Submit
 def submit_callback():
     s_date = st.session_state.txn_date
@@ -85,18 +111,68 @@ def submit_callback():
         except Exception as e:
             st.session_state["form_msg"] = {"type": "error", "content": [f"寫入失敗: {e}"]}
 
+# 批次匯入：券商對帳單常見欄位名稱對照
+IMPORT_COLUMN_ALIASES = {
+    '成交日期': '交易日期', '日期': '交易日期',
+    '代號': '股票代號', '證券代號': '股票代號', '股票代碼': '股票代號',
+    '名稱': '股票名稱', '證券名稱': '股票名稱', '股名': '股票名稱',
+    '買賣別': '交易類別', '交易別': '交易類別', '類別': '交易類別',
+    '成交股數': '股數', '數量': '股數',
+    '成交價': '單價', '成交單價': '單價', '成交價格': '單價',
+    '帳戶': '交易帳戶',
+}
+IMPORT_ACTION_ALIASES = {'買': '買進', '現買': '買進', '賣': '賣出', '現賣': '賣出'}
+IMPORT_VALID_ACTIONS = ['買進', '賣出', '現金股利', '股票股利', '現金增資', '入金', '出金']
+IMPORT_REQUIRED_COLS = ['交易日期', '股票代號', '交易類別', '股數', '單價']
+
+def parse_import_file(uploaded_file, default_account):
+    """讀取上傳的 CSV，回傳 (可匯入的 rows, 預覽 DataFrame, 錯誤訊息)"""
+    raw = uploaded_file.getvalue()
+    df_imp = None
+    for enc in ['utf-8-sig', 'cp950']:
+        try:
+            df_imp = pd.read_csv(io.BytesIO(raw), dtype=str, encoding=enc).fillna("")
+            break
+        except UnicodeDecodeError:
+            continue
+    if df_imp is None: return [], pd.DataFrame(), "無法辨識檔案編碼 (支援 UTF-8 / Big5)"
+
+    df_imp.columns = df_imp.columns.str.strip()
+    df_imp = df_imp.rename(columns=IMPORT_COLUMN_ALIASES)
+    missing = [c for c in IMPORT_REQUIRED_COLS if c not in df_imp.columns]
+    if missing: return [], df_imp, f"缺少必要欄位: {', '.join(missing)}"
+
+    # 無法辨識的交易類別 (例如 沖買/沖賣) 不會計算費用與現金流，整份檔案拒絕匯入
+    actions = df_imp['交易類別'].str.strip()
+    unknown = sorted(set(actions[~actions.map(lambda a: IMPORT_ACTION_ALIASES.get(a, a)).isin(IMPORT_VALID_ACTIONS)]))
+    if unknown: return [], df_imp, f"無法辨識的交易類別: {', '.join(unknown)} (支援: {', '.join(IMPORT_VALID_ACTIONS)})"
+
+    rows = []
+    for _, r in df_imp.iterrows():
+        action = IMPORT_ACTION_ALIASES.get(r['交易類別'].strip(), r['交易類別'].strip())
+        sid = r['股票代號'].strip()
+        account = r.get('交易帳戶', '').strip() or default_account
+        try: date_val = pd.to_datetime(r['交易日期'].strip()).date()
+        except: return [], df_imp, f"日期格式錯誤: {r['交易日期']}"
+        rows.append({
+            'date_val': date_val, 'stock_id': sid,
+            'stock_name': r.get('股票名稱', '').strip() or stock_map.get(sid, ''),
+            'action': action,
+            'qty': int(logic._safe_float(r['股數'])), 'price': logic._safe_float(r['單價']),
+            'account': account, 'notes': r.get('備註', '').strip(),
+            'discount': account_settings.get(account, 0.6),
+        })
+    return rows, df_imp, None
+
 # ==============================================================================
 # 2. 側邊欄：操作區
 # ==============================================================================
-try:
-    df_raw = database.load_data()
-except:
-    df_raw = pd.DataFrame()
+df_raw = all_data.get("ledger", pd.DataFrame())
 
 with st.sidebar:
     st.title("🛠️ 帳務操作")
     
-    mode = st.radio("選擇功能", ["📝 新增交易", "🔧 帳戶餘額校正"], horizontal=True)
+    mode = st.radio("選擇功能", ["📝 新增交易", "📥 批次匯入", "🔧 帳戶餘額校正"], horizontal=True)
     
     if mode == "📝 新增交易":
         #col1, col2 = st.columns(2)
@@ -111,13 +187,18 @@ with st.sidebar:
             st.info("💡 資金操作：請輸入金額")
             input_stock_id = st.text_input("股票代號", placeholder="(可留空)", key="txn_stock_id", disabled=False)
         else:
-            input_stock_id = st.text_input("股票代號", placeholder="例如 2330", key="txn_stock_id")
-            if input_stock_id:
-                clean_id = str(input_stock_id).strip()
-                found_name = stock_map.get(clean_id, "")
-                if found_name and st.session_state["txn_stock_name"] != found_name:
-                    st.session_state["txn_stock_name"] = found_name
-                    st.rerun()
+            input_stock_id = st.text_input("股票代號", placeholder="輸入代號或名稱，例如 2330 / 台積", key="txn_stock_id",
+                                           on_change=stock_query_callback)
+            clean_id = str(input_stock_id).strip()
+            if clean_id and not symbol_index.lookup(clean_id):
+                # 非完整代號：由本地索引列出候選 (前綴 / 子字串)，不需重新讀取試算表
+                candidates = symbol_index.search(clean_id, limit=20)
+                if candidates:
+                    st.selectbox("候選股票", options=candidates, index=None, key="txn_stock_pick",
+                                 format_func=lambda c: f"{c[0]} {c[1]}", placeholder=f"找到 {len(candidates)} 筆，請選擇",
+                                 on_change=stock_pick_callback)
+                else:
+                    st.caption("查無符合的股票")
 
         col2 = st.empty()
         if is_cash_op:
@@ -135,6 +216,25 @@ with st.sidebar:
         st.text_area("備註", placeholder="選填", key="txn_notes")
         st.button("💾 提交交易", on_click=submit_callback, use_container_width=True)
         
+    elif mode == "📥 批次匯入":
+        st.info("上傳 CSV 或券商對帳單，必要欄位：交易日期、股票代號、交易類別、股數、單價 (可選：股票名稱、交易帳戶、備註)")
+        import_account = st.selectbox("預設交易帳戶 (檔案未指定時)", options=account_list)
+        uploaded = st.file_uploader("選擇檔案", type=["csv"])
+        if uploaded is not None:
+            import_rows, df_preview, import_err = parse_import_file(uploaded, import_account)
+            if import_err:
+                st.error(f"❌ {import_err}")
+            else:
+                st.caption(f"共 {len(import_rows)} 筆，與既有紀錄重複者將自動略過")
+                st.dataframe(df_preview, use_container_width=True, height=200)
+                if st.button("📥 確認匯入", use_container_width=True):
+                    try:
+                        with st.spinner("寫入中..."):
+                            result = database.save_transactions(import_rows)
+                        st.success(f"✅ 匯入完成：新增 {result['written']} 筆，略過重複 {result['skipped']} 筆")
+                    except Exception as e:
+                        st.error(f"匯入失敗: {e}")
+
     else:
         st.info("自動計算差額並產生修正交易")
         adj_account = st.selectbox("選擇校正帳戶", options=account_list)
@@ -170,6 +270,24 @@ with st.sidebar:
         elif msg["type"] == "error": 
             for err in msg["content"]: st.error(err)
 
+    # 背景寫入 Google Sheets 的同步狀態
+    st.divider()
+    try:
+        journal = database.get_journal_status()
+        if journal["pending"]:
+            st.info(f"⏳ {journal['pending']} 筆資料等待同步至 Google Sheets (已可在報表中看到)")
+            if journal["last_error"]: st.warning(f"同步重試中: {journal['last_error']}")
+            if st.button("☁️ 立即同步", use_container_width=True):
+                try:
+                    database.flush_journal()
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"同步失敗: {e}")
+        else:
+            st.caption(f"☁️ 所有資料已同步 (累計 {journal['flushed']} 筆)")
+    except Exception:
+        pass
+
 # ==============================================================================
 # 3. 主畫面：分頁檢視
 # ==============================================================================
@@ -181,11 +299,14 @@ with tab1:
     if not df_raw.empty:
         df_fifo = logic.calculate_fifo_report(df_raw)
         current_prices = st.session_state.get("realtime_prices", {})
-        ta_data = st.session_state.get("ta_data", {})
         df_unrealized = logic.calculate_unrealized_pnl(df_fifo, current_prices)
         
         if not df_unrealized.empty:
-            # 技術指標
+            # 技術指標 (跨 session / 頁面共用快取，同一交易日每檔只算一次)
+            try:
+                ta_data = market_data.get_batch_technical_analysis(df_unrealized['股票代號'].unique().tolist())
+            except Exception:
+                ta_data = {}
             df_unrealized['技術訊號'] = df_unrealized['股票代號'].map(lambda x: ta_data.get(x, {}).get('Signal', '-'))
             df_unrealized['月線(20MA)'] = df_unrealized['股票代號'].map(lambda x: ta_data.get(x, {}).get('MA20', 0))
 
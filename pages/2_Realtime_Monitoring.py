@@ -2,6 +2,14 @@
 # 檔案名稱: pages/2_Realtime_Monitoring.py
 # 
 # 修改歷程:
+# 2026-10-17 23:20:00: [Fix] 盤中試算傳入報價所屬交易日，非盤中時段不再把前一交易日收盤重複計入
+# 2026-10-17 13:00:00: [Perf] 報價改讀欄式陣列 (QuoteColumns)，依位置取值，不再逐檔查 dict
+# 2026-10-17 12:00:00: [UI] 報價失敗的股票保留在表格中並標示原因，不再以 0 元顯示
+# 2026-10-17 11:00:00: [Perf] 技術指標改讀跨 session 共用快取 (每交易日每檔只抓一次)，不再需要手動按鈕才有資料
+# 2026-10-17 10:00:00: [Perf] 報價改讀 WebSocket 串流看板 (get_live_quotes)，串流啟用時每秒刷新且不消耗 REST 額度
+# 2026-10-17 09:00:00: [New] 新增「收盤試算」欄：依現價試算若現在收盤是否站上月線
+# 2026-10-16 19:00:00: [Update] 顯示報價失敗的股票與原因
+# 2026-10-16 12:00:00: [Perf] 頁面啟動改用 database.load_all 一次取回所有工作表
 # 2025-11-24 17:00:00: [Debug] 新增詳細的量比計算參數除錯表 (檢查現量、倍數、均量)
 # 2025-11-24 14:50:00: [Fix] 修正量比顯示問題；優化 Vol10 與量比的格式化邏輯
 # ==============================================================================
@@ -23,9 +31,15 @@ st.title("🚀 盤中戰情監控")
 # 1. 資料準備
 # ==============================================================================
 
+# 一次取回所有工作表 (單一 API 往返)
+try:
+    all_data = database.load_all()
+except:
+    all_data = {}
+
 # 讀取庫存
 try:
-    df_txn = database.load_data()
+    df_txn = all_data["ledger"]
     df_fifo = logic.calculate_fifo_report(df_txn)
     inventory_stocks = df_fifo['股票代號'].unique().tolist() if not df_fifo.empty else []
 except:
@@ -33,7 +47,7 @@ except:
 
 # 讀取自選股
 try:
-    df_watch = database.load_watchlist()
+    df_watch = all_data["watchlist"]
     if not df_watch.empty and '股票代號' in df_watch.columns:
         df_watch['股票代號'] = df_watch['股票代號'].astype(str).str.strip()
         groups = ["全部", "庫存持股"]
@@ -48,7 +62,7 @@ except:
     df_watch = pd.DataFrame(columns=['群組', '股票代號', '股票名稱', '警示價_高', '警示價_低', '備註'])
 
 try:
-    df_mp = database.load_mp_table()
+    df_mp = all_data["mp_table"]
 except:
     df_mp = pd.DataFrame()
 
@@ -59,8 +73,14 @@ with st.sidebar:
     st.header("⚙️ 監控設定")
     selected_group = st.selectbox("選擇監控群組", groups)
     
-    auto_refresh = st.toggle("啟用自動刷新 (30秒)", value=False)
-    st.caption("⚠️ 注意：頻繁刷新會消耗 API 額度")
+    streaming = market_data.get_quote_stream() is not None
+    refresh_seconds = 1 if streaming else 30
+    auto_refresh = st.toggle(f"啟用自動刷新 ({refresh_seconds}秒)", value=False)
+    if streaming:
+        stream_status = market_data.get_stream_status()
+        st.caption(f"📡 串流報價{'已連線' if stream_status['connected'] else '連線中...'}：看板刷新不消耗 API 額度")
+    else:
+        st.caption("⚠️ 注意：頻繁刷新會消耗 API 額度")
     
     st.divider()
     st.markdown("### 💡 警示圖示說明")
@@ -76,7 +96,7 @@ with st.sidebar:
 # 3. 核心監控邏輯 (Fragment)
 # ==============================================================================
 
-@st.fragment(run_every=30 if auto_refresh else None)
+@st.fragment(run_every=refresh_seconds if auto_refresh else None)
 def render_monitor_table(selected_group, inventory_list, df_watch, df_mp):
     
     # 1. 決定要監控的股票清單
@@ -96,13 +116,22 @@ def render_monitor_table(selected_group, inventory_list, df_watch, df_mp):
 
     # 2. 抓取資料 (即時報價 + 技術指標)
     try:
-        quotes = market_data.get_batch_detailed_quotes(target_stocks)
-        # 從 Session 讀取 TA 資料
-        ta_data = st.session_state.get("ta_data", {})
+        quotes = market_data.get_live_quotes(target_stocks)
+        # 技術指標走共用快取 (同一交易日每檔只算一次，所有 session / 頁面共用)
+        ta_data = market_data.get_batch_technical_analysis(target_stocks)
     except Exception as e:
         st.error(f"資料抓取失敗: {e}")
         return
 
+    failed = quotes.errors
+    if failed: st.caption("⚠️ 報價失敗: " + ", ".join(f"{s} ({e})" for s, e in failed.items()))
+
+    # 盤中試算 (若現在收盤的月線位置)，使用本地滾動指標狀態，每次刷新幾乎無成本
+    try:
+        previews = market_data.get_intraday_previews(quotes.prices(), dates=quotes.dates())
+    except Exception:
+        previews = {}
+
     # 3. 取得當前時間與倍數 (使用台灣時間)
     tw_now = datetime.utcnow() + timedelta(hours=8)
     current_time_str = tw_now.strftime("%H:%M")
@@ -118,13 +147,14 @@ def render_monitor_table(selected_group, inventory_list, df_watch, df_mp):
     
     # 檢查是否有 TA 資料
     if not ta_data:
-        st.warning("⚠️ 尚未取得「10日均量」資料，量比無法計算。請點擊下方「🔄 更新技術指標」按鈕。")
+        st.warning("⚠️ 無法取得「10日均量」資料，量比無法計算。請確認 Fugle API 金鑰設定。")
 
-    for symbol in target_stocks:
-        quote = quotes.get(symbol, {})
-        price = quote.get('price', 0)
-        chg = quote.get('change_pct', 0)
-        vol = quote.get('volume', 0) # 盤中量 (張)
+    # 報價為與 quotes.symbols 同順序的陣列 (沒有資料的位置 found 為 False)
+    for i, symbol in enumerate(quotes.symbols):
+        has_quote = bool(quotes.found[i])
+        price = float(quotes.price[i]) if has_quote else 0
+        chg = float(quotes.change_pct[i])
+        vol = int(quotes.volume[i]) # 盤中量 (張)
         
         # TA 資料
         ta = ta_data.get(symbol, {})
@@ -188,8 +218,9 @@ def render_monitor_table(selected_group, inventory_list, df_watch, df_mp):
         # C. 技術警示
         if bias > 20: status_icon += "⚠️"
         
-        # 格式化處理
-        price_str = f"{price:,.2f}"
+        # 格式化處理 (報價失敗的股票保留在表格中並標示)
+        price_str = f"{price:,.2f}" if has_quote else "—"
+        if symbol in failed: status_icon += f"❗{failed[symbol]}"
         
         # 漲跌幅
         chg_str = f"{chg*100:.2f}%" if abs(chg) < 1 else f"{chg:.2f}%"
@@ -212,6 +243,12 @@ def render_monitor_table(selected_group, inventory_list, df_watch, df_mp):
             vol_10ma_str = "N/A"
             vol_ratio_str = "-" # 無法計算
 
+        preview = previews.get(symbol)
+        if preview:
+            preview_str = f"{'站上' if price > preview['MA'] else '跌破'} {preview['MA']:,.2f} ({preview['Bias']:+.2f}%)"
+        else:
+            preview_str = "-"
+
         table_rows.append({
             "代號": symbol,
             "名稱": name,
@@ -222,6 +259,7 @@ def render_monitor_table(selected_group, inventory_list, df_watch, df_mp):
             "10日均量": vol_10ma_str,
             "量比": vol_ratio_str,
             "月線乖離率": f"{bias:.2f}%",
+            "收盤試算": preview_str,
             "技術訊號": signal,
             "警示": status_icon
         })
@@ -248,6 +286,7 @@ def render_monitor_table(selected_group, inventory_list, df_watch, df_mp):
                 "10日均量": st.column_config.TextColumn("10日均量", width="small"),
                 "量比": st.column_config.TextColumn("量比", width="small"),
                 "月線乖離率": st.column_config.TextColumn("月線乖離率", width="small"),
+                "收盤試算": st.column_config.TextColumn("收盤試算 (MA20)", width="medium", help="若以現價收盤，月線與乖離率"),
                 "技術訊號": st.column_config.TextColumn("技術訊號", width="medium"),
                 "警示": st.column_config.TextColumn("警示", width="small"),
             },
@@ -255,19 +294,15 @@ def render_monitor_table(selected_group, inventory_list, df_watch, df_mp):
             hide_index=True
         )
         
-        # 手動更新 TA 按鈕
-        if st.button("🔄 更新技術指標 (均線/均量)"):
+        # 強制重新計算 TA (略過共用快取)
+        if st.button("🔄 重新計算技術指標 (均線/均量)"):
             with st.spinner("計算技術指標中 (抓取歷史K線)..."):
-                new_ta = market_data.get_batch_technical_analysis(target_stocks)
-                # 更新 session
-                current_ta = st.session_state.get("ta_data", {})
-                current_ta.update(new_ta)
-                st.session_state["ta_data"] = current_ta
+                market_data.get_batch_technical_analysis(target_stocks, force=True)
                 st.rerun()
                 
         # 除錯資訊區塊
         with st.expander("🛠️ 除錯資訊 (量比計算來源)"):
-            st.info("若量比顯示 0.00，請檢查「現量」或「倍數」是否為 0。若 10日均量 為 N/A，請按上方更新按鈕。")
+            st.info("若量比顯示 0.00，請檢查「現量」或「倍數」是否為 0。若 10日均量 為 N/A，可按上方重新計算按鈕。")
             
             tab_debug1, tab_debug2 = st.tabs(["🔢 量比計算參數明細", "📊 歷史資料 (Vol10來源)"])
             
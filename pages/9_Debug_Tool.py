@@ -3,10 +3,46 @@ import pandas as pd
 from collections import deque
 import database
 import logic
+import market_data
 
 st.set_page_config(page_title="除錯工具", layout="wide", page_icon="🐞")
 st.title("🐞 庫存計算除錯工具")
 
+# 0. 本地鏡像維護
+with st.sidebar:
+    st.header("🗄️ 本地鏡像")
+    if st.button("♻️ 強制整表重新同步", use_container_width=True, help="捨棄本地交易紀錄鏡像並重新下載整張表"):
+        try:
+            database.sync_ledger_mirror(force_full=True)
+            st.success("已重新同步交易紀錄")
+        except Exception as e:
+            st.error(f"同步失敗: {e}")
+
+    st.header("📊 快取命中統計")
+    cache_stats = database.get_cache_stats()
+    if cache_stats:
+        st.dataframe(pd.DataFrame.from_dict(cache_stats, orient="index"), use_container_width=True)
+    else:
+        st.caption("尚無快取紀錄")
+
+    st.header("📈 技術指標快取")
+    ta_stats = market_data.get_ta_cache_stats()
+    st.caption(f"交易日 {ta_stats['day'] or '-'} / {ta_stats['entries']} 檔 / 命中 {ta_stats['hits']} 次 / 未命中 {ta_stats['misses']} 次")
+
+    st.header("🚦 Fugle 請求排程")
+    sched = market_data.get_scheduler_stats()
+    st.caption(f"併發上限 {sched['limit']} / 進行中 {sched['in_flight']} / 排隊 {sched['waiting']} / 429 {sched['rate_limited']} 次 / 互動 {sched['interactive']} / 背景 {sched['background']}")
+    st.dataframe(pd.DataFrame.from_dict(sched["usage"], orient="index").rename(
+        columns={"used": "近1分鐘用量", "budget": "每分鐘額度", "paused": "暫停秒數"}), use_container_width=True)
+
+    st.header("📦 帳本引擎")
+    ledger_stats = logic.get_ledger_engine_stats()
+    st.caption(f"{ledger_stats['transactions']} 筆交易 / {ledger_stats['symbols']} 檔 / 增量套用 {ledger_stats['incremental']} 次 / 整本重建 {ledger_stats['rebuilds']} 次 (向量化 {ledger_stats['vectorized']} 次) / 累計套用 {ledger_stats['applied_rows']} 列")
+
+    st.header("🔌 Fugle 連線池")
+    conn_stats = market_data.get_connection_stats()
+    st.caption(f"請求 {conn_stats['requests']} 次 / 建立連線 {conn_stats['connections']} 條 / 重用 {conn_stats['reused']} 次 / 重試 {conn_stats['retries']} 次 / 失敗 {conn_stats['errors']} 次")
+
 # 1. 讀取資料
 try:
     df_raw = database.load_data()
@@ -14,6 +50,27 @@ except:
     st.error("無法讀取資料庫")
     st.stop()
 
+# 1.5 費用欄位稽核
+with st.expander("🧾 費用欄位稽核 (依目前帳戶折數重算手續費/交易稅/淨收付)"):
+    if st.button("開始稽核", use_container_width=True):
+        df_audit = logic.audit_fees(df_raw, database.get_account_settings())
+        if df_audit.empty:
+            st.success(f"✅ {len(df_raw)} 筆交易的費用欄位皆一致")
+        else:
+            st.warning(f"⚠️ {df_audit['交易ID'].nunique()} 筆交易共 {len(df_audit)} 個欄位與計算規則不一致")
+            st.dataframe(df_audit, use_container_width=True, hide_index=True)
+
+# 1.6 整本重建比對 (逐筆迴圈 vs 向量化)
+with st.expander("🧮 庫存重建比對 (逐筆迴圈 vs fifo_kernel 向量化)"):
+    if st.button("開始比對", use_container_width=True):
+        diffs = logic.check_engine_parity(df_raw)
+        if diffs is None:
+            st.info("帳本含零股小數或負股數，整本重建一律走逐筆迴圈，無需比對")
+        elif not diffs:
+            st.success(f"✅ {len(df_raw)} 筆交易兩種重建結果一致")
+        else:
+            st.error(f"❌ 結果不一致: {', '.join(diffs)}")
+
 # 2. 選擇股票
 all_stocks = df_raw['股票代號'].unique().tolist()
 target_stock = st.selectbox("請選擇要除錯的股票代號", all_stocks, index=all_stocks.index('6567') if '6567' in all_stocks else 0)
@@ -0,0 +1,256 @@
+# ==============================================================================
+# 檔案名稱: quote_stream.py
+#
+# 修改歷程:
+# 2026-10-17 10:00:00: [New] Fugle WebSocket 即時報價串流：背景執行緒維護 process 內的最新報價看板，斷線自動重連並重新訂閱
+# 2026-10-17 13:00:00: [Perf] 報價看板改為欄式 NumPy 陣列 (symbol → slot 對照)，原地更新、一次讀取多檔
+# 2026-10-17 23:20:00: [Fix] 報價保留所屬交易日 (date 欄，YYYYMMDD 整數)，供盤中試算判斷現價是否為已入庫的那根K線
+# ==============================================================================
+
+import json
+import random
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from websockets.sync.client import connect
+
+# --- 常數設定 ---
+FUGLE_WS_URL = "wss://api.fugle.tw/marketdata/v1.0/stock/streaming"
+STREAM_CHANNEL = "aggregates"      # 含最新價、漲跌幅、累計量
+SUBSCRIBE_CHUNK = 50               # 每次訂閱的股票數
+PING_INTERVAL = 20                 # 秒
+RECONNECT_BASE = 1                 # 重連等待基準秒數 (指數退避 + jitter)
+RECONNECT_MAX = 60
+
+class QuoteColumns:
+    """
+    一次讀出的多檔報價 (與輸入 symbols 同順序的陣列)；found 為 False 的位置沒有資料 (price 為 NaN)
+    date 為報價所屬交易日 (YYYYMMDD 整數，0 表示不明)；errors 記錄補抓失敗的股票與原因
+    """
+    def __init__(self, symbols, price, change_pct, volume, updated_at, found, errors=None, date=None):
+        self.symbols = list(symbols)
+        self.price, self.change_pct, self.volume = price, change_pct, volume
+        self.updated_at, self.found = updated_at, found
+        self.date = date if date is not None else np.zeros(len(self.symbols), dtype=np.int64)
+        self.errors = errors or {}
+
+    @classmethod
+    def from_quotes(cls, symbols, quotes):
+        """由 {symbol: quote dict} 建立 (REST 報價用)"""
+        symbols = list(symbols)
+        rows = [quotes.get(s) for s in symbols]
+        return cls(
+            symbols,
+            np.array([q["price"] if q else np.nan for q in rows], dtype=np.float64),
+            np.array([q["change_pct"] if q else 0.0 for q in rows], dtype=np.float64),
+            np.array([q["volume"] if q else 0 for q in rows], dtype=np.int64),
+            np.full(len(symbols), time.time()),
+            np.array([q is not None for q in rows], dtype=bool),
+            dict(getattr(quotes, "errors", {})),
+            np.array([_date_code(q.get("date")) if q else 0 for q in rows], dtype=np.int64),
+        )
+
+    def prices(self):
+        """{symbol: 最新價} (只含有資料的股票)"""
+        return {s: float(p) for s, p, ok in zip(self.symbols, self.price, self.found) if ok}
+
+    def dates(self):
+        """{symbol: 報價所屬交易日 "YYYY-MM-DD"} (只含有資料且交易日已知的股票)"""
+        return {s: f"{d // 10000:04d}-{d // 100 % 100:02d}-{d % 100:02d}"
+                for s, d, ok in zip(self.symbols, self.date.tolist(), self.found) if ok and d}
+
+def _date_code(value):
+    """"2025-06-02" (或含時間的 ISO 字串) → 20250602；無法辨識時為 0"""
+    digits = str(value or "")[:10].replace("-", "")
+    return int(digits) if len(digits) == 8 and digits.isdigit() else 0
+
+class QuoteBoard:
+    """
+    欄式最新報價看板：price / change_pct / volume / updated_at 各為一條 NumPy 陣列，
+    以 symbol → slot 對照定位；更新直接寫入陣列 (不重建 dict)，讀取時以索引陣列一次取出多檔
+    容量不足時倍增 (只在新增股票時發生)，多執行緒共用
+    """
+    def __init__(self, capacity=256):
+        self.slots = {}
+        self.price = np.full(capacity, np.nan)
+        self.change_pct = np.zeros(capacity)
+        self.volume = np.zeros(capacity, dtype=np.int64)
+        self.updated_at = np.zeros(capacity)
+        self.date = np.zeros(capacity, dtype=np.int64)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _grow(self):
+        extra = len(self.price)
+        self.price = np.concatenate([self.price, np.full(extra, np.nan)])
+        self.change_pct = np.concatenate([self.change_pct, np.zeros(extra)])
+        self.volume = np.concatenate([self.volume, np.zeros(extra, dtype=np.int64)])
+        self.updated_at = np.concatenate([self.updated_at, np.zeros(extra)])
+        self.date = np.concatenate([self.date, np.zeros(extra, dtype=np.int64)])
+
+    def _slot(self, symbol):
+        slot = self.slots.get(symbol)
+        if slot is None:
+            slot = len(self.slots)
+            if slot >= len(self.price): self._grow()
+            self.slots[symbol] = slot
+        return slot
+
+    def update(self, symbol, quote):
+        with self.lock:
+            i = self._slot(symbol)
+            if "price" in quote: self.price[i] = quote["price"]
+            if "change_pct" in quote: self.change_pct[i] = quote["change_pct"]
+            if "volume" in quote: self.volume[i] = quote["volume"]
+            if quote.get("date"): self.date[i] = _date_code(quote["date"])
+            self.updated_at[i] = time.time()
+
+    def read(self, symbols):
+        """一次讀出多檔，回傳 QuoteColumns (順序同 symbols)"""
+        symbols = list(symbols)
+        with self.lock:
+            idx = np.fromiter((self.slots.get(s, -1) for s in symbols), dtype=np.int64, count=len(symbols))
+            found = idx >= 0
+            safe = np.where(found, idx, 0)
+            return QuoteColumns(
+                symbols,
+                np.where(found, self.price[safe], np.nan),
+                np.where(found, self.change_pct[safe], 0.0),
+                np.where(found, self.volume[safe], 0),
+                np.where(found, self.updated_at[safe], 0.0),
+                found,
+                date=np.where(found, self.date[safe], 0),
+            )
+
+    def get(self, symbols):
+        """回傳 {symbol: quote dict} (看板上沒有的股票不在結果中)"""
+        cols = self.read(symbols)
+        return {
+            s: {"price": float(cols.price[i]), "change_pct": float(cols.change_pct[i]), "volume": int(cols.volume[i]),
+                "last_updated": datetime.fromtimestamp(cols.updated_at[i]).strftime('%H:%M:%S')}
+            for i, s in enumerate(cols.symbols) if cols.found[i]
+        }
+
+    def age(self, symbol):
+        """距最後更新的秒數 (沒有資料回傳 None)"""
+        with self.lock:
+            slot = self.slots.get(symbol)
+            return time.time() - self.updated_at[slot] if slot is not None else None
+
+def parse_aggregate(data):
+    """aggregates 頻道訊息 → 與 get_detailed_quote 相同的欄位；沒有價格時回傳 None"""
+    price = data.get('closePrice') or data.get('lastPrice')
+    if not price: return None
+    total = data.get('total') or {}
+    return {
+        "price": float(price),
+        "change_pct": float(data.get('changePercent') or 0),
+        "volume": int(total.get('tradeVolume') or 0),
+        "date": data.get('date'),
+        "last_updated": datetime.now().strftime('%H:%M:%S')
+    }
+
+class QuoteStream(threading.Thread):
+    """
+    背景執行緒：連線 → 驗證 → 訂閱 → 持續把報價寫進 board
+    斷線時以指數退避 + jitter 重連，並重新訂閱所有已登記的股票
+    """
+    def __init__(self, api_key, url=FUGLE_WS_URL, board=None):
+        super().__init__(daemon=True, name="quote-stream")
+        self.api_key = api_key
+        self.url = url
+        self.board = board or QuoteBoard()
+        self.symbols = set()
+        self.subscribed = set()
+        self.lock = threading.Lock()
+        self.ws = None
+        self.connected = False
+        self.stopped = threading.Event()
+        self.stats = {"connects": 0, "messages": 0, "last_error": None, "last_message_at": None}
+
+    # --- 對外介面 ---
+    def subscribe(self, symbols):
+        """登記要追蹤的股票；已連線時立即送出訂閱，否則在連線後送出"""
+        with self.lock:
+            new = [s for s in dict.fromkeys(symbols) if s not in self.symbols]
+            self.symbols.update(new)
+        if new and self.connected:
+            try: self._send_subscribe(new)
+            except Exception as e: self.stats["last_error"] = str(e)
+
+    def stop(self):
+        self.stopped.set()
+        if self.ws:
+            try: self.ws.close()
+            except Exception: pass
+
+    # --- 內部 ---
+    def _send(self, event, data=None):
+        message = {"event": event}
+        if data is not None: message["data"] = data
+        self.ws.send(json.dumps(message))
+
+    def _send_subscribe(self, symbols):
+        with self.lock:
+            symbols = [s for s in symbols if s not in self.subscribed]
+            for i in range(0, len(symbols), SUBSCRIBE_CHUNK):
+                self._send("subscribe", {"channel": STREAM_CHANNEL, "symbols": symbols[i:i + SUBSCRIBE_CHUNK]})
+            self.subscribed.update(symbols)
+
+    def _handle(self, raw):
+        message = json.loads(raw)
+        event = message.get("event")
+        if event == "data":
+            data = message.get("data") or {}
+            quote = parse_aggregate(data)
+            if quote and data.get("symbol"):
+                self.board.update(str(data["symbol"]), quote)
+                self.stats["messages"] += 1
+                self.stats["last_message_at"] = time.time()
+        elif event == "error":
+            self.stats["last_error"] = str(message.get("data"))
+
+    def _session(self):
+        with connect(self.url, open_timeout=10) as ws:
+            self.ws = ws
+            self._send("auth", {"apikey": self.api_key})
+            reply = json.loads(ws.recv(timeout=10))
+            if reply.get("event") != "authenticated":
+                raise Exception(f"驗證失敗: {reply.get('data')}")
+            with self.lock:
+                self.subscribed = set()
+                symbols = list(self.symbols)
+                self.connected = True
+            self.stats["connects"] += 1
+            self._send_subscribe(symbols)
+
+            last_ping = time.time()
+            while not self.stopped.is_set():
+                try:
+                    self._handle(ws.recv(timeout=1))
+                except TimeoutError:
+                    pass
+                if time.time() - last_ping > PING_INTERVAL:
+                    self._send("ping")
+                    last_ping = time.time()
+
+    def run(self):
+        failures = 0
+        while not self.stopped.is_set():
+            started = time.time()
+            try:
+                self._session()
+            except Exception as e:
+                self.stats["last_error"] = str(e) or type(e).__name__
+            finally:
+                self.connected = False
+                self.ws = None
+            if self.stopped.is_set(): break
+            # 連線撐過一段時間才重置退避
+            failures = 0 if time.time() - started > RECONNECT_MAX else failures + 1
+            delay = min(RECONNECT_MAX, RECONNECT_BASE * (2 ** failures)) + random.uniform(0, RECONNECT_BASE)
+            self.stopped.wait(delay)
@@ -0,0 +1,200 @@
+# ==============================================================================
+# 檔案名稱: storage.py
+#
+# 修改歷程:
+# 2026-10-17 23:00:00: [New] 新增 revision()：整份試算表的修改版本 (Google 為 Drive modifiedTime，本地為寫入計數)，任何儲存格變動都會改變
+# 2026-10-16 18:00:00: [New] 儲存後端介面：Google Sheets 實作 + 本地記憶體實作 (可模擬延遲/配額錯誤，支援離線模式)
+# ==============================================================================
+
+import os
+import re
+import csv
+import time
+import random
+import threading
+from collections import deque
+
+# 六張工作表 (名稱與 database.py 常數一致)
+SHEET_NAMES = ['交易紀錄', 'INDEX', '交割帳戶設定', '資產歷史紀錄', '自選股清單', 'mp_table']
+
+class StorageError(Exception):
+    """後端暫時性錯誤 (逾時、連線中斷)，呼叫端可重試"""
+
+class QuotaExceededError(StorageError):
+    """超過讀寫配額 (HTTP 429)"""
+
+# --- A1 範圍解析 ---
+_A1_RE = re.compile(r'^([A-Z]*)(\d*)$')
+
+def _col_to_index(letters):
+    n = 0
+    for ch in letters: n = n * 26 + (ord(ch) - ord('A') + 1)
+    return n
+
+def parse_a1(a1):
+    """
+    將 A1 範圍轉為 (起始列, 起始欄, 結束列, 結束欄)，皆從 1 起算，None 表示開放
+    支援: None (整張表)、"A5"、"A2:O9"、"A2:B" (列不設上限)、"A:A"、"1:1"
+    """
+    if not a1: return 1, 1, None, None
+    start, _, end = a1.upper().partition(':')
+    end = end or start
+    (c1, r1), (c2, r2) = _A1_RE.match(start).groups(), _A1_RE.match(end).groups()
+    return (int(r1) if r1 else 1, _col_to_index(c1) if c1 else 1,
+            int(r2) if r2 else None, _col_to_index(c2) if c2 else None)
+
+def _trim(rows):
+    """比照 Google Sheets API：去除每列尾端空白格與表格尾端空白列"""
+    out = []
+    for r in rows:
+        r = list(r)
+        while r and r[-1] in ("", None): r.pop()
+        out.append(r)
+    while out and not out[-1]: out.pop()
+    return out
+
+# --- 介面 ---
+class StorageBackend:
+    """
+    六張工作表的存取介面，database.py 只透過這些方法存取資料
+    - batch_get(ranges): ranges 為 [(工作表, A1 或 None)]，一次往返取回 [values, ...]
+    - batch_update(sheet_name, data): data 為 [{"range": A1, "values": [[...]]}]，一次往返寫入
+    - revision(): 整份試算表的修改版本字串 (任一儲存格變動都會改變)，不支援時回傳 None
+    values 一律為字串二維陣列，尾端空白格/空白列省略 (與 Google Sheets API 相同)
+    """
+    name = "base"
+
+    def batch_get(self, ranges):
+        raise NotImplementedError
+
+    def batch_update(self, sheet_name, data):
+        raise NotImplementedError
+
+    def revision(self):
+        return None
+
+# --- Google Sheets ---
+class GoogleSheetsBackend(StorageBackend):
+    name = "google"
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def _call(self, fn, *args, **kwargs):
+        from gspread.exceptions import APIError
+        try:
+            return fn(*args, **kwargs)
+        except APIError as e:
+            if getattr(e.response, "status_code", None) == 429:
+                raise QuotaExceededError(str(e)) from e
+            raise
+
+    def batch_get(self, ranges):
+        from gspread.utils import absolute_range_name
+        if not ranges: return []
+        resp = self._call(self.spreadsheet.values_batch_get,
+                          [absolute_range_name(name, rng) for name, rng in ranges])
+        return [vr.get("values", []) for vr in resp.get("valueRanges", [])]
+
+    def batch_update(self, sheet_name, data):
+        from gspread.utils import absolute_range_name
+        body = {
+            "valueInputOption": "RAW",
+            "data": [{"range": absolute_range_name(sheet_name, d["range"]), "values": d["values"]} for d in data],
+        }
+        return self._call(self.spreadsheet.values_batch_update, body)
+
+    def revision(self):
+        """Drive 檔案的 modifiedTime (需 drive 權限)，只取中繼資料，不讀儲存格"""
+        return self._call(self.spreadsheet.get_lastUpdateTime)
+
+# --- 本地記憶體 (離線模式 / 壓力測試) ---
+class MemoryBackend(StorageBackend):
+    """
+    以記憶體中的二維陣列模擬六張工作表
+    latency:          每次呼叫的固定延遲 (秒)，jitter 為額外隨機延遲上限
+    quota_per_minute: 每分鐘呼叫上限，超過時拋出 QuotaExceededError (None 表示不限制)
+    error_rate:       隨機拋出 StorageError 的機率 (模擬逾時)
+    data_dir:         指定時從 <data_dir>/<工作表>.csv 載入，寫入後也存回 CSV (離線模式)
+    """
+    name = "local"
+
+    def __init__(self, sheets=None, latency=0.0, jitter=0.0, quota_per_minute=None, error_rate=0.0,
+                 data_dir=None, seed=None):
+        self.sheets = {n: [list(r) for r in (sheets or {}).get(n, [])] for n in SHEET_NAMES}
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_per_minute = quota_per_minute
+        self.error_rate = error_rate
+        self.data_dir = data_dir
+        self.stats = {"reads": 0, "writes": 0, "quota_errors": 0, "errors": 0}
+        self._revision = 0
+        self._calls = deque()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        if data_dir: self._load_dir(data_dir)
+
+    def _load_dir(self, data_dir):
+        for name in SHEET_NAMES:
+            path = os.path.join(data_dir, f"{name}.csv")
+            if os.path.exists(path):
+                with open(path, newline="", encoding="utf-8-sig") as f:
+                    self.sheets[name] = [list(r) for r in csv.reader(f)]
+
+    def _save_sheet(self, name):
+        os.makedirs(self.data_dir, exist_ok=True)
+        with open(os.path.join(self.data_dir, f"{name}.csv"), "w", newline="", encoding="utf-8-sig") as f:
+            csv.writer(f).writerows(self.sheets[name])
+
+    def _simulate(self, quota=True):
+        """依設定模擬網路延遲、配額與隨機錯誤 (quota=False: 不計入 Sheets 讀寫配額)"""
+        delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay: time.sleep(delay)
+        if not quota: return
+        with self._lock:
+            now = time.time()
+            while self._calls and now - self._calls[0] > 60: self._calls.popleft()
+            if self.quota_per_minute is not None and len(self._calls) >= self.quota_per_minute:
+                self.stats["quota_errors"] += 1
+                raise QuotaExceededError("429: Quota exceeded (simulated)")
+            self._calls.append(now)
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.stats["errors"] += 1
+                raise StorageError("Request timed out (simulated)")
+
+    def _read(self, sheet_name, a1):
+        rows = self.sheets.get(sheet_name, [])
+        r1, c1, r2, c2 = parse_a1(a1)
+        r2 = r2 or len(rows)
+        out = []
+        for r in range(r1, r2 + 1):
+            row = rows[r - 1] if r - 1 < len(rows) else []
+            out.append([str(v) for v in row[c1 - 1:c2]])
+        return _trim(out)
+
+    def batch_get(self, ranges):
+        self._simulate()
+        with self._lock:
+            self.stats["reads"] += 1
+            return [self._read(name, a1) for name, a1 in ranges]
+
+    def batch_update(self, sheet_name, data):
+        self._simulate()
+        with self._lock:
+            self.stats["writes"] += 1
+            self._revision += 1
+            rows = self.sheets.setdefault(sheet_name, [])
+            for d in data:
+                r1, c1, _, _ = parse_a1(d["range"])
+                for i, values in enumerate(d["values"]):
+                    while len(rows) < r1 + i: rows.append([])
+                    row = rows[r1 + i - 1]
+                    row.extend([""] * (c1 - 1 + len(values) - len(row)))
+                    row[c1 - 1:c1 - 1 + len(values)] = [str(v) for v in values]
+            if self.data_dir: self._save_sheet(sheet_name)
+
+    def revision(self):
+        """寫入計數；對應 Drive 中繼資料，不佔 Sheets 配額，只模擬延遲"""
+        self._simulate(quota=False)
+        with self._lock:
+            return str(self._revision)
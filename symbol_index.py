@@ -0,0 +1,85 @@
+# ==============================================================================
+# 檔案名稱: symbol_index.py
+#
+# 修改歷程:
+# 2026-10-16 17:00:00: [New] 股票代號/名稱搜尋索引 (前綴: 排序陣列 + bisect；子字串: n-gram 倒排索引)
+# ==============================================================================
+
+from bisect import bisect_left
+
+class SymbolIndex:
+    """
+    建立一次、之後唯讀的股票搜尋索引 (約 2,000 檔台股，查詢在 1 毫秒內)
+    - 代號/名稱前綴：排序後的陣列 + bisect
+    - 代號/名稱子字串：單字與雙字 (1-gram / 2-gram) 倒排索引，取交集後再確認
+    """
+    def __init__(self, stock_map):
+        self.entries = sorted((str(code).strip(), str(name).strip()) for code, name in stock_map.items())
+        self._by_code = {code: i for i, (code, _) in enumerate(self.entries)}
+        self._by_code_lower = {code.lower(): i for i, (code, _) in enumerate(self.entries)}
+        self._codes = [code.lower() for code, _ in self.entries]
+        # 名稱可能重複，保留 (名稱, 序號) 以便 bisect
+        self._names = sorted((name.lower(), i) for i, (_, name) in enumerate(self.entries))
+        self._grams = {}
+        for i, (code, name) in enumerate(self.entries):
+            for text in (code.lower(), name.lower()):
+                for gram in self._ngrams(text):
+                    self._grams.setdefault(gram, set()).add(i)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _ngrams(text):
+        grams = set(text)
+        grams.update(text[i:i + 2] for i in range(len(text) - 1))
+        return grams
+
+    @staticmethod
+    def _prefix(keys, lo_key, hi_key):
+        """keys 已排序；回傳介於 [lo_key, hi_key) 的項目位置範圍"""
+        return bisect_left(keys, lo_key), bisect_left(keys, hi_key)
+
+    def lookup(self, code):
+        """完全比對代號，回傳名稱 (找不到回傳空字串)"""
+        i = self._by_code.get(str(code).strip())
+        return self.entries[i][1] if i is not None else ""
+
+    def search(self, query, limit=10):
+        """
+        依序回傳：代號完全相符、代號前綴、名稱前綴、代號或名稱包含 query
+        回傳 list of (代號, 名稱)
+        """
+        q = str(query).strip().lower()
+        if not q: return []
+        hits = []
+        seen = set()
+
+        def add(i):
+            if i not in seen:
+                seen.add(i)
+                hits.append(i)
+            return len(hits) >= limit
+
+        exact = self._by_code_lower.get(q)
+        if exact is not None and add(exact): return self._result(hits)
+        lo, hi = self._prefix(self._codes, q, q + "\uffff")
+        for i in range(lo, hi):
+            if add(i): return self._result(hits)
+        lo, hi = self._prefix(self._names, (q, -1), (q + "\uffff", -1))
+        for _, i in self._names[lo:hi]:
+            if add(i): return self._result(hits)
+
+        grams = [self._grams.get(g, set()) for g in self._query_grams(q)]
+        if grams:
+            for i in sorted(set.intersection(*grams)):
+                code, name = self.entries[i]
+                if q in code.lower() or q in name.lower():
+                    if add(i): break
+        return self._result(hits)
+
+    def _query_grams(self, q):
+        return [q] if len(q) == 1 else [q[i:i + 2] for i in range(len(q) - 1)]
+
+    def _result(self, hits):
+        return [self.entries[i] for i in hits]
@@ -0,0 +1,77 @@
+# ==============================================================================
+# 檔案名稱: tests/test_quote_stream.py
+#
+# 修改歷程:
+# 2026-10-17 23:55:00: [New] QuoteStream 對 fake_quote_server 的整合測試：斷線後重連並重新訂閱、驗證失敗狀態
+# ==============================================================================
+# 用法: python -m pytest -q tests
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import quote_stream
+from fake_quote_server import FakeQuoteServer
+
+API_KEY = "test-key"
+
+def _wait_until(predicate, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate(): return True
+        time.sleep(0.05)
+    return False
+
+@pytest.fixture
+def fast_reconnect(monkeypatch):
+    # 重連退避縮短到 0.05 秒，測試不必等待正式的 1~60 秒
+    monkeypatch.setattr(quote_stream, "RECONNECT_BASE", 0.05)
+    monkeypatch.setattr(quote_stream, "RECONNECT_MAX", 0.2)
+
+def _start(server, api_key):
+    url = server.start()
+    stream = quote_stream.QuoteStream(api_key, url)
+    stream.start()
+    return stream
+
+def test_reconnects_and_resubscribes_after_drop(fast_reconnect):
+    server = FakeQuoteServer(port=0, interval=0.05, drop_every=0.5, api_key=API_KEY, seed=0)
+    stream = _start(server, API_KEY)
+    try:
+        stream.subscribe(["2330", "0050"])
+        assert _wait_until(lambda: stream.board.read(["2330", "0050"]).found.all())
+
+        # 伺服器主動斷線後，串流應自行重連並再次送出訂閱
+        assert _wait_until(lambda: stream.stats["connects"] >= 2 and server.stats["subscribe_events"] >= 2)
+        assert stream.subscribed == {"2330", "0050"}
+
+        # 重連後看板持續更新 (新連線推送的報價)
+        before = stream.board.read(["2330"]).updated_at[0]
+        assert _wait_until(lambda: stream.board.read(["2330"]).updated_at[0] > before)
+
+        # 重連之後才登記的股票也會被訂閱
+        stream.subscribe(["2317"])
+        assert _wait_until(lambda: stream.board.read(["2317"]).found[0])
+    finally:
+        stream.stop()
+        server.stop()
+
+def test_bad_auth_reports_error_and_stays_disconnected(fast_reconnect):
+    server = FakeQuoteServer(port=0, interval=0.05, api_key=API_KEY, seed=0)
+    stream = _start(server, "wrong-key")
+    try:
+        stream.subscribe(["2330"])
+        assert _wait_until(lambda: "驗證失敗" in str(stream.stats["last_error"]))
+        # 驗證失敗持續重試 (退避)，但從未建立可用連線，也沒有送出訂閱
+        assert _wait_until(lambda: server.stats["connections"] >= 2)
+        assert not stream.connected
+        assert stream.stats["connects"] == 0
+        assert server.stats["subscribe_events"] == 0
+        assert not stream.board.read(["2330"]).found[0]
+    finally:
+        stream.stop()
+        server.stop()